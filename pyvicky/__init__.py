@@ -2,7 +2,15 @@ from pyvicky.argparser import Argparser
 from pyvicky.logger import Logger
 from pyvicky.window import Window, DirectoriesTreeView, TabView
 from pyvicky.numberbar import QAutoComplete, QCodeEditor, QLineNumberArea
-from pyvicky.highlighter import BaseHighlighter, PythonHighlighter
+from pyvicky.decorations import SelectionLayers
+from pyvicky.identifiers import IdentifierIndex, DocumentIndex
+from pyvicky.highlighter import BaseHighlighter, PythonHighlighter, CppHighlighter
+from pyvicky.languages import Language
 from pyvicky.find import Find
+from pyvicky.find_in_files import FindInFiles
+from pyvicky.find_terms import FindTerms
+from pyvicky.loader import FileLoader, LoadingBar
+from pyvicky.large_file import MappedFile, LargeFileView
+from pyvicky.saver import FileSaver
 from pyvicky.preferences import PreferencesDlg
 from pyvicky.interpreter_dialog import InterpreterDlg
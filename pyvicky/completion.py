@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+from PyQt5.QtCore import QObject, QProcess, QTimer
+from PyQt5.QtWidgets import QApplication
+from PyQt5 import sip
+
+import json
+import logging
+import os
+import sys
+import weakref
+
+from pyvicky import jedi_worker
+
+WORKER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jedi_worker.py')
+
+jedi_completion = None
+
+
+def get_jedi_completion():
+    """
+    :return: JediCompletion, which is shared by all editors
+    """
+    global jedi_completion
+    if jedi_completion is None:
+        jedi_completion = JediCompletion()
+    return jedi_completion
+
+
+def forget_editor(editor):
+    """
+    drops the requests of the editor of a closed or hibernated tab
+    """
+    if jedi_completion is not None:
+        jedi_completion.forget(editor)
+
+
+class JediCompletion(QObject):
+    """
+    Python completion by jedi in a persistent worker process (jedi_worker.py), which keeps the caches of jedi warm.
+    Keystrokes are coalesced: a request is sent after a short pause in typing,
+    and only the reply to the last sent request is passed to the editor.
+    """
+    # Pause after a keystroke before the request is sent (milliseconds)
+    DEBOUNCE_TIME = 50
+
+    def __init__(self):
+        super(JediCompletion, self).__init__()
+        self.process = None
+        self.available = True
+        self.buffer = b''
+        self.requestId = 0
+        # (editor, position of the cursor, prefix) of the request, which waits for the pause in typing
+        self.pending = None
+        # (id, editor, position, prefix) of the last sent request
+        self.latest = None
+        # editors, whose destroyed signal drops their requests
+        self.editors = weakref.WeakSet()
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.send)
+        QApplication.instance().aboutToQuit.connect(self.stop_process)
+
+    def request(self, editor, prefix):
+        """
+        asks for the completions at the cursor of the editor, the previous request is superseded
+        :param editor: QCodeEditor, its on_context_completions is called with the reply
+        :param prefix: part of the word before the cursor
+        :return:
+        """
+        if not self.available:
+            return
+        if editor not in self.editors:
+            self.editors.add(editor)
+            editor.destroyed.connect(self.on_editor_destroyed)
+        self.pending = (editor, editor.textCursor().position(), prefix)
+        self.timer.start(self.DEBOUNCE_TIME)
+
+    def forget(self, editor):
+        """
+        drops the requests of the editor, before it is deleted
+        """
+        if self.pending is not None and self.pending[0] is editor:
+            self.pending = None
+            self.timer.stop()
+        if self.latest is not None and self.latest[1] is editor:
+            self.latest = None
+
+    def on_editor_destroyed(self):
+        # the tab was closed or hibernated, its requests mustn't touch the deleted editor
+        if self.pending is not None and sip.isdeleted(self.pending[0]):
+            self.pending = None
+            self.timer.stop()
+        if self.latest is not None and sip.isdeleted(self.latest[1]):
+            self.latest = None
+
+    def start_process(self):
+        self.process = QProcess(self)
+        self.process.readyReadStandardOutput.connect(self.on_ready_read)
+        self.process.readyReadStandardError.connect(self.on_error_output)
+        self.process.finished.connect(self.on_finished)
+        self.process.start(sys.executable, [WORKER_PATH])
+        logging.info('Started jedi worker')
+
+    def stop_process(self):
+        if self.process is not None:
+            self.process.finished.disconnect(self.on_finished)
+            self.process.kill()
+            self.process.waitForFinished(1000)
+            self.process = None
+
+    def send(self):
+        if self.pending is None:
+            return
+        editor, position, prefix = self.pending
+        self.pending = None
+        if sip.isdeleted(editor):
+            return
+        if self.process is None:
+            self.start_process()
+        block = editor.document().findBlock(position)
+        self.requestId += 1
+        self.latest = (self.requestId, editor, position, prefix)
+        message = {'id': self.requestId,
+                   'source': editor.toPlainText(),
+                   'path': editor.filePath,
+                   'line': block.blockNumber() + 1,
+                   'column': position - block.position()}
+        self.process.write((json.dumps(message) + '\n').encode())
+
+    def on_ready_read(self):
+        self.buffer += bytes(self.process.readAllStandardOutput())
+        while b'\n' in self.buffer:
+            line, self.buffer = self.buffer.split(b'\n', 1)
+            reply = json.loads(line.decode())
+            if self.latest is None or reply['id'] != self.latest[0]:
+                # the reply to a superseded request
+                continue
+            _, editor, position, prefix = self.latest
+            self.latest = None
+            if sip.isdeleted(editor):
+                continue
+            editor.on_context_completions(position, prefix, [name for name, _ in reply['completions']])
+
+    def on_error_output(self):
+        logging.error(bytes(self.process.readAllStandardError()).decode(errors='replace').strip())
+
+    def on_finished(self, exit_code, exit_status):
+        if exit_code == jedi_worker.NO_JEDI:
+            logging.info('jedi is not installed, Python completion is disabled')
+            self.available = False
+        else:
+            logging.error('jedi worker stopped with code {}'.format(exit_code))
+        # the worker is started again with the next request
+        self.process = None
+        self.buffer = b''
+        self.latest = None
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QTextEdit
+from PyQt5.QtGui import QTextCursor
+
+import logging
+
+# Layers from the bottom to the top, the later layer is drawn over the earlier one
+LAYERS = ('diagnostics', 'search', 'brackets')
+
+
+def make_selection(document, start, end, text_format):
+    """
+    :param document: QTextDocument
+    :param start: position of the first character
+    :param end: position after the last character
+    :param text_format: QTextCharFormat
+    :return: QTextEdit.ExtraSelection
+    """
+    selection = QTextEdit.ExtraSelection()
+    cursor = QTextCursor(document)
+    cursor.setPosition(start)
+    cursor.setPosition(end, QTextCursor.KeepAnchor)
+    selection.cursor = cursor
+    selection.format = text_format
+    return selection
+
+
+def selection_key(selection):
+    return selection.cursor.selectionStart(), selection.cursor.selectionEnd(), selection.format
+
+
+class SelectionLayers:
+    """
+    Extra selections of an editor, split into named layers.
+    Every layer is kept as it was built, so changing one layer doesn't rebuild the others.
+    A layer, which is set to the same selections, doesn't touch the editor,
+    changes of several layers in one event loop iteration are applied with one setExtraSelections call.
+    """
+    def __init__(self, editor):
+        self.editor = editor
+        self.layers = {name: [] for name in LAYERS}
+        # layer name -> selection keys, to compare the new selections with
+        self.keys = {name: [] for name in LAYERS}
+        self.applyTimer = QTimer(editor)
+        self.applyTimer.setSingleShot(True)
+        self.applyTimer.timeout.connect(self.apply)
+
+    def set_layer(self, name, selections):
+        """
+        replaces the selections of the layer
+        :param name: name from LAYERS
+        :param selections: list of QTextEdit.ExtraSelection
+        :return: True, if the layer has changed
+        """
+        keys = [selection_key(selection) for selection in selections]
+        if keys == self.keys[name]:
+            return False
+        self.layers[name] = list(selections)
+        self.keys[name] = keys
+        if not self.applyTimer.isActive():
+            self.applyTimer.start(0)
+        return True
+
+    def clear_layer(self, name):
+        return self.set_layer(name, [])
+
+    def get_layer(self, name):
+        return list(self.layers[name])
+
+    def apply(self):
+        self.applyTimer.stop()
+        selections = []
+        for name in LAYERS:
+            selections += self.layers[name]
+        self.editor.setExtraSelections(selections)
+        logging.debug('Applied {} extra selections'.format(len(selections)))
@@ -0,0 +1,448 @@
+# -*- coding: utf-8 -*-
+"""
+Search and replace in the files of a directory tree.
+search_files, preview_replace and replace_files run in the worker processes of find_in_files,
+so this module doesn't use Qt.
+"""
+
+from contextlib import contextmanager
+import mmap
+import os
+import re
+import stat
+import tempfile
+
+# Files in one task of a worker process
+BATCH_FILES = 32
+# Directories, which are never searched
+SKIP_DIRS = {'.git', '.hg', '.svn', '__pycache__'}
+# Files of this size and bigger are read through mmap instead of being copied into memory
+MMAP_SIZE = 1 << 20
+# A NUL byte at the start of the file marks it as binary
+BINARY_CHECK_SIZE = 8192
+# Limits of one file, so that a minified or generated file doesn't flood the results
+MAX_FILE_MATCHES = 1000
+MAX_LINE_LENGTH = 300
+# Lines of the diff of one file in the preview of a replacement
+MAX_PREVIEW_LINES = 200
+# Mode bits, which a new file doesn't get, it can only be read by setting it, so it is read once
+UMASK = os.umask(0o022)
+os.umask(UMASK)
+
+
+def make_pattern(query, regex=False, case_sensitive=False, whole_words=False):
+    """
+    :param query: text or regular expression
+    :param regex: the query is a regular expression, otherwise it is searched literally
+    :param case_sensitive: case sensitive search
+    :param whole_words: the match must not be a part of a longer word
+    :return: source and flags of the pattern for bytes, re.error is raised for a wrong regex
+    """
+    source = query if regex else re.escape(query)
+    if whole_words:
+        source = r'(?<!\w)(?:' + source + r')(?!\w)'
+    flags = re.MULTILINE if case_sensitive else re.MULTILINE | re.I
+    source = source.encode('utf-8')
+    # The files are searched as bytes: non-ASCII letters are matched exactly, \w and re.I are ASCII only
+    re.compile(source, flags)
+    return source, flags
+
+
+def translate_ignore(pattern):
+    """
+    :param pattern: glob of .gitignore without the leading '!' and the trailing '/'
+    :return: regular expression for a path relative to the directory of the .gitignore file
+    """
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+    result = []
+    index = 0
+    while index < len(pattern):
+        if pattern.startswith('**/', index):
+            result.append('(?:.*/)?')
+            index += 3
+        elif pattern.startswith('**', index):
+            result.append('.*')
+            index += 2
+        elif pattern[index] == '*':
+            result.append('[^/]*')
+            index += 1
+        elif pattern[index] == '?':
+            result.append('[^/]')
+            index += 1
+        elif pattern[index] == '[' and ']' in pattern[index + 2:]:
+            end = pattern.index(']', index + 2)
+            result.append('[' + pattern[index + 1:end].replace('!', '^', 1) + ']')
+            index = end + 1
+        else:
+            result.append(re.escape(pattern[index]))
+            index += 1
+    # a pattern without a slash matches the name at any depth
+    return ('^' if anchored else '(?:^|/)') + ''.join(result) + '$'
+
+
+class IgnoreRules:
+    """
+    Patterns of the .gitignore files of a directory and of its parents.
+    As in git, the last matching pattern decides, and '!' patterns include the path again.
+    """
+    def __init__(self, rules=()):
+        # (directory of the .gitignore, compiled pattern, negated, only directories)
+        self.rules = tuple(rules)
+
+    def read(self, directory):
+        """
+        :param directory: directory, which is entered by the walk
+        :return: rules of the directory, self, if it has no .gitignore
+        """
+        try:
+            with open(os.path.join(directory, '.gitignore'), 'r', encoding='utf-8', errors='replace') as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return self
+        rules = list(self.rules)
+        for line in lines:
+            line = line.rstrip()
+            if not line or line.startswith('#'):
+                continue
+            negated = line.startswith('!')
+            if negated:
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            if line:
+                rules.append((directory, re.compile(translate_ignore(line)), negated, dir_only))
+        return IgnoreRules(rules)
+
+    def ignored(self, path, is_dir):
+        result = False
+        for directory, pattern, negated, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if pattern.search(path[len(directory) + 1:]):
+                result = not negated
+        return result
+
+
+def walk(root, stopped=None):
+    """
+    generates the paths of the files under the root, which are not skipped or ignored
+    :param root: directory
+    :param stopped: threading.Event, the walk ends, when it is set
+    :return:
+    """
+    for entry in walk_entries(root, stopped):
+        yield entry.path
+
+
+def walk_entries(root, stopped=None):
+    """
+    the same as walk, but generates os.DirEntry objects, their stat() is cached
+    """
+    stack = [(root.rstrip('/') or '/', IgnoreRules())]
+    while stack:
+        if stopped is not None and stopped.is_set():
+            return
+        directory, rules = stack.pop()
+        rules = rules.read(directory)
+        try:
+            entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+        except OSError:
+            continue
+        subdirectories = []
+        for entry in entries:
+            try:
+                # symbolic links to directories are not followed, so the walk can't loop
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if not is_dir and not entry.is_file():
+                    continue
+            except OSError:
+                continue
+            if is_dir and entry.name in SKIP_DIRS or rules.rules and rules.ignored(entry.path, is_dir):
+                continue
+            if is_dir:
+                subdirectories.append((entry.path, rules))
+            else:
+                yield entry
+        # directories are searched in the alphabetical order
+        stack.extend(reversed(subdirectories))
+
+
+@contextmanager
+def read_file(path):
+    """
+    opens the file for a search, files of MMAP_SIZE and bigger are mapped into memory
+    :param path: path of the file
+    :return: context manager of the contents (bytes or mmap), None for an empty or a binary file
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            yield None
+            return
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size >= MMAP_SIZE else f.read()
+    try:
+        yield None if b'\0' in data[:BINARY_CHECK_SIZE] else data
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+
+
+def search_file(path, pattern):
+    """
+    :param path: path of the file
+    :param pattern: compiled bytes pattern
+    :return: list of (line from 1, column, text of the line), empty for a binary file
+    """
+    with read_file(path) as data:
+        return search_data(data, pattern) if data is not None else []
+
+
+def search_data(data, pattern):
+    """
+    :param data: contents of a file, bytes or mmap
+    :param pattern: compiled bytes pattern
+    :return: list of (line from 1, column, text of the line)
+    """
+    results = []
+    line = 1
+    position = 0
+    for match in pattern.finditer(data):
+        start = match.start()
+        if match.end() == start:
+            continue
+        # mmap has no count(), the slice is copied, but every byte only once
+        line += data[position:start].count(b'\n')
+        position = start
+        line_start = data.rfind(b'\n', 0, start) + 1
+        # a long line is shown around the match, the search for its end is bounded too
+        text_start = max(line_start, start - MAX_LINE_LENGTH)
+        line_end = data.find(b'\n', start, start + MAX_LINE_LENGTH * 4)
+        if line_end < 0:
+            line_end = min(len(data), start + MAX_LINE_LENGTH * 4)
+        text = data[text_start:line_end].decode('utf-8', 'replace').rstrip('\r')
+        column = len(data[line_start:start].decode('utf-8', 'replace'))
+        results.append((line, column, text[:MAX_LINE_LENGTH * 2]))
+        if len(results) >= MAX_FILE_MATCHES:
+            break
+    return results
+
+
+def search_files(paths, source, flags):
+    """
+    searches a batch of files, it is run in a worker process
+    :param paths: paths of the files
+    :param source: bytes source of the pattern from make_pattern
+    :param flags: flags of the pattern
+    :return: list of (path, [(line, column, text)]) of the files with matches
+    """
+    pattern = re.compile(source, flags)
+    results = []
+    for path in paths:
+        try:
+            matches = search_file(path, pattern)
+        except (OSError, ValueError):
+            # the file was removed or can't be read
+            continue
+        if matches:
+            results.append((path, matches))
+    return results
+
+
+def make_replacement(replacement, regex, source, flags):
+    """
+    :param replacement: text, which replaces the matches
+    :param regex: the replacement is a template with group references (\\1, \\g<name>)
+    :param source: bytes source of the pattern from make_pattern
+    :param flags: flags of the pattern
+    :return: bytes of the replacement, re.error is raised for a wrong template
+    """
+    replacement = replacement.encode('utf-8')
+    if regex:
+        # the template is parsed even without a match
+        re.compile(source, flags).sub(replacement, b'')
+    return replacement
+
+
+def replace_data(data, pattern, replacement, regex):
+    """
+    :param data: text or bytes
+    :param pattern: compiled pattern of the same type
+    :param replacement: replacement of the same type
+    :param regex: the replacement is a template, otherwise it is inserted literally
+    :return: new data and the number of replacements, empty matches are not replaced
+    """
+    count = 0
+
+    def substitute(match):
+        nonlocal count
+        if match.end() == match.start():
+            return match.group()
+        count += 1
+        return match.expand(replacement) if regex else replacement
+    return pattern.sub(substitute, data), count
+
+
+def preview_data(path, data, pattern, replacement, regex):
+    """
+    computes the diff of a replacement from its matches, only the changed lines are shown
+    :param path: path shown in the diff
+    :param data: text or bytes
+    :param pattern: compiled pattern of the same type
+    :param replacement: replacement of the same type
+    :param regex: the replacement is a template, otherwise it is inserted literally
+    :return: number of replacements and the diff, at most MAX_PREVIEW_LINES of it
+    """
+    binary = isinstance(data, bytes)
+    newline = b'\n' if binary else '\n'
+    lines = ['--- ' + path, '+++ ' + path]
+    count = 0
+    # line of the position and the difference of the line numbers of the new and the old text
+    line = 1
+    position = 0
+    delta = 0
+    # start and end of the changed lines and the replaced (start, end, new text) in them
+    hunk = None
+
+    def add_hunk(start, end, replaced):
+        nonlocal line, position, delta
+        line += data.count(newline, position, start)
+        position = start
+        parts = []
+        last = start
+        for match_start, match_end, new in replaced:
+            parts += [data[last:match_start], new]
+            last = match_end
+        parts.append(data[last:end])
+        old_lines = data[start:end].splitlines()
+        new_lines = data[:0].join(parts).splitlines()
+        lines.append('@@ -{},{} +{},{} @@'.format(line, len(old_lines), line + delta, len(new_lines)))
+        for prefix, chunk in (('-', old_lines), ('+', new_lines)):
+            lines.extend(prefix + (text.decode('utf-8', 'replace') if binary else text) for text in chunk)
+        delta += len(new_lines) - len(old_lines)
+
+    for match in pattern.finditer(data):
+        start, end = match.span()
+        if end == start:
+            continue
+        count += 1
+        if len(lines) >= MAX_PREVIEW_LINES:
+            # the rest is only counted
+            continue
+        new = match.expand(replacement) if regex else replacement
+        if hunk is not None and start <= hunk[1]:
+            line_end = data.find(newline, end)
+            hunk[1] = max(hunk[1], line_end if line_end >= 0 else len(data))
+            hunk[2].append((start, end, new))
+            continue
+        if hunk is not None:
+            add_hunk(*hunk)
+        line_end = data.find(newline, end)
+        hunk = [data.rfind(newline, 0, start) + 1, line_end if line_end >= 0 else len(data), [(start, end, new)]]
+    if hunk is not None and len(lines) < MAX_PREVIEW_LINES:
+        add_hunk(*hunk)
+    if len(lines) >= MAX_PREVIEW_LINES:
+        lines = lines[:MAX_PREVIEW_LINES] + ['...']
+    return count, '\n'.join(lines)
+
+
+def read_text_file(path):
+    """
+    :return: contents of the file and its (mtime, size) or None for a binary file
+    """
+    with open(path, 'rb') as f:
+        status = os.fstat(f.fileno())
+        data = f.read()
+    if b'\0' in data[:BINARY_CHECK_SIZE]:
+        return None, None
+    return data, (status.st_mtime_ns, status.st_size)
+
+
+def write_atomic(path, data, fsync=True, fsync_directory=False):
+    """
+    writes a temporary file next to the file and renames it over the file, so the file is either old or new
+    :param path: path of the file
+    :param data: new contents, bytes or an iterable of bytes
+    :param fsync: the data are flushed to the disk before the rename
+    :param fsync_directory: the rename is flushed to the disk too
+    :return:
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        # mkstemp creates the file only for its owner, a new file gets the mode of open()
+        mode = 0o666 & ~UMASK
+    fd, temp_path = tempfile.mkstemp(prefix='.' + name + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            os.fchmod(f.fileno(), mode)
+            if isinstance(data, bytes):
+                f.write(data)
+            else:
+                f.writelines(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+    if fsync_directory:
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def preview_replace(paths, source, flags, replacement, regex):
+    """
+    computes the replacement in a batch of files without writing them, it is run in a worker process
+    :param paths: paths of the files
+    :param source: bytes source of the pattern from make_pattern
+    :param flags: flags of the pattern
+    :param replacement: bytes from make_replacement
+    :param regex: the replacement is a template
+    :return: list of (path, number of replacements, diff, (mtime, size)) of the files with replacements
+    """
+    pattern = re.compile(source, flags)
+    results = []
+    for path in paths:
+        try:
+            data, signature = read_text_file(path)
+        except OSError:
+            continue
+        if data is None:
+            continue
+        count, diff = preview_data(path, data, pattern, replacement, regex)
+        if count:
+            results.append((path, count, diff, signature))
+    return results
+
+
+def replace_files(files, source, flags, replacement, regex):
+    """
+    replaces in a batch of files and writes them atomically, it is run in a worker process
+    :param files: list of (path, (mtime, size)) from preview_replace, a file, which was changed since, is skipped
+    :return: list of (path, number of replacements, error or None)
+    """
+    pattern = re.compile(source, flags)
+    results = []
+    for path, signature in files:
+        try:
+            data, current = read_text_file(path)
+            if current != signature:
+                results.append((path, 0, 'changed since the preview'))
+                continue
+            new_data, count = replace_data(data, pattern, replacement, regex)
+            # a link is kept, the file it points to is replaced
+            write_atomic(os.path.realpath(path), new_data)
+        except OSError as e:
+            results.append((path, 0, str(e)))
+            continue
+        results.append((path, count, None))
+    return results
@@ -1,9 +1,65 @@
 from PyQt5.QtWidgets import QWidget, QPlainTextEdit, QTextEdit, QCompleter, QDialog, QPushButton, QRadioButton, \
                             QLineEdit, QLabel, QCheckBox, QGridLayout
 from PyQt5.QtGui import QTextFormat, QTextCursor
+from PyQt5 import sip
+from functools import lru_cache
 import re
 import logging
 
+from pyvicky import file_search, search
+
+
+def replace_spans(editor, spans, replacement):
+    """
+    replaces the spans of the document as one undo step
+    :param editor: QPlainTextEdit
+    :param spans: sorted, not overlapping (start, end) positions in the document
+    :param replacement: new text of every span or a list of the new texts of the spans
+    :return: number of replaced spans
+    """
+    if isinstance(replacement, str):
+        replacement = [replacement] * len(spans)
+    cursor = QTextCursor(editor.document())
+    cursor.beginEditBlock()
+    # back to front, so that the positions of the spans, which are not replaced yet, stay the same
+    for (start, end), text in zip(reversed(spans), reversed(replacement)):
+        cursor.setPosition(start)
+        cursor.setPosition(end, QTextCursor.KeepAnchor)
+        cursor.insertText(text)
+    cursor.endEditBlock()
+    return len(spans)
+
+
+def match_spans(text, pattern):
+    """
+    finds all matches in one pass over one copy of the text, empty matches are not replaced
+    :param text: plain text of the document
+    :param pattern: compiled pattern
+    :return: (start, end) positions of the matches in the document
+    """
+    spans = [match.span() for match in pattern.finditer(text) if match.end() > match.start()]
+    positions = search.to_document_positions(text, [position for span in spans for position in span])
+    return list(zip(positions[::2], positions[1::2]))
+
+
+@lru_cache(maxsize=64)
+def compile_query(query, regex=False, case_sensitive=False, whole_words=False):
+    """
+    compiled patterns are cached, so typing into the find field doesn't compile them again
+    :param query: text or regular expression
+    :param regex: the query is a regular expression, otherwise it is searched literally
+    :param case_sensitive: case sensitive search
+    :param whole_words: the match must not be a part of a longer word
+    :return: compiled pattern, re.error is raised for a wrong regex
+    """
+    if not regex:
+        query = re.escape(query)
+    # Lookarounds are not a part of the match and find words at the start and the end of a line too
+    if whole_words:
+        query = r'(?<!\w)(?:' + query + r')(?!\w)'
+    # By default regexes are case sensitive but usually a search isn't, ^ and $ match at every line
+    return re.compile(query, re.MULTILINE if case_sensitive else re.MULTILINE | re.I)
+
 
 class Find(QDialog):
     def __init__(self, parent=None):
@@ -11,7 +67,17 @@ class Find(QDialog):
         self.parent = parent
 
         self.lastMatch = None
+        # (editor, position), where the search as you type started
+        self.searchStart = None
+        # (editor, position, revision of the document, options, query, result) of the last search as you type
+        self.typedSearch = None
+        # Matches of the current tab, while all of them are highlighted or Previous is used
+        self.matchIndex = None
         self.initUI()
+        self.finished.connect(self.close_match_index)
+        self.finished.connect(self.cancel_search)
+        if parent is not None:
+            parent.tabWidget.editorRemoved.connect(self.forget_editor)
         self.findField.setFocus()
         logging.info('created find window')
 
@@ -21,6 +87,10 @@ class Find(QDialog):
         findButton.clicked.connect(self.find)
         # findButton.returnPressed.connect(self.find)
 
+        # Search backwards button
+        previousButton = QPushButton('&Previous', self)
+        previousButton.clicked.connect(self.find_previous)
+
         # Replace Button
         replaceButton = QPushButton('&Replace', self)
         replaceButton.clicked.connect(self.replace)
@@ -30,6 +100,10 @@ class Find(QDialog):
         replaceAllButton = QPushButton('Replace &All', self)
         replaceAllButton.clicked.connect(self.replaceAll)
 
+        # Many terms at once
+        termsButton = QPushButton('&Terms...', self)
+        termsButton.clicked.connect(self.parent.search_terms)
+
         # Normal Mode
         self.normalRadio = QRadioButton('Normal', self)
         self.normalRadio.toggled.connect(self.normalMode)
@@ -40,6 +114,7 @@ class Find(QDialog):
 
         # Search input
         self.findField = QLineEdit(self)
+        self.findField.textChanged.connect(self.search_as_you_type)
 
         # Replace input
         self.replaceField = QLineEdit(self)
@@ -53,12 +128,22 @@ class Find(QDialog):
         # Whole words option
         self.wholeWords = QCheckBox('Whole words', self)
 
+        # Changed options search again
+        self.regexRadio.toggled.connect(self.search_again)
+        self.caseSensitive.toggled.connect(self.search_again)
+        self.wholeWords.toggled.connect(self.search_again)
+
+        # Highlight all matches option
+        self.highlightAll = QCheckBox('Highlight all', self)
+        self.highlightAll.toggled.connect(self.update_highlight)
+
         # Layout
         layout = QGridLayout()
         layout.addWidget(self.findField, 1, 0, 1, 4)
         layout.addWidget(self.normalRadio, 2, 2)
         layout.addWidget(self.regexRadio, 2, 3)
-        layout.addWidget(findButton, 2, 0, 1, 2)
+        layout.addWidget(findButton, 2, 0)
+        layout.addWidget(previousButton, 2, 1)
         layout.addWidget(self.replaceField, 3, 0, 1, 4)
         layout.addWidget(replaceButton, 4, 0, 1, 2)
         layout.addWidget(replaceAllButton, 4, 2, 1, 2)
@@ -70,6 +155,12 @@ class Find(QDialog):
         layout.addWidget(optionsLabel, 6, 0)
         layout.addWidget(self.caseSensitive, 6, 1)
         layout.addWidget(self.wholeWords, 6, 2)
+        layout.addWidget(self.highlightAll, 6, 3)
+
+        # Number of matches and the result of Replace All
+        self.resultLabel = QLabel(self)
+        layout.addWidget(self.resultLabel, 7, 0, 1, 3)
+        layout.addWidget(termsButton, 7, 3)
 
         self.setGeometry(300, 300, 360, 250)
         self.setWindowTitle('Find and Replace')
@@ -81,46 +172,265 @@ class Find(QDialog):
 
     def get_parent_text(self):
         current_index = self.parent.tabWidget.get_cur_index()
+        if current_index < 0:
+            # No tab is open
+            return None
         return self.parent.tabWidget.get_editor_from_tab(current_index)
 
-    def find(self):
-        # Get text
-
-        text = self.get_parent_text().toPlainText()
-
-        # And text to Find
-        query = self.findField.text()
-
-        if self.wholeWords.isChecked():
-            query = r'\W' + query + r'\W'
-
-        # By default regexes are case sensitive but usually a search isn't
-        flags = 0 if self.caseSensitive.isChecked() else re.I
-
-        # Compile the pattern
-        pattern = re.compile(query, flags)
-
-        # use last match position, if available
-        start = self.lastMatch.start() + 1 if self.lastMatch else 0
-
-        # The actual search
-        self.lastMatch = pattern.search(text, start)
-
-        if self.lastMatch:
-            start = self.lastMatch.start()
-            end = self.lastMatch.end()
-
-            # If using whole words, include the two non-alphanumerics wrapping it
-            if self.wholeWords.isChecked():
-                start += 1
-                end -= 1
+    def get_viewer(self):
+        """
+        :return: LargeFileView of the current tab or None
+        """
+        current_index = self.parent.tabWidget.get_cur_index()
+        if current_index < 0:
+            return None
+        return self.parent.tabWidget.get_viewer_from_tab(current_index)
 
-            self.moveCursor(start, end)
+    def find(self):
+        viewer = self.get_viewer()
+        if viewer is not None:
+            # A selected match is skipped
+            self.searchStart = None
+            self.find_in_viewer(viewer, True)
+            return
+
+        if self.highlightAll.isChecked():
+            # Go to the next match in the index
+            self.find_in_index(forward=True)
+            return
+
+        pattern = self.compile_checked()
+        editor = self.get_parent_text()
+        if pattern is None or editor is None:
+            return
+        cursor = editor.textCursor()
+        # The next search as you type starts here
+        self.searchStart = None
+
+        # A selected match is skipped, a match at the cursor is not
+        position = cursor.selectionStart() + 1 if cursor.hasSelection() else cursor.position()
+        self.find_later(editor, pattern, position, None, self.show_match)
+
+    def search_as_you_type(self, query):
+        """
+        selects the first match of the typed query after the position, where the typing started
+        """
+        viewer = self.get_viewer()
+        if viewer is not None:
+            if self.searchStart is None or self.searchStart[0] is not viewer:
+                self.searchStart = (viewer, viewer.position())
+            if not query:
+                viewer.cancel_search()
+                self.resultLabel.clear()
+                return
+            self.find_in_viewer(viewer, True, self.searchStart[1])
+            return
+
+        editor = self.get_parent_text()
+        if editor is None:
+            return
+        document_search = editor.documentSearch
+        if self.searchStart is None or self.searchStart[0] is not editor:
+            self.searchStart = (editor, editor.textCursor().selectionStart())
+        start = self.searchStart[1]
+        if not query:
+            document_search.cancel()
+            self.typedSearch = None
+            self.lastMatch = None
+            self.moveCursor(start, start)
+            self.resultLabel.clear()
+            return
+        pattern = self.compile_checked()
+        if pattern is None:
+            return
+
+        options = (self.regexRadio.isChecked(), self.caseSensitive.isChecked(), self.wholeWords.isChecked())
+        state = self.searchStart + (document_search.revision, options)
+        position, stop = start, None
+        typed = self.typedSearch
+        # Every match of a longer literal query starts at a match of its beginning,
+        # so the search continues from the match of the previous query
+        if typed is not None and typed[:4] == state and not options[0] and not options[2] \
+                and query.startswith(typed[4]):
+            if typed[5] is None:
+                document_search.cancel()
+                self.show_match(None)
+                return
+            position, stop = typed[5][0], start
+
+        def found(result):
+            self.typedSearch = state + (query, result)
+            self.show_match(result)
+            if self.highlightAll.isChecked() and self.get_match_index() is not None:
+                self.update_count()
+        self.find_later(editor, pattern, position, stop, found)
+
+    def search_again(self):
+        self.search_as_you_type(self.findField.text())
+
+    def find_later(self, editor, pattern, position, stop, callback):
+        """
+        searches the document of the editor in the event loop, the result is passed to the callback
+        """
+        if not editor.documentSearch.find_later(pattern, position, stop, callback):
+            self.resultLabel.setText('Searching...')
+
+    def find_in_viewer(self, viewer, forward, position=None):
+        """
+        searches the mapped file of a large file tab in a thread and selects the match
+        :param viewer: LargeFileView
+        :param forward: search direction
+        :param position: offset, where the search starts, after the selected match by default
+        """
+        if not self.findField.text():
+            return
+        try:
+            source, flags = file_search.make_pattern(self.findField.text(), self.regexRadio.isChecked(),
+                                                     self.caseSensitive.isChecked(), self.wholeWords.isChecked())
+        except re.error as e:
+            self.resultLabel.setText('Wrong pattern: {}'.format(e))
+            return
+
+        def found(result):
+            self.lastMatch = result
+            if result is None:
+                self.resultLabel.setText('No matches')
+                return
+            viewer.select(*result)
+            self.resultLabel.clear()
+        viewer.find(re.compile(source, flags), forward, found, position)
+        self.resultLabel.setText('Searching...')
+
+    def cancel_search(self):
+        viewer = self.get_viewer()
+        if viewer is not None:
+            viewer.cancel_search()
+        editor = self.get_parent_text()
+        if editor is not None:
+            editor.documentSearch.cancel()
+
+    def forget_editor(self, editor):
+        """
+        drops the state of the search in the editor of a closed or hibernated tab
+        """
+        if self.matchIndex is not None and not sip.isdeleted(self.matchIndex) and self.matchIndex.editor is editor:
+            self.close_match_index()
+        if self.searchStart is not None and self.searchStart[0] is editor:
+            editor.documentSearch.cancel()
+            self.searchStart = None
+            self.lastMatch = None
+        if self.typedSearch is not None and self.typedSearch[0] is editor:
+            self.typedSearch = None
+
+    def show_match(self, result):
+        """
+        :param result: start and end position of the match or None
+        """
+        self.lastMatch = result
+        if result is None:
+            self.resultLabel.setText('No matches')
+            return
+        self.moveCursor(*result)
+        self.resultLabel.clear()
+
+    def find_previous(self):
+        viewer = self.get_viewer()
+        if viewer is not None:
+            self.searchStart = None
+            self.find_in_viewer(viewer, False)
+            return
+        self.find_in_index(forward=False)
+
+    def find_in_index(self, forward):
+        """
+        selects the next or the previous match of the match index, the search wraps around
+        :param forward: search direction
+        :return:
+        """
+        match_index = self.get_match_index()
+        if match_index is None:
+            return
+        cursor = match_index.editor.textCursor()
+        if forward:
+            # A selected match is skipped, a match at the cursor is not
+            index = match_index.next(cursor.selectionStart() + 1 if cursor.hasSelection() else cursor.position())
+        else:
+            index = match_index.previous(cursor.selectionStart())
+        if index is not None:
+            self.moveCursor(*match_index.span(index))
+        self.update_count()
+
+    def get_match_index(self):
+        """
+        :return: MatchIndex of the current tab and query, it is built again, when they change,
+                 None, if no tab is open or the query is empty or a wrong regex
+        """
+        editor = self.get_parent_text()
+        if editor is None:
+            return None
+        pattern = self.compile_checked()
+        if pattern is None:
+            return None
+        match_index = self.matchIndex
+        if match_index is None or match_index.editor is not editor or match_index.pattern != pattern:
+            self.close_match_index()
+            match_index = search.MatchIndex(editor, pattern)
+            match_index.changed.connect(self.update_count)
+            editor.cursorPositionChanged.connect(self.update_count)
+            self.matchIndex = match_index
+        match_index.set_visible(self.highlightAll.isChecked())
+        return match_index
+
+    def close_match_index(self):
+        if self.matchIndex is not None:
+            if not sip.isdeleted(self.matchIndex):
+                # The tab wasn't closed
+                self.matchIndex.editor.cursorPositionChanged.disconnect(self.update_count)
+                self.matchIndex.close()
+            self.matchIndex = None
+
+    def update_highlight(self, checked):
+        if self.get_parent_text() is None:
+            # No tab or a large file tab
+            return
+        if checked:
+            if self.get_match_index() is not None:
+                self.update_count()
+        elif self.matchIndex is not None:
+            self.matchIndex.set_visible(False)
+
+    def update_count(self):
+        if self.matchIndex is None or sip.isdeleted(self.matchIndex):
+            return
+        current = self.matchIndex.current()
+        total = len(self.matchIndex)
+        if current is None:
+            self.resultLabel.setText('{} match{}'.format(total, '' if total == 1 else 'es'))
         else:
-            # set the cursor to the end if search failed
-            self.get_parent_text().moveCursor(QTextCursor.End)
+            self.resultLabel.setText('{} of {}'.format(current + 1, total))
+
+    def compile_pattern(self):
+        """
+        :return: compiled pattern of the query and the options
+        """
+        return compile_query(self.findField.text(), self.regexRadio.isChecked(),
+                             self.caseSensitive.isChecked(), self.wholeWords.isChecked())
+
+    def compile_checked(self):
+        """
+        :return: compiled pattern or None, if the query is empty or a wrong regex, which is typed yet
+        """
+        if not self.findField.text():
+            return None
+        try:
+            return self.compile_pattern()
+        except re.error as e:
+            self.resultLabel.setText('Wrong pattern: {}'.format(e))
+            return None
 
     def replace(self):
+        if self.get_parent_text() is None:
+            return
         # Get cursor
         cursor = self.get_parent_text().textCursor()
 
@@ -133,16 +443,21 @@ class Find(QDialog):
             self.get_parent_text().setTextCursor(cursor)
 
     def replaceAll(self):
-        # Set lastmatch to None so the search starts from the beginning
+        # Set lastmatch to None so the next search starts from the beginning
         self.lastMatch = None
 
-        # Initial find() call so that lastMatch is potentially not None
-        self.find()
-
-        # Replace and find until find is None again
-        while self.lastMatch:
-            self.replace()
-            self.find()
+        editor = self.get_parent_text()
+        if editor is None:
+            self.resultLabel.setText('The file is read-only')
+            return 0
+        pattern = self.compile_checked()
+        if pattern is None:
+            return 0
+        spans = match_spans(editor.toPlainText(), pattern)
+        count = replace_spans(editor, spans, self.replaceField.text())
+        self.resultLabel.setText('Replaced {} occurrence{}'.format(count, '' if count == 1 else 's'))
+        logging.info('Replaced {} occurrences'.format(count))
+        return count
 
     def regexMode(self):
         # First uncheck the checkboxes
@@ -166,7 +481,40 @@ class Find(QDialog):
         cursor.setPosition(start)
 
         # Move the Cursor over the match and pass KeepAnchor to select the text
-        cursor.movePosition(QTextCursor.Right, QTextCursor.KeepAnchor, end - start)
+        cursor.setPosition(end, QTextCursor.KeepAnchor)
 
         # And finally, set this new cursor as the parent's
         self.get_parent_text().setTextCursor(cursor)
+
+
+def benchmark(counts=(300, 3000, 50000)):
+    """
+    prints the time of Replace All of foo in 'foo = bar(foo) + foo_x' lines with the python highlighter
+    and if one undo restores the text
+    run it with python -m pyvicky.find from the root of the repository
+    """
+    import sys
+    import time
+    from PyQt5.QtWidgets import QApplication
+    from pyvicky.highlighter import PythonHighlighter
+    app = QApplication.instance() or QApplication(sys.argv)
+    pattern = compile_query('foo', whole_words=True)
+    for count in counts:
+        editor = QPlainTextEdit()
+        text = '\n'.join(['foo = bar(foo) + foo_x'] * (count // 2))
+        editor.setPlainText(text)
+        document = editor.document()
+        document.clearUndoRedoStacks()
+        highlighter = PythonHighlighter(document)
+        app.processEvents()
+        start = time.perf_counter()
+        replaced = replace_spans(editor, match_spans(editor.toPlainText(), pattern), 'foo_y')
+        elapsed = time.perf_counter() - start
+        document.undo()
+        undone = document.toPlainText() == text and not document.isUndoAvailable()
+        print('{:>6} occurrences: {:.3f} s, one undo restores the text: {}'.format(replaced, elapsed, undone))
+        highlighter.close()
+
+
+if __name__ == '__main__':
+    benchmark()
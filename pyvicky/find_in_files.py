@@ -0,0 +1,509 @@
+# -*- coding: utf-8 -*-
+
+from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtWidgets import QApplication, QWidget, QPushButton, QLineEdit, QLabel, QCheckBox, QGridLayout, \
+                            QTreeWidget, QTreeWidgetItem, QDialog, QDialogButtonBox, QPlainTextEdit, QVBoxLayout
+from concurrent.futures import ProcessPoolExecutor, wait
+import logging
+import multiprocessing
+import os
+import re
+import threading
+import time
+
+from pyvicky import file_search, search, trigram_index
+from pyvicky.find import compile_query, replace_spans
+
+search_pool = None
+
+
+def get_search_pool():
+    """
+    :return: ProcessPoolExecutor with a worker per core, which is shared by all searches
+    """
+    global search_pool
+    if search_pool is None:
+        # a fork of the editor would copy the Qt threads and the locks, they hold, into the workers
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        search_pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1,
+                                          mp_context=multiprocessing.get_context(method))
+        QApplication.instance().aboutToQuit.connect(stop_search_pool)
+    return search_pool
+
+
+def stop_search_pool(pool=None):
+    """
+    :param pool: the pool is stopped only if it is still the shared one, by default the shared pool is stopped
+    """
+    global search_pool
+    if search_pool is not None and (pool is None or pool is search_pool):
+        search_pool.shutdown(wait=False, cancel_futures=True)
+        search_pool = None
+
+
+def walk_and_search(pool, root, function, args, stopped, on_results):
+    """
+    walks the tree and passes batches of its files to the pool, it is run in a thread
+    :param pool: ProcessPoolExecutor
+    :param root: directory
+    :param function: function of the workers, it gets a list of paths and the args
+    :param args: other arguments of the function
+    :param stopped: threading.Event, which stops the search
+    :param on_results: function, which gets the result of every batch, it is called in a thread of the pool
+    :return: number of searched files or None, if the search was stopped
+    """
+    def on_done(future):
+        if not future.cancelled() and future.exception() is None and not stopped.is_set():
+            on_results(future.result())
+        # the callback runs after wait() has returned
+        callbacks.release()
+
+    def submit(paths):
+        future = pool.submit(function, paths, *args)
+        future.add_done_callback(on_done)
+        pending.add(future)
+        futures.append(future)
+
+    pending = set()
+    futures = []
+    callbacks = threading.Semaphore(0)
+    searched = 0
+    batch = []
+    try:
+        for path in file_search.walk(root, stopped):
+            batch.append(path)
+            if len(batch) >= file_search.BATCH_FILES:
+                submit(batch)
+                searched += len(batch)
+                batch = []
+        if batch:
+            submit(batch)
+            searched += len(batch)
+        while pending:
+            done, pending = wait(pending, timeout=0.1)
+            if stopped.is_set():
+                for future in pending:
+                    future.cancel()
+                return None
+    except RuntimeError as e:
+        # BrokenProcessPool or the pool was shut down
+        logging.error(e)
+        stop_search_pool(pool)
+    # the results of all batches are passed on before the end of the search
+    for future in futures:
+        callbacks.acquire()
+    return searched
+
+
+class FindInFiles(QWidget):
+    """
+    Panel, which searches the files of the directory opened in the tree.
+    The tree is walked in a thread, batches of files are searched by a pool of processes
+    (matching of a regex holds the GIL, so threads would use one core only),
+    and the results are shown as soon as a batch is done. A new search or Stop cancels the running one.
+    With the index, only the files, which contain the trigrams of the query, are searched at first,
+    then the index is updated, and the new and changed files are searched too.
+    Replace computes the replacement in the found files by the pool and shows the diff,
+    the files are then written by the pool, the open tabs are edited instead as one undo step.
+    """
+    # Matches shown in the panel, the rest is only counted
+    MAX_SHOWN = 5000
+
+    # generation of the search, list of (path, matches)
+    found = pyqtSignal(int, object)
+    # generation of the search, number of searched files, description of the index or None
+    searchFinished = pyqtSignal(int, int, object)
+    # generation of the replacement, results of the workers or None, if the pool failed
+    previewReady = pyqtSignal(int, object)
+    replaceFinished = pyqtSignal(int, object)
+
+    def __init__(self, parent):
+        super(FindInFiles, self).__init__(parent)
+        self.parent = parent
+        # results of older searches are dropped
+        self.generation = 0
+        # threading.Event, which stops the running search
+        self.stopped = None
+        self.root = None
+        self.startTime = 0
+        self.matchCount = 0
+        self.fileCount = 0
+        self.shownCount = 0
+        # (query, regex, case sensitive, whole words) of the search and its finished generation
+        self.searchOptions = None
+        self.finishedGeneration = None
+        # all files with matches, the replacement is done in them
+        self.foundPaths = []
+        # previews and writes of older replacements are dropped
+        self.replaceGeneration = 0
+        # (source, flags, replacement, regex, text pattern, text replacement) of the previewed replacement
+        self.replacement = None
+        self.previewDialog = None
+        # occurrences replaced in the open tabs by the running replacement
+        self.tabReplaced = 0
+        self.found.connect(self.on_found)
+        self.searchFinished.connect(self.on_search_finished)
+        self.previewReady.connect(self.on_preview_ready)
+        self.replaceFinished.connect(self.on_replace_finished)
+        self.initUI()
+        logging.info('created find in files panel')
+
+    def initUI(self):
+        # Search input
+        self.findField = QLineEdit(self)
+        self.findField.returnPressed.connect(self.search)
+
+        # Search button
+        searchButton = QPushButton('&Search', self)
+        searchButton.clicked.connect(self.search)
+
+        # Stop button
+        stopButton = QPushButton('S&top', self)
+        stopButton.clicked.connect(self.stop)
+
+        # Replace input and button, which shows the diff of the replacement in the found files
+        self.replaceField = QLineEdit(self)
+        self.replaceField.setPlaceholderText('Replace with')
+        replaceButton = QPushButton('Re&place...', self)
+        replaceButton.clicked.connect(self.preview_replace)
+
+        # Options
+        self.regex = QCheckBox('RegEx', self)
+        self.caseSensitive = QCheckBox('Case sensitive', self)
+        self.wholeWords = QCheckBox('Whole words', self)
+        self.useIndex = QCheckBox('Use index', self)
+        self.useIndex.setChecked(True)
+
+        # Results grouped by file, activating a line opens the file there
+        self.results = QTreeWidget(self)
+        self.results.setHeaderHidden(True)
+        self.results.setUniformRowHeights(True)
+        self.results.itemActivated.connect(self.open_result)
+
+        self.statusLabel = QLabel(self)
+
+        # Layout
+        layout = QGridLayout()
+        layout.addWidget(self.findField, 0, 0, 1, 4)
+        layout.addWidget(searchButton, 0, 4)
+        layout.addWidget(stopButton, 0, 5)
+        layout.addWidget(self.replaceField, 1, 0, 1, 4)
+        layout.addWidget(replaceButton, 1, 4)
+        layout.addWidget(self.regex, 2, 0)
+        layout.addWidget(self.caseSensitive, 2, 1)
+        layout.addWidget(self.wholeWords, 2, 2)
+        layout.addWidget(self.useIndex, 2, 3)
+        layout.addWidget(self.statusLabel, 2, 4, 1, 2)
+        layout.addWidget(self.results, 3, 0, 1, 6)
+        self.setLayout(layout)
+
+    def get_options(self):
+        """
+        :return: query, regex, case sensitive, whole words
+        """
+        return (self.findField.text(), self.regex.isChecked(),
+                self.caseSensitive.isChecked(), self.wholeWords.isChecked())
+
+    def search(self):
+        self.stop()
+        options = self.get_options()
+        if not options[0]:
+            return
+        try:
+            source, flags = file_search.make_pattern(*options)
+        except re.error as e:
+            self.statusLabel.setText('Wrong pattern: {}'.format(e))
+            return
+
+        self.generation += 1
+        self.searchOptions = options
+        self.foundPaths = []
+        self.root = self.parent.treeWidget.root_path()
+        self.results.clear()
+        self.matchCount = 0
+        self.fileCount = 0
+        self.shownCount = 0
+        self.startTime = time.monotonic()
+        self.statusLabel.setText('Searching...')
+        self.stopped = threading.Event()
+        target = self.search_index if self.useIndex.isChecked() else self.search_tree
+        threading.Thread(target=target,
+                         args=(get_search_pool(), self.generation, self.root, source, flags, self.stopped),
+                         daemon=True).start()
+        logging.info('Searching {} in {}'.format(options[0], self.root))
+
+    def stop(self):
+        if self.stopped is not None and not self.stopped.is_set():
+            self.stopped.set()
+            self.statusLabel.setText('Stopped: {} matches in {} files'.format(self.matchCount, self.fileCount))
+
+    def search_tree(self, pool, generation, root, source, flags, stopped):
+        """
+        walks the tree and passes batches of files to the pool, it is run in a thread
+        """
+        def on_results(results):
+            self.found.emit(generation, results)
+
+        searched = walk_and_search(pool, root, file_search.search_files, (source, flags), stopped, on_results)
+        if searched is not None:
+            self.searchFinished.emit(generation, searched, None)
+
+    def search_index(self, pool, generation, root, source, flags, stopped):
+        """
+        searches the candidates of the trigram index and updates the index, it is run in a thread
+        """
+        def on_done(future):
+            if not future.cancelled() and future.exception() is None and not stopped.is_set():
+                self.found.emit(generation, future.result())
+            # the callback runs after wait() has returned
+            callbacks.release()
+
+        def on_found(results):
+            if not stopped.is_set():
+                self.found.emit(generation, results)
+
+        def submit_index(files, source, flags):
+            return pool.submit(trigram_index.index_files, files, source, flags)
+
+        index = trigram_index.get_trigram_index(root)
+        # a previous search may still update the index
+        with index.lock:
+            if stopped.is_set():
+                return
+            try:
+                start = time.monotonic()
+                candidates = index.candidates(source, flags) if index.is_built() else []
+                logging.info('{} candidate files of {} in {:.3f} s'.format(
+                    len(candidates), len(index.ids), time.monotonic() - start))
+                pending = set()
+                callbacks = threading.Semaphore(0)
+                for position in range(0, len(candidates), file_search.BATCH_FILES):
+                    future = pool.submit(file_search.search_files,
+                                         candidates[position:position + file_search.BATCH_FILES], source, flags)
+                    future.add_done_callback(on_done)
+                    pending.add(future)
+                indexed = index.update(submit_index, stopped, set(candidates), source, flags, on_found)
+                while pending:
+                    done, pending = wait(pending, timeout=0.1)
+                    if stopped.is_set():
+                        for future in pending:
+                            future.cancel()
+                        return
+                # the results of all batches are emitted before the end of the search
+                for position in range(0, len(candidates), file_search.BATCH_FILES):
+                    callbacks.acquire()
+            except RuntimeError as e:
+                # BrokenProcessPool or the pool was shut down
+                logging.error(e)
+                stop_search_pool(pool)
+                return
+            except OSError as e:
+                logging.error('Trigram index failed: {}'.format(e))
+                return
+            description = '{} files indexed, {:.1f} MB, built in {:.1f} s'.format(
+                len(index.ids), index.size() / 2 ** 20, index.buildTime)
+        self.searchFinished.emit(generation, len(candidates) + indexed, description)
+
+    def on_found(self, generation, results):
+        if generation != self.generation:
+            return
+        items = []
+        for path, matches in results:
+            self.foundPaths.append(path)
+            self.fileCount += 1
+            self.matchCount += len(matches)
+            if self.shownCount >= self.MAX_SHOWN:
+                continue
+            shown = matches[:self.MAX_SHOWN - self.shownCount]
+            self.shownCount += len(shown)
+            file_item = QTreeWidgetItem(['{} ({})'.format(os.path.relpath(path, self.root), len(matches))])
+            file_item.setData(0, Qt.UserRole, (path, 1, 0))
+            for line, column, text in shown:
+                item = QTreeWidgetItem(file_item, ['{}: {}'.format(line, text.strip())])
+                item.setData(0, Qt.UserRole, (path, line, column))
+            items.append(file_item)
+        if items:
+            self.results.addTopLevelItems(items)
+            if self.results.topLevelItemCount() == len(items):
+                logging.info('First results in {:.3f} s'.format(time.monotonic() - self.startTime))
+        self.statusLabel.setText('{} matches in {} files...'.format(self.matchCount, self.fileCount))
+
+    def on_search_finished(self, generation, searched, index_description):
+        if generation != self.generation:
+            return
+        self.finishedGeneration = generation
+        elapsed = time.monotonic() - self.startTime
+        status = '{} matches in {} files, {} files searched in {:.2f} s'.format(
+            self.matchCount, self.fileCount, searched, elapsed)
+        if index_description:
+            status += '; ' + index_description
+        self.statusLabel.setText(status)
+        logging.info(status)
+
+    def open_result(self, item, column):
+        path, line, column = item.data(0, Qt.UserRole)
+        self.parent.open_file_at(path, line, column)
+
+    def preview_replace(self):
+        """
+        computes the replacement in the found files, the diff is shown, when all of them are done
+        """
+        options = self.get_options()
+        if self.searchOptions != options or self.finishedGeneration != self.generation:
+            self.statusLabel.setText('Search for the query first, the found matches are replaced')
+            return
+        query, regex, case_sensitive, whole_words = options
+        text = self.replaceField.text()
+        source, flags = file_search.make_pattern(*options)
+        try:
+            replacement = file_search.make_replacement(text, regex, source, flags)
+            # the open tabs are replaced in their documents, which may differ from the files
+            text_pattern = compile_query(query, regex, case_sensitive, whole_words)
+            if regex:
+                text_pattern.sub(text, '')
+        except re.error as e:
+            self.statusLabel.setText('Wrong replacement: {}'.format(e))
+            return
+        self.replacement = (source, flags, replacement, regex, text_pattern, text)
+        self.replaceGeneration += 1
+
+        previews = []
+        paths = []
+        for path in self.foundPaths:
+            index = self.parent.tabWidget.find_tab(path)
+            editor = self.parent.get_editor_by_index(index) if index is not None else None
+            if editor is None:
+                # large file tabs are read-only views of the file
+                paths.append(path)
+                continue
+            count, diff = file_search.preview_data(path, editor.toPlainText(), text_pattern, text, regex)
+            if count:
+                # no signature, the tab is edited instead of the file
+                previews.append((path, count, diff, None))
+        self.statusLabel.setText('Computing the replacement in {} files...'.format(len(self.foundPaths)))
+        threading.Thread(target=self.run_batches,
+                         args=(get_search_pool(), self.replaceGeneration, file_search.preview_replace, paths,
+                               (source, flags, replacement, regex), previews, self.previewReady),
+                         daemon=True).start()
+
+    def run_batches(self, pool, generation, function, items, args, results, signal):
+        """
+        passes batches of the items to the pool and emits the signal with all results, it is run in a thread
+        """
+        try:
+            futures = [pool.submit(function, items[position:position + file_search.BATCH_FILES], *args)
+                       for position in range(0, len(items), file_search.BATCH_FILES)]
+            for future in futures:
+                results.extend(future.result())
+        except RuntimeError as e:
+            # BrokenProcessPool or the pool was shut down
+            logging.error(e)
+            stop_search_pool(pool)
+            results = None
+        signal.emit(generation, results)
+
+    def on_preview_ready(self, generation, previews):
+        if generation != self.replaceGeneration:
+            return
+        if previews is None:
+            self.statusLabel.setText('Replacement failed, see the log')
+            return
+        if not previews:
+            self.statusLabel.setText('Nothing to replace')
+            return
+        self.statusLabel.setText('')
+        previews.sort(key=lambda preview: preview[0])
+        self.previewDialog = ReplacePreview(self, previews)
+        self.previewDialog.accepted.connect(lambda: self.apply_replace(generation, previews))
+
+    def apply_replace(self, generation, previews):
+        """
+        edits the open tabs and writes the other files in the pool
+        """
+        if generation != self.replaceGeneration:
+            return
+        source, flags, replacement, regex, text_pattern, text = self.replacement
+        tab_count = 0
+        files = []
+        for path, count, diff, signature in previews:
+            if signature is not None:
+                files.append((path, signature))
+                continue
+            index = self.parent.tabWidget.find_tab(path)
+            if index is None:
+                continue
+            editor = self.parent.get_editor_by_index(index)
+            if editor is None:
+                # the tab was hibernated after the preview without changes, so its file is replaced
+                try:
+                    status = os.stat(path)
+                except OSError:
+                    continue
+                files.append((path, (status.st_mtime_ns, status.st_size)))
+                continue
+            old_text = editor.toPlainText()
+            spans = []
+            texts = []
+            for match in text_pattern.finditer(old_text):
+                if match.end() > match.start():
+                    spans.append(match.span())
+                    texts.append(match.expand(text) if regex else text)
+            positions = search.to_document_positions(old_text, [position for span in spans for position in span])
+            tab_count += replace_spans(editor, list(zip(positions[::2], positions[1::2])), texts)
+        # the found matches are not valid after the replacement
+        self.searchOptions = None
+        self.tabReplaced = tab_count
+        self.statusLabel.setText('Replacing in {} files...'.format(len(files)))
+        threading.Thread(target=self.run_batches,
+                         args=(get_search_pool(), generation, file_search.replace_files, files,
+                               (source, flags, replacement, regex), [], self.replaceFinished),
+                         daemon=True).start()
+
+    def on_replace_finished(self, generation, results):
+        if generation != self.replaceGeneration:
+            return
+        if results is None:
+            self.statusLabel.setText('Replacement failed, see the log')
+            return
+        count = self.tabReplaced + sum(result[1] for result in results)
+        file_count = sum(1 for result in results if result[2] is None)
+        for path, _, error in results:
+            if error is not None:
+                logging.error('Not replaced in {}: {}'.format(path, error))
+        skipped = len(results) - file_count
+        status = 'Replaced {} occurrences in {} files'.format(count, file_count)
+        if self.tabReplaced:
+            status += ' and open tabs'
+        if skipped:
+            status += ', {} files skipped, see the log'.format(skipped)
+        self.statusLabel.setText(status)
+        logging.info(status)
+
+
+class ReplacePreview(QDialog):
+    """
+    Diff of the files, which are changed by a replacement, Replace applies it
+    """
+    def __init__(self, parent, previews):
+        super(ReplacePreview, self).__init__(parent)
+        count = sum(preview[1] for preview in previews)
+        label = QLabel('{} occurrences in {} files'.format(count, len(previews)), self)
+
+        diff = QPlainTextEdit(self)
+        diff.setReadOnly(True)
+        diff.setLineWrapMode(QPlainTextEdit.NoWrap)
+        diff.setPlainText('\n\n'.join(preview[2] for preview in previews))
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel, self)
+        buttons.button(QDialogButtonBox.Ok).setText('&Replace')
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+
+        layout = QVBoxLayout()
+        layout.addWidget(label)
+        layout.addWidget(diff)
+        layout.addWidget(buttons)
+        self.setLayout(layout)
+        self.setWindowTitle('Replace in Files')
+        self.resize(800, 600)
+        self.show()
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+
+from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtWidgets import QDialog, QPushButton, QRadioButton, QPlainTextEdit, QLabel, QCheckBox, QGridLayout, \
+                            QTreeWidget, QTreeWidgetItem, QFileDialog
+from PyQt5 import sip
+import logging
+import os
+import re
+import threading
+import time
+
+from pyvicky import term_search
+from pyvicky.find_in_files import get_search_pool, walk_and_search
+
+
+class FindTerms(QDialog):
+    """
+    Counts a list of terms in the current tab or in the files of the directory opened in the tree.
+    The terms are combined into one pattern, so the text is scanned once, whatever the number of terms.
+    Every term shows its count, the number of files with it and its first locations.
+    """
+    # Locations of one term shown in the results
+    MAX_SHOWN = 200
+
+    # generation of the search, list of (path, {term: [count, locations]})
+    found = pyqtSignal(int, object)
+    # generation of the search, number of searched files
+    searchFinished = pyqtSignal(int, int)
+
+    def __init__(self, parent=None):
+        QDialog.__init__(self, parent)
+        self.parent = parent
+        # results of older searches are dropped
+        self.generation = 0
+        # threading.Event, which stops the running search
+        self.stopped = None
+        self.root = None
+        # editor of the current tab search
+        self.editor = None
+        self.startTime = 0
+        # term -> [count, number of files, number of shown locations]
+        self.counts = {}
+        # term -> QTreeWidgetItem
+        self.items = {}
+        self.found.connect(self.on_found)
+        self.searchFinished.connect(self.on_search_finished)
+        self.initUI()
+        self.finished.connect(self.stop)
+        if parent is not None:
+            parent.tabWidget.editorRemoved.connect(self.forget_editor)
+        logging.info('created find terms window')
+
+    def initUI(self):
+        # Terms input
+        self.termsField = QPlainTextEdit(self)
+        self.termsField.setPlaceholderText('One term per line')
+
+        # Load terms from a file
+        loadButton = QPushButton('&Load file...', self)
+        loadButton.clicked.connect(self.load_terms)
+
+        # Search button
+        searchButton = QPushButton('&Search', self)
+        searchButton.clicked.connect(self.search)
+
+        # Stop button
+        stopButton = QPushButton('S&top', self)
+        stopButton.clicked.connect(self.stop)
+
+        # Where to search
+        self.currentRadio = QRadioButton('Current tab', self)
+        self.projectRadio = QRadioButton('Project', self)
+        self.currentRadio.setChecked(True)
+
+        # Options
+        self.caseSensitive = QCheckBox('Case sensitive', self)
+        self.wholeWords = QCheckBox('Whole words', self)
+
+        # Terms with their counts, activating a location shows it
+        self.results = QTreeWidget(self)
+        self.results.setHeaderLabels(['Term', 'Count', 'Files'])
+        self.results.setUniformRowHeights(True)
+        self.results.itemActivated.connect(self.open_result)
+
+        self.statusLabel = QLabel(self)
+
+        # Layout
+        layout = QGridLayout()
+        layout.addWidget(self.termsField, 0, 0, 1, 4)
+        layout.addWidget(loadButton, 1, 0)
+        layout.addWidget(self.currentRadio, 1, 1)
+        layout.addWidget(self.projectRadio, 1, 2)
+        layout.addWidget(self.caseSensitive, 2, 1)
+        layout.addWidget(self.wholeWords, 2, 2)
+        layout.addWidget(searchButton, 2, 0)
+        layout.addWidget(stopButton, 2, 3)
+        layout.addWidget(self.results, 3, 0, 1, 4)
+        layout.addWidget(self.statusLabel, 4, 0, 1, 4)
+
+        self.setGeometry(300, 300, 500, 600)
+        self.setWindowTitle('Find Terms')
+        self.setLayout(layout)
+
+    def load_terms(self):
+        options = QFileDialog.Options()
+        options |= QFileDialog.DontUseNativeDialog
+        file_name, _ = QFileDialog.getOpenFileName(self, 'Load terms', '', 'All Files (*)', options=options)
+        if not file_name:
+            return
+        try:
+            with open(file_name, 'r', encoding='utf-8', errors='replace') as f:
+                self.termsField.setPlainText(f.read())
+        except OSError as e:
+            self.statusLabel.setText('Cannot read {}: {}'.format(file_name, e))
+
+    def search(self):
+        self.stop()
+        terms = term_search.parse_terms(self.termsField.toPlainText())
+        if not terms:
+            self.statusLabel.setText('No terms')
+            return
+        case_sensitive = self.caseSensitive.isChecked()
+        whole_words = self.wholeWords.isChecked()
+
+        self.generation += 1
+        self.startTime = time.monotonic()
+        self.counts = {}
+        self.items = {}
+        self.results.clear()
+        # all terms are listed, the ones, which are not found, stay at 0
+        for term in terms:
+            item = QTreeWidgetItem([term, '0', '0'])
+            self.items[term] = item
+            self.counts[term] = [0, 0, 0]
+        self.results.addTopLevelItems(list(self.items.values()))
+
+        if self.currentRadio.isChecked():
+            current_index = self.parent.tabWidget.get_cur_index()
+            if current_index < 0:
+                self.statusLabel.setText('No tab is open')
+                return
+            self.editor = self.parent.get_editor_by_index(current_index)
+            self.root = None
+            viewer = self.parent.tabWidget.get_viewer_from_tab(current_index)
+            if viewer is not None:
+                # the mapped file of a large file tab is searched, its locations are opened by the path
+                self.root = os.path.dirname(viewer.filePath)
+                path, data = viewer.filePath, viewer.file.data
+                source, flags, keys = term_search.make_terms_pattern(terms, case_sensitive, whole_words, binary=True)
+            else:
+                path, data = None, self.editor.toPlainText()
+                source, flags, keys = term_search.make_terms_pattern(terms, case_sensitive, whole_words)
+            self.statusLabel.setText('Searching...')
+            self.stopped = threading.Event()
+            threading.Thread(target=self.search_current,
+                             args=(self.generation, path, data, (source, flags, keys, case_sensitive), self.stopped),
+                             daemon=True).start()
+            return
+
+        self.editor = None
+        self.root = self.parent.treeWidget.root_path()
+        source, flags, keys = term_search.make_terms_pattern(terms, case_sensitive, whole_words, binary=True)
+        self.statusLabel.setText('Searching...')
+        self.stopped = threading.Event()
+        threading.Thread(target=self.search_tree,
+                         args=(get_search_pool(), self.generation, self.root, (source, flags, keys, case_sensitive),
+                               self.stopped),
+                         daemon=True).start()
+        logging.info('Searching {} terms in {}'.format(len(terms), self.root))
+
+    def stop(self):
+        if self.stopped is not None and not self.stopped.is_set():
+            self.stopped.set()
+            # results, which are already sent, are dropped too
+            self.generation += 1
+            self.statusLabel.setText('Stopped')
+
+    def forget_editor(self, editor):
+        """
+        the locations in the editor of a closed or hibernated tab are not opened any more
+        """
+        if self.editor is editor:
+            self.editor = None
+
+    def search_current(self, generation, path, data, args, stopped):
+        """
+        counts the terms in the text of the tab or in the mapped file, it is run in a thread
+        """
+        source, flags, keys, case_sensitive = args
+        try:
+            counts = term_search.count_terms(data, re.compile(source, flags), keys, case_sensitive, stopped)
+        except ValueError:
+            # the mapped file was closed with its tab
+            return
+        if counts is not None and not stopped.is_set():
+            self.found.emit(generation, [(path, counts)])
+            self.searchFinished.emit(generation, 1)
+
+    def search_tree(self, pool, generation, root, args, stopped):
+        """
+        counts the terms in the files of the tree, it is run in a thread
+        """
+        def on_results(results):
+            self.found.emit(generation, results)
+
+        searched = walk_and_search(pool, root, term_search.search_files, args, stopped, on_results)
+        if searched is not None:
+            self.searchFinished.emit(generation, searched)
+
+    def on_found(self, generation, results):
+        if generation != self.generation:
+            return
+        for path, counts in results:
+            for term, (count, locations) in counts.items():
+                total = self.counts[term]
+                total[0] += count
+                total[1] += 1
+                item = self.items[term]
+                item.setText(1, str(total[0]))
+                item.setText(2, str(total[1]))
+                shown = locations[:self.MAX_SHOWN - total[2]]
+                total[2] += len(shown)
+                for line, column, text in shown:
+                    where = '{}:{}'.format(os.path.relpath(path, self.root), line) if path else str(line)
+                    child = QTreeWidgetItem(item, ['{}: {}'.format(where, text.strip())])
+                    child.setData(0, Qt.UserRole, (path, line, column))
+
+    def on_search_finished(self, generation, searched):
+        if generation != self.generation:
+            return
+        hits = sum(total[0] for total in self.counts.values())
+        found = sum(1 for total in self.counts.values() if total[0])
+        status = '{} hits of {} of {} terms in {:.2f} s'.format(
+            hits, found, len(self.counts), time.monotonic() - self.startTime)
+        if self.root is not None:
+            status += ', {} files searched'.format(searched)
+        self.statusLabel.setText(status)
+        logging.info(status)
+
+    def open_result(self, item, column):
+        location = item.data(0, Qt.UserRole)
+        if location is None:
+            return
+        path, line, column = location
+        if path is not None:
+            self.parent.open_file_at(path, line, column)
+            return
+        editor = self.editor
+        if editor is None or sip.isdeleted(editor):
+            return
+        block = editor.document().findBlockByNumber(line - 1)
+        if not block.isValid():
+            return
+        cursor = editor.textCursor()
+        cursor.setPosition(block.position() + min(column, block.length() - 1))
+        editor.setTextCursor(cursor)
+        editor.centerCursor()
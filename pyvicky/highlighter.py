@@ -4,218 +4,676 @@ from PyQt5 import QtGui, QtCore
 from PyQt5.QtWidgets import QErrorMessage
 import logging
 import configparser
+import os
+import re
+import time
+from pyvicky import languages, semantic
+
+SETTINGS_PATH = 'pyvicky/configs/settings.ini'
+DEFAULT_THEME_PATH = 'pyvicky/configs/themes/default.ini'
 
 
 class BaseHighlighter(QtGui.QSyntaxHighlighter):
-    def __init__(self, parent=None):
+    """
+    Highlighters, which are attached to an editor with set_editor, format the visible blocks first
+    and the rest of the document in small time sliced batches in the background.
+    All blocks before self.frontier are highlighted with correct states,
+    blocks after it are left unformatted until they become visible or the background pass reaches them.
+    """
+    # Time budget of one background batch (seconds)
+    BATCH_TIME = 0.01
+    # Pause of the background pass after an edit or a scroll (milliseconds)
+    PAUSE_TIME = 300
+
+    # Name of the language in languages.LANGUAGES
+    language = None
+
+    def __init__(self, parent=None, language=None):
         super(BaseHighlighter, self).__init__(parent)
 
         self.parent = parent
-        self.indenters = []
-        self.dedenters = []
-
-    def get_palette(self):
-        raise NotImplementedError('You must subclass BaseHighlighter and implement this function.'
-                                  ' It should return a QtGui.QPalette.')
-
-
-class PythonHighlighter(BaseHighlighter):
-    def __init__(self, parent=None):
-        super(PythonHighlighter, self).__init__(parent)
-
-        self.parent = parent
-        self.load_config()
-
-        self.classRegex = QtCore.QRegExp("\\bQ[A-Za-z]+\\b")
-        self.singleLineCommentRegex = QtCore.QRegExp("#[^\n]*")
-        self.multiLineCommentRegex = None
-        self.singleQuoteRegex = QtCore.QRegExp("'.*'")
-        self.doubleQuoteRegex = QtCore.QRegExp("\".*\"")
-        self.functionRegex = QtCore.QRegExp("\\b[A-Za-z0-9_]+(?=\\()")
-        self.commentStartRegex = QtCore.QRegExp('/"""')
-        self.commentEndRegex = QtCore.QRegExp('"""/')
-
-        self.commentChar = '#'
-
-        keyword_format = QtGui.QTextCharFormat()
-        keyword_format.setFontWeight(QtGui.QFont.Bold)
-        self.keywordPatterns = self.get_patterns('pyvicky/keywords/python_keywords.txt')
-        self.highlightingRules = [(QtCore.QRegExp(pattern), keyword_format)
-                                  for pattern in self.keywordPatterns]
-
-        class_format = QtGui.QTextCharFormat()
-        class_format.setFontWeight(QtGui.QFont.Bold)
-        self.highlightingRules.append((self.classRegex,
-                                       class_format))
-
-        single_line_comment_format = QtGui.QTextCharFormat()
-        self.highlightingRules.append((self.singleLineCommentRegex, single_line_comment_format))
-
-        self.multiLineCommentFormat = QtGui.QTextCharFormat()
-
-        quotation_format = QtGui.QTextCharFormat()
-        self.highlightingRules.append((self.doubleQuoteRegex,
-                                       quotation_format))
-        self.highlightingRules.append((self.singleQuoteRegex,
-                                       quotation_format))
-
-        function_format = QtGui.QTextCharFormat()
-        function_format.setFontItalic(True)
-        function_format.setForeground(QtCore.Qt.blue)
-        self.highlightingRules.append((self.functionRegex,
-                                       function_format))
-
-        self.commentStartExpression = self.commentStartRegex
-        self.commentEndExpression = self.commentEndRegex
-
-        # For use by the main editor
-        self.indenters = ['def', 'for', 'while', 'do', 'class', 'if', 'else', 'elif', 'switch', 'case', 'try',
-                          'except', 'finally']
-        self.dedenters = ['break', 'continue', 'return']
+        if language:
+            self.language = language
+        definition = languages.get_language(self.language) if self.language else None
+        self.indenters = definition.indenters if definition else []
+        self.dedenters = definition.dedenters if definition else []
+        self.commentChar = definition.line_comment if definition else None
+
+        # Shared by all highlighters of the language, built on the first use
+        self.rules = get_rule_set(definition) if definition else None
+        self.editor = None
+        # Names resolved in the background, only for languages with semantic highlighting
+        self.semantic = None
+        self.frontier = 0
+        self.visibleBlocks = (0, -1)
+        self.forcedBlocks = (0, 0)
+        self.batchSize = 64
+        # True while the highlighter reformats blocks itself, Qt counts it as a new revision of the document
+        self.reformatting = False
+        # Number of edits of the text since the highlighter was created
+        self.edits = 0
+        self.backgroundTimer = QtCore.QTimer(self)
+        self.backgroundTimer.timeout.connect(self.highlight_next_batch)
+
+        document = self.document()
+        if document is not None:
+            self.blockCount = document.blockCount()
+            self.revision = document.revision()
+            # Reconnect the document, so that the frontier is moved before Qt reformats the changed blocks
+            self.setDocument(None)
+            document.contentsChange.connect(self.on_contents_change)
+            self.setDocument(document)
 
     def highlightBlock(self, text):
-        for pattern, _format in self.highlightingRules:
-            expression = QtCore.QRegExp(pattern)
-            index = expression.indexIn(text)
-            while index >= 0:
-                length = expression.matchedLength()
-                self.setFormat(index, length, _format)
-                index = expression.indexIn(text, index + length)
-
-        self.setCurrentBlockState(0)
-
-        start_index = 0
-        if self.previousBlockState() != 1:
-            start_index = self.commentStartExpression.indexIn(text)
-
-        while start_index >= 0:
-            end_index = self.commentEndExpression.indexIn(text, start_index)
-
-            if end_index == -1:
-                self.setCurrentBlockState(1)
-                comment_length = len(text) - start_index
-            else:
-                comment_length = end_index - start_index + self.commentEndExpression.matchedLength()
+        if self.rules is None or self.defer_block():
+            return
+        # Qt goes on to the next block only while its state differs from the previous highlighting,
+        # so an edit inside of a docstring stops right after the edited block
+        rules = self.rules
+        tokens, state = rules.tokenizer.scan(text, self.previousBlockState())
+        formats = rules.formats
+        for start, length, kind in tokens:
+            self.setFormat(start, length, formats[kind])
+        self.setCurrentBlockState(state)
+
+        spans = self.semantic.get_spans(self.currentBlock()) if self.semantic is not None else None
+        if spans:
+            semantic_formats = rules.semantic_formats
+            for i in range(0, len(spans), 3):
+                start, length = spans[i], spans[i + 1]
+                # merged, so that a semantic format without a color keeps the lexical one
+                text_format = self.format(start)
+                text_format.merge(semantic_formats[spans[i + 2]])
+                self.setFormat(start, length, text_format)
 
-            self.setFormat(start_index, comment_length, self.multiLineCommentFormat)
-            start_index = self.commentStartExpression.indexIn(text, start_index + comment_length)
+    def get_palette(self):
+        if self.rules is None:
+            raise NotImplementedError('You must subclass BaseHighlighter and implement this function.'
+                                      ' It should return a QtGui.QPalette.')
+        return QtGui.QPalette(self.rules.palette)
+
+    def reload_rules(self):
+        """
+        applies the current theme and keywords
+        :return: True, if the document is reformatted
+        """
+        return self.set_rules(get_rule_set(languages.get_language(self.language)))
+
+    def set_editor(self, editor):
+        """
+        switches the highlighter to the viewport first mode
+        :param editor: QPlainTextEdit, which shows the document
+        :return:
+        """
+        self.editor = editor
+        editor.verticalScrollBar().valueChanged.connect(self.on_view_changed)
+        editor.viewport().installEventFilter(self)
+        self.update_visible_blocks()
+        self.backgroundTimer.start(0)
+        definition = languages.get_language(self.language)
+        if definition is not None and definition.semantic and self.semantic is None:
+            if semantic.available():
+                self.semantic = semantic.SemanticLayer(self)
+            else:
+                logging.info('parso is not installed, semantic highlighting is disabled')
+
+    def close(self):
+        """
+        stops the background highlighting and drops the semantic tree, before the document is freed
+        """
+        self.backgroundTimer.stop()
+        if self.semantic is not None:
+            self.semantic.close()
+
+    def set_rules(self, rules):
+        """
+        swaps the rule set of the highlighter at once and reformats the document only if it is needed
+        :param rules: new RuleSet
+        :return: True, if the document is reformatted
+        """
+        old_rules, self.rules = self.rules, rules
+        if old_rules is rules or old_rules is None:
+            return False
+        if old_rules.keywords == rules.keywords and \
+                all(old_rules.formats[kind] == rules.formats[kind] for kind in rules.formats) and \
+                old_rules.semantic_formats == rules.semantic_formats:
+            # only the palette has changed
+            return False
+        self.restart()
+        return True
+
+    def restart(self):
+        """
+        reformats the whole document: in the viewport first mode visible blocks at once,
+        the rest in the background, keeping the old formats until then
+        """
+        if self.editor is None:
+            self.reformatting = True
+            self.rehighlight()
+            self.reformatting = False
+            self.revision = self.document().revision()
+            return
+        self.frontier = 0
+        first, last = self.visibleBlocks
+        self.rehighlight_blocks(first, last + 1)
+        self.backgroundTimer.start(0)
+
+    def defer_block(self):
+        """
+        must be called at the beginning of highlightBlock
+        :return: True, if the current block is left for the background pass and mustn't be formatted now
+        """
+        if self.editor is None:
+            return False
+        block = self.currentBlock()
+        number = block.blockNumber()
+        if number < self.frontier or self.forcedBlocks[0] <= number < self.forcedBlocks[1] or \
+                self.visibleBlocks[0] <= number <= self.visibleBlocks[1]:
+            if number == self.frontier:
+                self.frontier += 1
+            return False
+        # keep the old state, so Qt doesn't go on to the next block
+        self.setCurrentBlockState(block.userState())
+        return True
+
+    def highlight_next_batch(self):
+        document = self.document()
+        if document is None:
+            self.backgroundTimer.stop()
+            return
+        self.backgroundTimer.setInterval(0)
+        count = document.blockCount()
+        start = time.monotonic()
+        while self.frontier < count and time.monotonic() - start < self.BATCH_TIME:
+            batch_start = time.monotonic()
+            self.rehighlight_blocks(self.frontier, self.frontier + self.batchSize)
+            # Adapt the batch size, so that one batch takes between 1/8 and 1/2 of the time budget
+            elapsed = time.monotonic() - batch_start
+            if elapsed < self.BATCH_TIME / 8:
+                self.batchSize *= 2
+            elif elapsed > self.BATCH_TIME / 2 and self.batchSize > 1:
+                self.batchSize //= 2
+        if self.frontier >= count:
+            self.backgroundTimer.stop()
+            logging.debug('Background highlighting finished')
+
+    def rehighlight_blocks(self, first, last):
+        """
+        formats blocks from first up to last (not included) in one pass of Qt
+        """
+        block = self.document().findBlockByNumber(first)
+        start = block
+        for _ in range(last - first):
+            if not block.isValid():
+                break
+            # Qt goes on to the next block only if the state of the block has changed
+            block.setUserState(-2)
+            block = block.next()
+        self.forcedBlocks = (first, last)
+        self.reformatting = True
+        self.rehighlightBlock(start)
+        self.reformatting = False
+        self.forcedBlocks = (0, 0)
+        self.revision = self.document().revision()
+
+    def eventFilter(self, obj, event):
+        if event.type() == QtCore.QEvent.Resize:
+            self.on_view_changed()
+        return False
+
+    def update_visible_blocks(self):
+        first = self.editor.firstVisibleBlock().blockNumber()
+        lines = self.editor.viewport().height() // max(self.editor.fontMetrics().height(), 1)
+        visible_blocks = (first, first + lines + 1)
+        changed = visible_blocks != self.visibleBlocks
+        self.visibleBlocks = visible_blocks
+        return changed
+
+    def on_view_changed(self, *args):
+        if self.document() is None or not self.update_visible_blocks():
+            return
+        # Scrolling preempts the background pass
+        if self.frontier < self.document().blockCount():
+            self.backgroundTimer.start(self.PAUSE_TIME)
+        first, last = self.visibleBlocks
+        if last >= self.frontier:
+            self.rehighlight_blocks(max(first, self.frontier), last + 1)
+
+    def on_contents_change(self, position, chars_removed, chars_added):
+        document = self.document()
+        if document is None or self.reformatting or document.revision() == self.revision:
+            # formats, changed by highlighting itself
+            return
+        self.revision = document.revision()
+        self.edits += 1
+        count = document.blockCount()
+        delta = count - self.blockCount
+        self.blockCount = count
+        first = document.findBlock(position).blockNumber()
+        last = document.findBlock(position + chars_added).blockNumber()
+        if first < self.frontier:
+            if last - first > self.visibleBlocks[1] - self.visibleBlocks[0]:
+                # Big change (paste, setPlainText): Qt mustn't reformat all of it at once
+                self.frontier = first + 1
+            else:
+                self.frontier = max(self.frontier + delta, first + 1)
+        # Edits preempt the background pass
+        if self.editor is not None and self.frontier < count:
+            self.backgroundTimer.start(self.PAUSE_TIME)
+        if self.semantic is not None:
+            self.semantic.on_contents_change()
+
+
+# Lexer state, that is stored in the block state of QSyntaxHighlighter:
+# bits 0-2 - string or comment, which is still open at the end of the block (index of its Delimiter + 1)
+# bit 3    - the line ends with a backslash continuation
+# bits 4.. - depth of the open brackets
+STRING_MASK = 0b111
+CONTINUATION_FLAG = 0b1000
+DEPTH_SHIFT = 4
+MAX_DEPTH = 0xFFFF
+
+
+def encode_state(string, continued, depth):
+    return string | (CONTINUATION_FLAG if continued else 0) | (min(depth, MAX_DEPTH) << DEPTH_SHIFT)
+
+
+def decode_state(state):
+    """
+    :param state: block state, -1 (not highlighted yet) is the same as 0
+    :return: (string, continued, depth)
+    """
+    state = max(state, 0)
+    return state & STRING_MASK, bool(state & CONTINUATION_FLAG), state >> DEPTH_SHIFT
+
+
+class Tokenizer:
+    """
+    Single pass scanner for one block of text.
+    All token rules are joined into one compiled alternation, so every character
+    of the block is looked at once; rules listed first win at the same position.
+    Identifiers are classified afterwards with a set lookup instead of one regex per keyword.
+    Strings and comments, that are not closed at the end of the block, brackets and line continuations
+    are carried over to the next block as the lexer state.
+    """
+    def __init__(self, language, keywords):
+        self.keywords = frozenset(keywords)
+        self.delimiters = language.delimiters
+        if len(self.delimiters) > STRING_MASK:
+            raise ValueError('Too many delimiters in language ' + language.name)
+        # Longer openers first, so that ''' is not taken for an empty string
+        self.openers = {delimiter.opener: index + 1 for index, delimiter in enumerate(self.delimiters)}
+        openers = sorted(self.openers, key=len, reverse=True)
+        self.kinds = {}
+        rules = []
+        if language.line_comment:
+            rules.append(('comment', re.escape(language.line_comment) + r'[^\n]*'))
+        if openers:
+            rules.append(('delimiter', '|'.join(re.escape(opener) for opener in openers)))
+        for index, (kind, pattern) in enumerate(language.rules):
+            self.kinds['rule{}'.format(index)] = kind
+            rules.append(('rule{}'.format(index), pattern))
+        rules += [
+            ('number', r'\b(?:0[xXbBoO][0-9a-fA-F_]+|\d[\d_]*(?:\.\d*)?(?:[eE][+-]?\d+)?)[jJlLuUfF]*(?!\w)'),
+            ('word', r'[A-Za-z0-9_]+'),
+            ('open', r'[(\[{]'),
+            ('close', r'[)\]}]'),
+            ('continuation', r'\\$'),
+        ]
+        self.regex = re.compile('|'.join('(?P<{}>{})'.format(name, pattern) for name, pattern in rules))
+        # Rest of the span after the opener: up to the closer or to the end of the block
+        self.bodies = [re.compile(self.make_body(delimiter)) for delimiter in self.delimiters]
 
     @staticmethod
-    def get_patterns(file_path):
-        patterns = []
-        with open(file_path, 'r') as f:
-            for keyword in f:
-                patterns.append('\\b{}\\b'.format(keyword.strip()))
-        return patterns
-
-    def load_config(self):
-        self.settings = configparser.ConfigParser()
-        self.settings.read('pyvicky/configs/settings.ini')
-        self.theme = configparser.ConfigParser()  # The theme config
+    def make_body(delimiter):
+        closer = delimiter.closer
+        first, rest = re.escape(closer[0]), re.escape(closer[1:])
+        escape = '\\\\' if delimiter.escape else ''
+        parts = ['[^{}{}]'.format(first, escape)]
+        if delimiter.escape:
+            parts.append(r'\\.')
+        if rest:
+            parts.append('{}(?!{})'.format(first, rest))
+        return '(?:{})*(?:(?P<close>{})|{}$)'.format('|'.join(parts), re.escape(closer), r'\\?' if escape else '')
+
+    def scan(self, text, state=0):
+        """
+        scans one block
+        :param text: text of the block
+        :param state: lexer state at the end of the previous block
+        :return: list of (start, length, kind) for every token, that should be formatted, and the new state
+        """
+        tokens = []
+        string, _, depth = decode_state(state)
+        continued = False
+        pos = 0
+        if string:
+            pos, string = self.scan_delimited(text, 0, 0, string, tokens)
+
+        keywords = self.keywords
+        regex = self.regex
+        while not string:
+            match = regex.search(text, pos)
+            if not match:
+                break
+            kind = match.lastgroup
+            start, pos = match.span()
+            if kind == 'word':
+                word = match.group()
+                if text.startswith('(', pos):
+                    kind = 'function'
+                elif word in keywords:
+                    kind = 'keyword'
+                elif word[0] == 'Q' and len(word) > 1 and word[1:].isalpha():
+                    kind = 'class'
+                else:
+                    continue
+            elif kind == 'delimiter':
+                pos, string = self.scan_delimited(text, start, pos, self.openers[match.group()], tokens)
+                continue
+            elif kind == 'open':
+                depth += 1
+                continue
+            elif kind == 'close':
+                depth = max(depth - 1, 0)
+                continue
+            elif kind == 'continuation':
+                continued = True
+                continue
+            elif kind in self.kinds:
+                kind = self.kinds[kind]
+            tokens.append((start, pos - start, kind))
+
+        return tokens, encode_state(string, continued, depth)
+
+    def scan_delimited(self, text, start, pos, string, tokens):
+        """
+        scans the string or the comment from the opener at start up to its closer
+        :return: position after the span and the span, which is still open at the end of the block (or 0)
+        """
+        delimiter = self.delimiters[string - 1]
+        body = self.bodies[string - 1].match(text, pos)
+        end = body.end()
+        tokens.append((start, end - start, delimiter.kind))
+        if body.group('close') or not (delimiter.multiline or delimiter.escape and text.endswith('\\')):
+            # closed or not terminated single line string, which doesn't go on the next line
+            return end, 0
+        return end, string
+
+
+# Compiled rule sets, shared by all highlighters: (language, theme path) -> (modification times, RuleSet)
+rule_sets = {}
+# Parsed config files: path -> (modification time, ConfigParser)
+configs = {}
+
+
+def get_mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def read_config(path):
+    """
+    reads the config file only if it was changed since the last call
+    the returned ConfigParser is shared, so it mustn't be changed
+    :param path:
+    :return:
+    """
+    mtime = get_mtime(path)
+    cached = configs.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    config = configparser.ConfigParser()
+    config.read(path)
+    configs[path] = (mtime, config)
+    return config
+
+
+def get_rule_set(language):
+    """
+    returns the rule set of the language for the current theme
+    it is built only once and rebuilt, when the theme, the settings or the keywords file changes
+    :param language: languages.Language
+    :return: RuleSet
+    """
+    settings = read_config(SETTINGS_PATH)
+    theme_path = settings.get('Editor', 'theme', fallback=DEFAULT_THEME_PATH)
+    mtimes = (get_mtime(SETTINGS_PATH), get_mtime(theme_path), get_mtime(language.keywords_path))
+    cached = rule_sets.get((language.name, theme_path))
+    if cached and cached[0] == mtimes:
+        return cached[1]
+    rule_set = RuleSet(language, theme_path)
+    rule_sets[(language.name, theme_path)] = (mtimes, rule_set)
+    logging.info('Built {} highlighting rules for {}'.format(language.name, theme_path))
+    return rule_set
+
+
+def get_keywords(file_path):
+    keywords = []
+    with open(file_path, 'r') as f:
+        for keyword in f:
+            if keyword.strip():
+                keywords.append(keyword.strip())
+    return keywords
+
+
+def get_QColor(color_string):
+    try:
+        # Assume the string is hexadecimal RGB
+        rVal = int(color_string[:2], 16)
+        gVal = int(color_string[2:4], 16)
+        bVal = int(color_string[4:6], 16)
+        return QtGui.QColor(rVal, gVal, bVal)
+    except Exception as e:
+        logging.error(e)
+        # Not hex string, so try a built-in QColor color
         try:
-            self.theme.read(self.settings['Editor']['theme'])
+            return QtGui.QColor('#' + color_string)
         except Exception as e:
             logging.error(e)
-            self.theme.read('pyvicky/configs/themes/default.ini')
-            self.make_error_popup(msg='Unable to load theme at path specified in settings.ini. '
-                                      'Reverting to default theme.')
-
-    def get_QColor(self, color_string):
-        try:
-            # Assume the string is hexadecimal RGB
-            rVal = int(color_string[:2], 16)
-            gVal = int(color_string[2:4], 16)
-            bVal = int(color_string[4:6], 16)
-            return QtGui.QColor(rVal, gVal, bVal)
-        except Exception as e:
-            logging.error(e)
-            # Not hex string, so try a built-in QColor color
-            try:
-                return QtGui.QColor('#' + color_string)
-            except Exception as e:
-                logging.error(e)
-                return None
-
-    def get_palette(self):
+            return None
+
+
+def make_error_popup(title='Oops', msg='Something went wrong...'):
+    popup = QErrorMessage()
+    popup.setWindowTitle(title)
+    popup.showMessage(msg)
+
+
+class RuleSet:
+    """
+    Tokenizer, formats and palette of one language with one theme.
+    It is shared by all highlighters of the language, so it mustn't be changed after it is built.
+    """
+    def __init__(self, language, theme_path):
+        self.keywords = tuple(get_keywords(language.keywords_path))
+        self.tokenizer = Tokenizer(language, self.keywords)
+
+        theme = configparser.ConfigParser()
+        if not theme.read(theme_path):
+            logging.error('Unable to read theme ' + theme_path)
+            theme.read(DEFAULT_THEME_PATH)
+            make_error_popup(msg='Unable to load theme at path specified in settings.ini. '
+                                 'Reverting to default theme.')
+
+        # Format of every token kind, produced by the tokenizer
+        self.formats = {kind: QtGui.QTextCharFormat() for kind in ('keyword', 'class', 'comment', 'multiline',
+                                                                   'string', 'number', 'function')}
+        self.formats['keyword'].setFontWeight(QtGui.QFont.Bold)
+        self.formats['class'].setFontWeight(QtGui.QFont.Bold)
+        self.formats['function'].setFontItalic(True)
+        self.formats['function'].setForeground(QtCore.Qt.blue)
+        self.palette = None
+        self.make_palette(theme)
+        self.semantic_formats = self.make_semantic_formats(theme)
+
+    def make_palette(self, theme):
+        """
+        sets the colored formats and builds the palette of the editor
+        :param theme: ConfigParser of the theme
+        :return:
+        """
         palette = QtGui.QPalette()
 
         # Keywords
-        keyword_color = self.get_QColor(self.theme['Colors']['Keyword'])
+        keyword_color = get_QColor(theme['Colors']['Keyword'])
         if keyword_color:
             keyword_format = QtGui.QTextCharFormat()
             keyword_format.setForeground(keyword_color)
-            self.highlightingRules += [(pattern, keyword_format) for pattern in self.keywordPatterns]
+            self.formats['keyword'] = keyword_format
         else:
-            self.make_error_popup(msg='Unable to load the color for Keyword from settings')
+            make_error_popup(msg='Unable to load the color for Keyword from settings')
 
         # Background Color
-        bg_color = self.get_QColor(self.theme['Colors']['Background'])
+        bg_color = get_QColor(theme['Colors']['Background'])
         if bg_color:
             palette.setColor(QtGui.QPalette.Base, bg_color)
         else:
-            self.make_error_popup(msg='Unable to load the color for Background from settings')
+            make_error_popup(msg='Unable to load the color for Background from settings')
 
         # Foreground Color
-        fgc = self.get_QColor(self.theme['Colors']['Foreground'])
+        fgc = get_QColor(theme['Colors']['Foreground'])
         if fgc:
             palette.setColor(QtGui.QPalette.Text, fgc)
         else:
-            self.make_error_popup(msg='Unable to load the color for Foreground from settings')
+            make_error_popup(msg='Unable to load the color for Foreground from settings')
 
         # Single Line Comments
-        line_comment_color = self.get_QColor(self.theme['Colors']['SingleLineComment'])
+        line_comment_color = get_QColor(theme['Colors']['SingleLineComment'])
         if line_comment_color:
             line_comment_format = QtGui.QTextCharFormat()
             line_comment_format.setForeground(line_comment_color)
-            self.highlightingRules.append((self.singleLineCommentRegex, line_comment_format))
+            self.formats['comment'] = line_comment_format
         else:
-            self.make_error_popup(msg='Unable to load the color for SingleLineComment from settings')
-
-        # Single Quotes
-        single_quote_color = self.get_QColor(self.theme['Colors']['String'])
-        if single_quote_color:
-            single_quote_format = QtGui.QTextCharFormat()
-            single_quote_format.setForeground(single_quote_color)
-            self.highlightingRules.append((self.singleQuoteRegex, single_quote_format))
+            make_error_popup(msg='Unable to load the color for SingleLineComment from settings')
+
+        # Multi line strings and docstrings
+        multi_line_comment_color = get_QColor(theme['Colors']['MultiLineComment'])
+        if multi_line_comment_color:
+            multi_line_comment_format = QtGui.QTextCharFormat()
+            multi_line_comment_format.setForeground(multi_line_comment_color)
+            self.formats['multiline'] = multi_line_comment_format
         else:
-            self.make_error_popup(msg='Unable to load the color for String from settings')
-
-        # Double Quotes (uses same as single quote string)
-        if single_quote_color:
-            single_quote_format = QtGui.QTextCharFormat()
-            single_quote_format.setForeground(single_quote_color)
-            self.highlightingRules.append((self.doubleQuoteRegex, single_quote_format))
+            make_error_popup(msg='Unable to load the color for MultiLineComment from settings')
+
+        # Strings (single and double quotes use the same color)
+        string_color = get_QColor(theme['Colors']['String'])
+        if string_color:
+            string_format = QtGui.QTextCharFormat()
+            string_format.setForeground(string_color)
+            self.formats['string'] = string_format
+        else:
+            make_error_popup(msg='Unable to load the color for String from settings')
+
+        # Numbers (themes without a Number color use the String color)
+        number_color = get_QColor(theme['Colors'].get('Number', theme['Colors']['String']))
+        if number_color:
+            number_format = QtGui.QTextCharFormat()
+            number_format.setForeground(number_color)
+            self.formats['number'] = number_format
+        else:
+            make_error_popup(msg='Unable to load the color for Number from settings')
 
         # Functions
-        function_color = self.get_QColor(self.theme['Colors']['Function'])
+        function_color = get_QColor(theme['Colors']['Function'])
         if function_color:
             function_format = QtGui.QTextCharFormat()
             function_format.setForeground(function_color)
-            self.highlightingRules.append((self.functionRegex, function_format))
+            self.formats['function'] = function_format
         else:
-            self.make_error_popup(msg='Unable to load the color for Function from settings')
+            make_error_popup(msg='Unable to load the color for Function from settings')
 
-        select_color = self.get_QColor(self.theme['Colors']['Highlight'])
+        select_color = get_QColor(theme['Colors']['Highlight'])
         if select_color:
             palette.setColor(QtGui.QPalette.Highlight, select_color)
         else:
-            self.make_error_popup(msg='Unable to load the color for Highlight from settings')
+            make_error_popup(msg='Unable to load the color for Highlight from settings')
 
-        selected_text_color = self.get_QColor(self.theme['Colors']['HighlightedText'])
+        selected_text_color = get_QColor(theme['Colors']['HighlightedText'])
         if selected_text_color:
             palette.setColor(QtGui.QPalette.HighlightedText, selected_text_color)
         else:
-            self.make_error_popup(msg='Unable to load the color for HighlightedText from settings')
+            make_error_popup(msg='Unable to load the color for HighlightedText from settings')
+
+        self.palette = palette
+
+    def make_semantic_formats(self, theme):
+        """
+        formats of the names, resolved by the semantic pass, in the order of semantic.SEMANTIC_KINDS
+        the colors are optional in the themes: parameters are italic and builtins
+        use the Function color by default, other kinds are left as they are
+        :param theme: ConfigParser of the theme
+        :return: list of QTextCharFormat
+        """
+        colors = theme['Colors']
+        semantic_formats = []
+        for kind in semantic.SEMANTIC_KINDS:
+            semantic_format = QtGui.QTextCharFormat()
+            color = colors.get(kind.capitalize())
+            if color is None and kind == 'builtin':
+                color = colors.get('Function')
+            if color:
+                semantic_format.setForeground(get_QColor(color))
+            if kind == 'parameter':
+                semantic_format.setFontItalic(True)
+            semantic_formats.append(semantic_format)
+        return semantic_formats
 
-        return palette
 
-    @staticmethod
-    def make_error_popup(title='Oops', msg='Something went wrong...'):
-        popup = QErrorMessage()
-        popup.setWindowTitle(title)
-        popup.showMessage(msg)
+class PythonHighlighter(BaseHighlighter):
+    language = 'python'
 
 
 class CppHighlighter(BaseHighlighter):
-    def get_palette(self):
-        pass
+    language = 'cpp'
+
+
+def create_highlighter(document, file_path=None):
+    """
+    creates the highlighter for the language of the file
+    files with unknown extensions and new files get the highlighter from settings.ini
+    :param document: QTextDocument
+    :param file_path:
+    :return: BaseHighlighter
+    """
+    language = languages.get_language_for_file(file_path)
+    if language is None:
+        settings = read_config(SETTINGS_PATH)
+        language = languages.get_language_by_highlighter(
+            settings.get('Extensions', 'highlighter', fallback='PythonHighlighter')) or languages.LANGUAGES[0]
+    highlighter_class = globals().get(language.highlighter, BaseHighlighter)
+    return highlighter_class(document, language=language.name)
+
+
+def benchmark(path='pyvicky/window.py', copies=(1, 10, 40), repeat=3):
+    """
+    prints the time of the full highlighting of a python file, repeated to get larger documents
+    run it with python -m pyvicky.highlighter from the root of the repository
+    """
+    import sys
+    from PyQt5.QtWidgets import QApplication, QPlainTextDocumentLayout
+    app = QApplication.instance() or QApplication(sys.argv)
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    for count in copies:
+        document = QtGui.QTextDocument()
+        document.setDocumentLayout(QPlainTextDocumentLayout(document))
+        document.setPlainText(text * count)
+        highlighter = PythonHighlighter(document)
+        # the first highlighting builds the rule set
+        app.processEvents()
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            highlighter.rehighlight()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print('{:>7} blocks: {:.3f} s, {:,.0f} blocks/s'.format(document.blockCount(), best,
+                                                                 document.blockCount() / best))
+        highlighter.close()
+
+
+if __name__ == '__main__':
+    benchmark()
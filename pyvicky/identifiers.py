@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+from PyQt5.QtCore import QObject, QTimer
+from collections import Counter
+import heapq
+import logging
+import re
+import sys
+import time
+
+from pyvicky.matcher import fuzzy_score, PREFIX_BONUS
+
+IDENTIFIER = re.compile(r'[A-Za-z_][A-Za-z0-9_]+')
+
+identifier_index = None
+
+
+def get_identifier_index():
+    """
+    :return: IdentifierIndex of all open documents
+    """
+    global identifier_index
+    if identifier_index is None:
+        identifier_index = IdentifierIndex()
+    return identifier_index
+
+
+def scan_block(text):
+    return tuple(sys.intern(word) for word in IDENTIFIER.findall(text))
+
+
+class IdentifierIndex:
+    """
+    Identifiers of all open documents with the number of their occurrences.
+    Every added occurrence marks the word as recently used, so names, which are being typed now,
+    are ranked above the old ones with the same frequency.
+    """
+    # Bonus of a word, which has just been typed, it halves every RECENCY_HALF_LIFE edits
+    RECENCY_BONUS = 10.0
+    RECENCY_HALF_LIFE = 50.0
+
+    def __init__(self):
+        self.counts = Counter()
+        # word -> number of the last edit, which added it
+        self.recency = {}
+        self.edits = 0
+
+    def add(self, words):
+        self.counts.update(words)
+        for word in words:
+            self.recency[word] = self.edits
+
+    def remove(self, words):
+        counts = self.counts
+        for word in words:
+            count = counts[word] - 1
+            if count > 0:
+                counts[word] = count
+            else:
+                del counts[word]
+                self.recency.pop(word, None)
+
+    def score(self, word):
+        age = self.edits - self.recency.get(word, -sys.maxsize)
+        return self.counts[word] + self.RECENCY_BONUS * 0.5 ** (age / self.RECENCY_HALF_LIFE)
+
+    def complete(self, prefix, limit=50):
+        """
+        :param prefix: beginning of the word, case insensitive
+        :param limit: maximum number of results
+        :return: identifiers with the prefix, then fuzzy matches, from the most frequent and recent to the least
+        """
+        lower = prefix.lower()
+        counts = self.counts
+        scored = []
+        for word in counts:
+            if word[0].lower() != lower[:1] or word == prefix and counts[word] == 1:
+                # the word under the cursor is in the index too, while it is being typed
+                continue
+            match = fuzzy_score(word, lower)
+            if match is not None:
+                prefix_bonus = PREFIX_BONUS if word.lower().startswith(lower) else 0
+                scored.append((prefix_bonus + match + self.score(word), word))
+        return [word for _, word in heapq.nlargest(limit, scored)]
+
+
+class DocumentIndex(QObject):
+    """
+    Identifiers of one QTextDocument, kept up to date block by block.
+    Only the blocks, which are touched by an edit, are scanned again.
+    Big inserts (opening a file, paste) are scanned in time sliced batches in the background.
+    """
+    # Time budget of one background batch (seconds)
+    BATCH_TIME = 0.01
+    # Bigger changes are scanned in the background
+    SYNC_BLOCKS = 100
+
+    def __init__(self, document):
+        super(DocumentIndex, self).__init__(document)
+        self.document = document
+        self.index = get_identifier_index()
+        self.counts = Counter()
+        # (hash of the text, identifiers) of every block, None for a block, which is not scanned yet
+        self.blocks = [None] * document.blockCount()
+        # blocks before this one are all scanned
+        self.scanned = 0
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.scan_next_batch)
+        document.contentsChange.connect(self.on_contents_change)
+        self.timer.start(0)
+
+    def close(self):
+        """
+        removes identifiers of the document from the shared index
+        """
+        self.timer.stop()
+        self.document.contentsChange.disconnect(self.on_contents_change)
+        self.index.remove(list(self.counts.elements()))
+        self.counts = Counter()
+        self.blocks = []
+
+    def on_contents_change(self, position, chars_removed, chars_added):
+        document = self.document
+        first = document.findBlock(position).blockNumber()
+        last = document.findBlock(position + chars_added).blockNumber()
+        if last < 0:
+            last = document.blockCount() - 1
+        delta = document.blockCount() - len(self.blocks)
+        # blocks first..old_last were replaced by blocks first..last
+        old_last = last - delta
+        old_entries = self.blocks[first:old_last + 1]
+        if last - first >= self.SYNC_BLOCKS:
+            for entry in old_entries:
+                if entry is not None:
+                    self.remove(entry[1])
+            self.blocks[first:old_last + 1] = [None] * (last - first + 1)
+            self.scanned = min(self.scanned, first)
+            self.timer.start(0)
+            return
+
+        block = document.findBlockByNumber(first)
+        entries = []
+        for number in range(first, last + 1):
+            text = block.text()
+            old = old_entries[number - first] if delta == 0 else None
+            if old is not None and old[0] == hash(text):
+                # only the formats were changed
+                entries.append(old)
+            else:
+                entries.append((hash(text), scan_block(text)))
+            block = block.next()
+        kept = set(map(id, entries)) & set(map(id, old_entries))
+        if len(kept) == len(entries) == len(old_entries):
+            return
+        self.index.edits += 1
+        for entry in old_entries:
+            if entry is not None and id(entry) not in kept:
+                self.remove(entry[1])
+        for entry in entries:
+            if id(entry) not in kept:
+                self.add(entry[1])
+        self.blocks[first:old_last + 1] = entries
+
+    def add(self, words):
+        self.counts.update(words)
+        self.index.add(words)
+
+    def remove(self, words):
+        counts = self.counts
+        for word in words:
+            counts[word] -= 1
+            if counts[word] <= 0:
+                del counts[word]
+        self.index.remove(words)
+
+    def scan_next_batch(self):
+        blocks = self.blocks
+        while self.scanned < len(blocks) and blocks[self.scanned] is not None:
+            self.scanned += 1
+        if self.scanned >= len(blocks):
+            self.timer.stop()
+            return
+        block = self.document.findBlockByNumber(self.scanned)
+        start = time.monotonic()
+        while block.isValid() and time.monotonic() - start < self.BATCH_TIME:
+            for _ in range(64):
+                if not block.isValid():
+                    break
+                number = block.blockNumber()
+                if blocks[number] is None:
+                    text = block.text()
+                    blocks[number] = (hash(text), scan_block(text))
+                    self.add(blocks[number][1])
+                block = block.next()
+        self.scanned = block.blockNumber() if block.isValid() else len(blocks)
+        if self.scanned >= len(blocks):
+            self.timer.stop()
+            logging.debug('Indexed {} identifiers'.format(len(self.counts)))
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Completion worker, started by completion.JediCompletion as a separate process.
+Requests and replies are JSON objects, one per line, on stdin and stdout.
+It is run as a script, so it doesn't import PyQt and the rest of the editor.
+"""
+
+import json
+import os
+import sys
+import threading
+
+# Exit code, when jedi is not installed
+NO_JEDI = 3
+# Maximum number of completions in a reply
+LIMIT = 200
+
+
+class RequestQueue:
+    """
+    Keeps only the newest request: requests, which came while jedi was busy, are superseded by the last one
+    """
+    def __init__(self):
+        self.request = None
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def read(self, stream):
+        for line in stream:
+            with self.condition:
+                self.request = line
+                self.condition.notify()
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def get(self):
+        with self.condition:
+            while self.request is None and not self.closed:
+                self.condition.wait()
+            request, self.request = self.request, None
+            return request
+
+
+def complete(jedi, projects, request):
+    """
+    :param jedi: jedi module
+    :param projects: project root -> jedi.Project, they are kept to reuse the caches of jedi
+    :param request: dict with source, path, line (from 1) and column
+    :return: list of (name, type)
+    """
+    path = request.get('path')
+    if hasattr(jedi.Script, 'complete'):
+        root = os.path.dirname(os.path.abspath(path)) if path else os.getcwd()
+        if root not in projects:
+            projects[root] = jedi.Project(root)
+        script = jedi.Script(request['source'], path=path, project=projects[root])
+        completions = script.complete(request['line'], request['column'])
+    else:
+        # jedi before 0.16
+        script = jedi.Script(request['source'], request['line'], request['column'], path)
+        completions = script.completions()
+    return [(completion.name, completion.type) for completion in completions[:LIMIT]]
+
+
+def main():
+    try:
+        import jedi
+    except ImportError:
+        sys.exit(NO_JEDI)
+    projects = {}
+    # Loads builtins and the standard library, so that the first real request is fast
+    try:
+        complete(jedi, projects, {'source': 'import os\nos.', 'path': None, 'line': 2, 'column': 3})
+    except Exception as e:
+        sys.stderr.write('jedi warm up failed: {}\n'.format(e))
+
+    queue = RequestQueue()
+    threading.Thread(target=queue.read, args=(sys.stdin,), daemon=True).start()
+    while True:
+        line = queue.get()
+        if line is None:
+            break
+        request = json.loads(line)
+        try:
+            completions = complete(jedi, projects, request)
+        except Exception as e:
+            sys.stderr.write('jedi failed: {}\n'.format(e))
+            completions = []
+        sys.stdout.write(json.dumps({'id': request['id'], 'completions': completions}) + '\n')
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
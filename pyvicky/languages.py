@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+import os
+
+# Text between an opener and a closer (string, block comment).
+# multiline - the span goes on after the end of the line,
+# escape - backslash escapes the next character (and continues the line)
+Delimiter = namedtuple('Delimiter', 'opener closer kind multiline escape')
+
+
+class Language:
+    """
+    Declarative description of a language for highlighting.
+    Nothing is read or compiled here, the rules are built by the highlighter on first use.
+    """
+    def __init__(self, name, highlighter, extensions, keywords_path, line_comment=None, delimiters=(), rules=(),
+                 indenters=(), dedenters=(), semantic=False):
+        """
+        :param name: name of the language
+        :param highlighter: name of the highlighter class in highlighter.py
+        :param extensions: file extensions with the dot, lower case
+        :param keywords_path: file with keywords, one per line
+        :param line_comment: string, that starts a comment up to the end of the line
+        :param delimiters: Delimiter list of strings and block comments
+        :param rules: additional (kind, regex) rules, that are tried before words
+        :param indenters: words, after which the next line is indented
+        :param dedenters: words, after which the next line is dedented
+        :param semantic: names are resolved in the background by semantic.py (Python only)
+        """
+        self.name = name
+        self.highlighter = highlighter
+        self.extensions = tuple(extensions)
+        self.keywords_path = keywords_path
+        self.line_comment = line_comment
+        self.delimiters = tuple(delimiters)
+        self.rules = tuple(rules)
+        self.indenters = list(indenters)
+        self.dedenters = list(dedenters)
+        self.semantic = semantic
+
+
+LANGUAGES = [
+    Language('python', 'PythonHighlighter', ('.py', '.pyw', '.pyi'), 'pyvicky/keywords/python_keywords.txt',
+             line_comment='#',
+             delimiters=(Delimiter("'''", "'''", 'multiline', True, True),
+                         Delimiter('"""', '"""', 'multiline', True, True),
+                         Delimiter("'", "'", 'string', False, True),
+                         Delimiter('"', '"', 'string', False, True)),
+             indenters=('def', 'for', 'while', 'do', 'class', 'if', 'else', 'elif', 'switch', 'case', 'try',
+                        'except', 'finally'),
+             dedenters=('break', 'continue', 'return'),
+             semantic=True),
+    Language('cpp', 'CppHighlighter', ('.c', '.h', '.cpp', '.hpp', '.cc', '.hh', '.cxx', '.hxx'),
+             'pyvicky/keywords/cpp_keywords.txt',
+             line_comment='//',
+             delimiters=(Delimiter('/*', '*/', 'multiline', True, False),
+                         Delimiter('"', '"', 'string', False, True),
+                         Delimiter("'", "'", 'string', False, True)),
+             rules=(('keyword', r'#\s*[A-Za-z_]+'),),
+             indenters=('{',),
+             dedenters=('break', 'continue', 'return')),
+]
+
+
+def register(language):
+    LANGUAGES.append(language)
+
+
+def get_language(name):
+    for language in LANGUAGES:
+        if language.name == name:
+            return language
+    return None
+
+
+def get_language_by_highlighter(highlighter):
+    for language in LANGUAGES:
+        if language.highlighter == highlighter:
+            return language
+    return None
+
+
+def get_language_for_file(file_path):
+    """
+    :param file_path:
+    :return: Language of the file by its extension or None
+    """
+    if not file_path:
+        return None
+    extension = os.path.splitext(file_path)[1].lower()
+    for language in LANGUAGES:
+        if extension in language.extensions:
+            return language
+    return None
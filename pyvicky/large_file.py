@@ -0,0 +1,476 @@
+# -*- coding: utf-8 -*-
+
+from PyQt5.QtCore import Qt, QEvent, QTimer, pyqtSignal
+from PyQt5.QtGui import QPainter, QColor
+from PyQt5.QtWidgets import QAbstractScrollArea, QApplication
+from array import array
+from bisect import bisect_right
+from itertools import islice
+import logging
+import mmap
+import os
+import re
+import threading
+import time
+
+from pyvicky.loader import detect_encoding, SNIFF_SIZE
+
+# Only every LINE_STEP-th line start is stored, the lines between are found in the mapped file
+LINE_STEP = 32
+# Bytes, which are read at once by the index thread
+INDEX_BLOCK_SIZE = 1 << 24
+# Bytes of the file, which are searched at once and dropped from the memory afterwards
+SEARCH_WINDOW = 1 << 22
+# Longer lines are cut in the view
+MAX_LINE_BYTES = 1 << 14
+# Encodings, in which a line ends with the byte b'\n'
+MAPPED_ENCODINGS = ('utf-8', 'latin-1')
+
+NEWLINE = re.compile(b'\n')
+
+
+class MappedFile:
+    """
+    A read-only file mapped into memory with an index of its lines.
+    The index is built in a thread from plain reads, so it doesn't keep the pages of the file in memory,
+    and it is an array('Q') of the start of every LINE_STEP-th line: 8 bytes per LINE_STEP lines.
+    A line is found from the closest indexed line in at most LINE_STEP - 1 steps, whatever the size of the file.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.size = os.fstat(f.fileno()).st_size
+            # raises ValueError for an empty file
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.encoding, bom = detect_encoding(self.data[:SNIFF_SIZE])
+        if self.encoding not in MAPPED_ENCODINGS:
+            self.data.close()
+            raise ValueError('{} is not supported for mapped files'.format(self.encoding))
+        self.offsets = array('Q', [len(bom)])
+        # (number of known lines, bytes indexed so far), they are replaced together
+        self.indexed = (1, len(bom))
+        self.complete = False
+        self.closed = threading.Event()
+
+    def start_index(self):
+        threading.Thread(target=self.build_index, daemon=True).start()
+
+    def build_index(self):
+        """
+        finds the line starts, it is run in a thread
+        """
+        start = time.monotonic()
+        offsets = self.offsets
+        base = offsets[0]
+        # line ends after the last indexed line start, there are less than LINE_STEP of them
+        pending = 0
+        buffer = bytearray(INDEX_BLOCK_SIZE)
+        with open(self.path, 'rb') as f:
+            f.seek(base)
+            while not self.closed.is_set():
+                count = f.readinto(buffer)
+                if not count:
+                    break
+                # one pass over the line ends of the block, only every LINE_STEP-th of them is kept,
+                # the first one of them is the (LINE_STEP - pending)-th line end of the block
+                for match in islice(NEWLINE.finditer(buffer, 0, count), LINE_STEP - pending - 1, None, LINE_STEP):
+                    offsets.append(base + match.end())
+                pending = (pending + buffer.count(b'\n', 0, count)) % LINE_STEP
+                base += count
+                self.indexed = ((len(offsets) - 1) * LINE_STEP + pending + 1, base)
+        if not self.closed.is_set():
+            self.complete = True
+            logging.info('Indexed {} lines of {} in {:.2f} s'.format(
+                self.indexed[0], self.path, time.monotonic() - start))
+
+    def close(self):
+        self.closed.set()
+        try:
+            self.data.close()
+        except BufferError:
+            # a search still reads it, the map is closed, when it is dropped
+            pass
+
+    def line_count(self):
+        """
+        :return: number of the lines, which are indexed so far
+        """
+        return self.indexed[0]
+
+    def line_start(self, line):
+        """
+        :param line: number of the line from 0, it must be indexed already
+        :return: offset of the line in the file
+        """
+        position = self.offsets[line // LINE_STEP]
+        find = self.data.find
+        for _ in range(line % LINE_STEP):
+            position = find(b'\n', position) + 1
+        return position
+
+    def lines(self, first, count):
+        """
+        :param first: number of the first line from 0
+        :param count: maximum number of the lines
+        :return: list of (offset, text) of the lines, the text is cut after MAX_LINE_BYTES
+        """
+        count = min(count, self.line_count() - first)
+        if count <= 0:
+            return []
+        data = self.data
+        position = self.line_start(first)
+        result = []
+        for _ in range(count):
+            end = data.find(b'\n', position, position + MAX_LINE_BYTES)
+            cut = min(position + MAX_LINE_BYTES, self.size) if end < 0 else end
+            result.append((position, self.decode(data[position:cut]).rstrip('\r')))
+            if end < 0:
+                end = data.find(b'\n', cut)
+                if end < 0:
+                    break
+            position = end + 1
+        return result
+
+    def decode(self, data):
+        return data.decode(self.encoding, 'replace')
+
+    def count_lines(self, start, end):
+        """
+        :return: number of line ends between the offsets, the file is read in windows
+        """
+        count = 0
+        for position in range(start, end, SEARCH_WINDOW):
+            count += self.data[position:min(position + SEARCH_WINDOW, end)].count(b'\n')
+        return count
+
+    def line_of(self, offset):
+        """
+        :param offset: offset in the file
+        :return: number of the line from 0 and the offset of its start
+        """
+        index = bisect_right(self.offsets, offset) - 1
+        start = self.offsets[index]
+        line = index * LINE_STEP + self.count_lines(start, offset)
+        return line, self.data.rfind(b'\n', start, offset) + 1 if line > index * LINE_STEP else start
+
+    def window_end(self, position):
+        """
+        :return: end of the search window, which starts at the position, windows end at a line end
+        """
+        end = position + SEARCH_WINDOW
+        if end >= self.size:
+            return self.size
+        end = self.data.find(b'\n', end)
+        return self.size if end < 0 else end + 1
+
+    def window_start(self, position):
+        """
+        :return: start of the search window, which ends at the position, windows start at a line start
+        """
+        start = position - SEARCH_WINDOW
+        if start <= 0:
+            return 0
+        return self.data.rfind(b'\n', 0, start) + 1
+
+    def drop(self, start, end):
+        """
+        releases the pages of the mapped file between the offsets, so a search doesn't keep all of them resident
+        """
+        start -= start % mmap.PAGESIZE
+        if end > start and hasattr(self.data, 'madvise'):
+            self.data.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+    def search_forward(self, pattern, position, stop, stopped):
+        """
+        :param pattern: compiled bytes pattern, a match mustn't span a window, a window consists of whole lines
+        :param position: the match starts at this offset or after it
+        :param stop: the search wraps around the end of the file and stops at this offset
+        :param stopped: threading.Event, which cancels the search
+        :return: start and end offset of the first match or None
+        """
+        ranges = [(position, self.size), (0, stop)] if stop <= position else [(position, stop)]
+        for start, end in ranges:
+            window = start
+            while window < end:
+                if stopped.is_set() or self.closed.is_set():
+                    return None
+                window_end = self.window_end(window)
+                match = pattern.search(self.data, window, window_end)
+                while match is not None and match.end() == match.start():
+                    match = pattern.search(self.data, match.start() + 1, window_end)
+                self.drop(window, window_end)
+                if match is not None:
+                    return match.span() if match.start() < end else None
+                window = window_end
+        return None
+
+    def search_backward(self, pattern, position, stopped):
+        """
+        :param pattern: compiled bytes pattern
+        :param position: the match starts before this offset, the search wraps around the start of the file
+        :param stopped: threading.Event, which cancels the search
+        :return: start and end offset of the last match or None
+        """
+        for start, end in [(0, position), (position, self.size)]:
+            window_end = self.window_end(end) if end < self.size else end
+            while window_end > start:
+                if stopped.is_set() or self.closed.is_set():
+                    return None
+                window = self.window_start(window_end)
+                last = None
+                for match in pattern.finditer(self.data, window, window_end):
+                    if match.start() >= end:
+                        break
+                    if match.end() > match.start() and match.start() >= start:
+                        last = match.span()
+                self.drop(window, window_end)
+                if last is not None:
+                    return last
+                window_end = window
+        return None
+
+
+class LargeFileView(QAbstractScrollArea):
+    """
+    Read-only view of a file, which is too big for an editor.
+    The file is mapped into memory, and only the visible lines are read from it and painted,
+    so scrolling and going to a line take the same time at the start and at the end of a big file.
+    """
+    # generation of the search, start and end offset of the match or None
+    searchFinished = pyqtSignal(int, object)
+
+    def __init__(self, path, parent=None):
+        super(LargeFileView, self).__init__(parent)
+        self.file = MappedFile(path)
+        self.filePath = path
+        self.currentLine = 0
+        # (line, first column, last column) of the selected match
+        self.selection = None
+        # start and end offset of the selected match
+        self.match = None
+        self.digitWidth = 0
+        self.lineHeight = 1
+        self.numberAreaWidth = 0
+        # the horizontal scroll bar grows with the widest line drawn so far
+        self.maxWidth = 0
+        self.currentLineColor = QColor(Qt.yellow).lighter(160)
+        self.selectionColor = QColor(255, 150, 50)
+        self.searchGeneration = 0
+        self.searchCallback = None
+        self.searchStopped = None
+        self.searchFinished.connect(self.on_search_finished)
+        self.setFocusPolicy(Qt.StrongFocus)
+        self.viewport().setCursor(Qt.IBeamCursor)
+        self.update_metrics()
+
+        # the number of lines grows, while the index is built
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.update_line_count)
+        self.timer.start(100)
+        self.file.start_index()
+        self.update_line_count()
+        logging.info('Mapped ' + path)
+
+    def close_file(self):
+        self.timer.stop()
+        self.cancel_search()
+        self.file.close()
+
+    def update_metrics(self):
+        metrics = self.fontMetrics()
+        self.digitWidth = metrics.width('9')
+        self.lineHeight = max(metrics.height(), 1)
+        self.update_line_count()
+
+    def changeEvent(self, event):
+        super(LargeFileView, self).changeEvent(event)
+        if event.type() == QEvent.FontChange:
+            self.update_metrics()
+
+    def resizeEvent(self, event):
+        super(LargeFileView, self).resizeEvent(event)
+        self.update_line_count()
+
+    def visible_lines(self):
+        return max(self.viewport().height() // self.lineHeight, 1)
+
+    def update_line_count(self):
+        count = self.file.line_count()
+        if self.file.complete:
+            self.timer.stop()
+        self.numberAreaWidth = 6 + self.digitWidth * len(str(count))
+        scroll_bar = self.verticalScrollBar()
+        scroll_bar.setRange(0, max(0, count - self.visible_lines()))
+        scroll_bar.setPageStep(self.visible_lines())
+        self.horizontalScrollBar().setRange(0, max(0, self.maxWidth - self.viewport().width() // 2))
+        self.horizontalScrollBar().setPageStep(self.viewport().width())
+        self.viewport().update()
+
+    def scrollContentsBy(self, dx, dy):
+        self.viewport().update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self.viewport())
+        metrics = self.fontMetrics()
+        width = self.viewport().width()
+        first = self.verticalScrollBar().value()
+        left = self.numberAreaWidth + 4 - self.horizontalScrollBar().value()
+        painter.fillRect(event.rect(), self.palette().base())
+        max_width = self.maxWidth
+        for index, (offset, text) in enumerate(self.file.lines(first, self.visible_lines() + 1)):
+            line = first + index
+            top = index * self.lineHeight
+            text = text.expandtabs(4)
+            if line == self.currentLine:
+                painter.fillRect(0, top, width, self.lineHeight, self.currentLineColor)
+            if self.selection is not None and self.selection[0] == line:
+                start = metrics.width(text[:self.selection[1]])
+                end = metrics.width(text[:self.selection[2]])
+                painter.fillRect(left + start, top, max(end - start, 2), self.lineHeight, self.selectionColor)
+            painter.drawText(left, top + metrics.ascent(), text)
+            max_width = max(max_width, metrics.width(text))
+        painter.fillRect(0, 0, self.numberAreaWidth, self.viewport().height(), Qt.lightGray)
+        painter.setPen(Qt.black)
+        for index in range(min(self.visible_lines() + 1, self.file.line_count() - first)):
+            painter.drawText(0, index * self.lineHeight, self.numberAreaWidth - 3, self.lineHeight, Qt.AlignRight,
+                             str(first + index + 1))
+        painter.end()
+        if max_width > self.maxWidth:
+            self.maxWidth = max_width
+            self.horizontalScrollBar().setRange(0, max(0, self.maxWidth - width // 2))
+
+    def goto_line(self, line, column=0):
+        """
+        :param line: number of the line from 1, it is centered in the view
+        :param column: column of the line, the view is scrolled to it
+        """
+        line = min(max(line - 1, 0), self.file.line_count() - 1)
+        self.currentLine = line
+        self.verticalScrollBar().setValue(line - self.visible_lines() // 2)
+        if column:
+            text = self.file.lines(line, 1)[0][1].expandtabs(4)
+            x = self.fontMetrics().width(text[:column])
+            if not 0 <= x - self.horizontalScrollBar().value() < self.viewport().width() - self.numberAreaWidth:
+                self.horizontalScrollBar().setValue(x - self.viewport().width() // 2)
+        self.viewport().update()
+
+    def set_current_line(self, line):
+        line = min(max(line, 0), self.file.line_count() - 1)
+        self.currentLine = line
+        self.selection = None
+        self.match = None
+        first = self.verticalScrollBar().value()
+        if line < first:
+            self.verticalScrollBar().setValue(line)
+        elif line >= first + self.visible_lines():
+            self.verticalScrollBar().setValue(line - self.visible_lines() + 1)
+        self.viewport().update()
+
+    def keyPressEvent(self, event):
+        key = event.key()
+        page = self.visible_lines()
+        if key == Qt.Key_Up:
+            self.set_current_line(self.currentLine - 1)
+        elif key == Qt.Key_Down:
+            self.set_current_line(self.currentLine + 1)
+        elif key == Qt.Key_PageUp:
+            self.set_current_line(self.currentLine - page)
+        elif key == Qt.Key_PageDown:
+            self.set_current_line(self.currentLine + page)
+        elif key == Qt.Key_Home and event.modifiers() & Qt.ControlModifier:
+            self.set_current_line(0)
+        elif key == Qt.Key_End and event.modifiers() & Qt.ControlModifier:
+            self.set_current_line(self.file.line_count() - 1)
+        else:
+            super(LargeFileView, self).keyPressEvent(event)
+
+    def mousePressEvent(self, event):
+        self.set_current_line(self.verticalScrollBar().value() + event.pos().y() // self.lineHeight)
+
+    def copy(self):
+        """
+        copies the selected match or the current line
+        """
+        if self.match is not None:
+            text = self.file.decode(self.file.data[self.match[0]:self.match[1]])
+        else:
+            text = self.file.lines(self.currentLine, 1)[0][1]
+        QApplication.clipboard().setText(text)
+
+    def position(self):
+        """
+        :return: offset of the selected match or of the start of the current line
+        """
+        if self.match is not None:
+            return self.match[0]
+        return self.file.line_start(self.currentLine)
+
+    def select(self, start, end):
+        """
+        selects the match between the offsets and scrolls to it
+        """
+        line, line_start = self.file.line_of(start)
+        data = self.file.data
+        line_end = data.find(b'\n', start, start + MAX_LINE_BYTES)
+        if line_end < 0:
+            line_end = start + MAX_LINE_BYTES
+        first = len(self.file.decode(data[line_start:start]))
+        last = first + len(self.file.decode(data[start:min(end, line_end)]))
+        self.match = (start, end)
+        self.selection = (line, first, last)
+        first_visible = self.verticalScrollBar().value()
+        if not first_visible <= line < first_visible + self.visible_lines():
+            self.verticalScrollBar().setValue(line - self.visible_lines() // 2)
+        self.currentLine = line
+        self.viewport().update()
+
+    def find(self, pattern, forward, callback, position=None, stop=None):
+        """
+        searches the mapped file in a thread, the running search is cancelled
+        :param pattern: compiled bytes pattern
+        :param forward: search direction
+        :param callback: gets the start and end offset of the match or None
+        :param position: offset, where the search starts, after the selected match by default
+        :param stop: a forward search wraps around and stops at this offset, by default the whole file is searched
+        """
+        self.cancel_search()
+        if position is None:
+            position = self.position()
+            if forward and self.match is not None:
+                position += 1
+        if stop is None:
+            stop = position
+        self.searchGeneration += 1
+        self.searchCallback = callback
+        self.searchStopped = threading.Event()
+        threading.Thread(target=self.search,
+                         args=(self.searchGeneration, pattern, forward, position, stop, self.searchStopped),
+                         daemon=True).start()
+
+    def search(self, generation, pattern, forward, position, stop, stopped):
+        """
+        runs the search, it is run in a thread
+        """
+        try:
+            if forward:
+                result = self.file.search_forward(pattern, position, stop, stopped)
+            else:
+                result = self.file.search_backward(pattern, position, stopped)
+        except ValueError:
+            # the file was closed
+            return
+        if not stopped.is_set():
+            self.searchFinished.emit(generation, result)
+
+    def cancel_search(self):
+        if self.searchStopped is not None:
+            self.searchStopped.set()
+            self.searchStopped = None
+
+    def on_search_finished(self, generation, result):
+        if generation != self.searchGeneration or self.searchCallback is None:
+            return
+        callback = self.searchCallback
+        self.searchCallback = None
+        self.searchStopped = None
+        callback(result)
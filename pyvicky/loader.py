@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+
+from PyQt5.QtCore import QObject, pyqtSignal
+from PyQt5.QtGui import QTextCursor
+from PyQt5.QtWidgets import QApplication, QWidget, QProgressBar, QPushButton, QHBoxLayout, QLabel
+from concurrent.futures import ThreadPoolExecutor
+import codecs
+import logging
+import os
+import threading
+import time
+
+# Bytes, which are read and decoded at once
+CHUNK_SIZE = 1 << 18
+# Bytes at the start of the file, which decide between UTF-8 and Latin-1
+SNIFF_SIZE = 1 << 16
+# Files, which are read at once by a batch open, bigger ones are loaded in chunks by FileLoader
+BATCH_FILE_SIZE = 1 << 22
+# Files, which are read at once by a batch open
+MAX_READ_THREADS = 8
+# Byte order marks, the UTF-32 ones start with the UTF-16 ones, so they are checked first
+BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32-le'),
+    (codecs.BOM_UTF32_BE, 'utf-32-be'),
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+]
+
+
+def detect_encoding(head):
+    """
+    :param head: bytes at the start of the file
+    :return: name of the encoding and the byte order mark, b'' for a file without it
+    """
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding, bom
+    try:
+        head.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # a character, which is cut at the end of the head, doesn't count
+        if e.reason != 'unexpected end of data':
+            return 'latin-1', b''
+    return 'utf-8', b''
+
+
+def detect_newline(text):
+    """
+    :param text: decoded text
+    :return: style of the first line end in the text, '\n' if there is none
+    """
+    index = text.find('\n')
+    cr = text.find('\r', 0, index if index >= 0 else len(text))
+    if cr < 0:
+        return '\n'
+    return '\r\n' if text.startswith('\r\n', cr) else '\r'
+
+
+read_pool = None
+
+
+def get_read_pool():
+    """
+    :return: ThreadPoolExecutor, which reads the files of a batch open
+    """
+    global read_pool
+    if read_pool is None:
+        read_pool = ThreadPoolExecutor(max_workers=MAX_READ_THREADS)
+        QApplication.instance().aboutToQuit.connect(stop_read_pool)
+    return read_pool
+
+
+def stop_read_pool():
+    global read_pool
+    if read_pool is not None:
+        read_pool.shutdown(wait=False, cancel_futures=True)
+        read_pool = None
+
+
+def read_text(path):
+    """
+    reads and decodes the whole file the same way as FileLoader, it is run in the read pool
+    :param path: path of the file
+    :return: text with '\n' line ends, encoding, byte order mark and line end of the file,
+             OSError is raised, if the file can't be read
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    encoding, bom = detect_encoding(data[:SNIFF_SIZE])
+    data = memoryview(data)[len(bom):]
+    try:
+        text = codecs.decode(data, encoding, 'replace' if bom else 'strict')
+    except UnicodeDecodeError as e:
+        logging.info('{} is not UTF-8: {}'.format(path, e))
+        encoding = 'latin-1'
+        text = codecs.decode(data, encoding)
+    newline = os.linesep
+    if '\n' in text or '\r' in text:
+        newline = detect_newline(text)
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text, encoding, bom, newline
+
+
+class FileLoader(QObject):
+    """
+    Loads a file into a QTextDocument without blocking the GUI.
+    A thread reads and decodes the file in chunks, the chunks are appended to the document in the event loop,
+    so the window keeps repainting and the loading can be cancelled.
+    At most MAX_PENDING chunks wait for the GUI, so the memory besides the document stays bounded,
+    the text of the whole file is never held in one string.
+    Line ends are stored as '\n', the original style is kept in newline, so the file can be saved back with it.
+    """
+    # Decoded chunks, which the thread may read ahead of the GUI
+    MAX_PENDING = 2
+
+    # text of a chunk, number of bytes read so far
+    chunkLoaded = pyqtSignal(object, int)
+    # encoding, the file is read again with it from the start
+    restarted = pyqtSignal(str)
+    readFinished = pyqtSignal()
+    readFailed = pyqtSignal(str)
+
+    # percent of the file, which is in the document
+    progress = pyqtSignal(int)
+    # the whole file is in the document
+    loaded = pyqtSignal()
+    # error message, it is empty if the loading was cancelled
+    failed = pyqtSignal(str)
+
+    def __init__(self, path, document):
+        super(FileLoader, self).__init__()
+        self.path = path
+        self.document = document
+        self.size = 0
+        self.encoding = None
+        # byte order mark at the start of the file
+        self.bom = b''
+        self.newline = None
+        self.running = False
+        self.startTime = 0
+        self.cancelled = threading.Event()
+        self.pending = threading.Semaphore(self.MAX_PENDING)
+        self.cursor = QTextCursor(document)
+        self.chunkLoaded.connect(self.insert_chunk)
+        self.restarted.connect(self.on_restarted)
+        self.readFinished.connect(self.on_read_finished)
+        self.readFailed.connect(self.on_read_failed)
+
+    def start(self):
+        self.running = True
+        self.startTime = time.monotonic()
+        # the text is not an edit, which could be undone
+        self.document.setUndoRedoEnabled(False)
+        threading.Thread(target=self.read, daemon=True).start()
+        logging.info('Loading ' + self.path)
+
+    def cancel(self):
+        if not self.running:
+            return
+        self.running = False
+        self.cancelled.set()
+        # wakes up the thread, if it waits for the GUI
+        for _ in range(self.MAX_PENDING):
+            self.pending.release()
+        self.document.setUndoRedoEnabled(True)
+        logging.info('Loading of {} cancelled'.format(self.path))
+        self.failed.emit('')
+
+    def read(self):
+        """
+        reads the file, it is run in a thread
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                self.size = os.fstat(f.fileno()).st_size
+                encoding, bom = detect_encoding(f.read(SNIFF_SIZE))
+                while True:
+                    f.seek(len(bom))
+                    try:
+                        self.read_chunks(f, encoding, bom)
+                        break
+                    except UnicodeDecodeError as e:
+                        if encoding != 'utf-8' or bom:
+                            raise
+                        # the start of the file looked like UTF-8, but a later part isn't
+                        logging.info('{} is not UTF-8: {}'.format(self.path, e))
+                        encoding = 'latin-1'
+                        self.restarted.emit(encoding)
+        except (OSError, UnicodeDecodeError) as e:
+            if not self.cancelled.is_set():
+                self.readFailed.emit(str(e))
+            return
+        if not self.cancelled.is_set():
+            self.readFinished.emit()
+
+    def read_chunks(self, f, encoding, bom):
+        # an explicit byte order mark wins, wrong bytes are replaced
+        decoder = codecs.getincrementaldecoder(encoding)('replace' if bom else 'strict')
+        self.encoding = encoding
+        self.bom = bom
+        self.newline = None
+        # '\r' at the end of a chunk may be the start of '\r\n'
+        carry = ''
+        read = len(bom)
+        while not self.cancelled.is_set():
+            data = f.read(CHUNK_SIZE)
+            read += len(data)
+            text = carry + decoder.decode(data, final=not data)
+            carry = ''
+            if data and text.endswith('\r'):
+                carry = '\r'
+                text = text[:-1]
+            if self.newline is None and ('\n' in text or '\r' in text):
+                self.newline = detect_newline(text)
+            if '\r' in text:
+                text = text.replace('\r\n', '\n').replace('\r', '\n')
+            if text:
+                self.pending.acquire()
+                if self.cancelled.is_set():
+                    return
+                self.chunkLoaded.emit(text, read)
+            if not data:
+                return
+
+    def insert_chunk(self, text, read):
+        if not self.running:
+            return
+        self.cursor.movePosition(QTextCursor.End)
+        self.cursor.insertText(text)
+        self.pending.release()
+        self.progress.emit(100 * read // max(self.size, 1))
+
+    def on_restarted(self, encoding):
+        if not self.running:
+            return
+        self.document.clear()
+        self.progress.emit(0)
+
+    def on_read_finished(self):
+        if not self.running:
+            return
+        self.running = False
+        self.document.setUndoRedoEnabled(True)
+        self.document.setModified(False)
+        if self.newline is None:
+            self.newline = os.linesep
+        logging.info('Loaded {} ({}, {} bytes) in {:.2f} s'.format(
+            self.path, self.encoding, self.size, time.monotonic() - self.startTime))
+        self.loaded.emit()
+
+    def on_read_failed(self, error):
+        if not self.running:
+            return
+        self.running = False
+        self.document.setUndoRedoEnabled(True)
+        logging.error('Cannot load {}: {}'.format(self.path, error))
+        self.failed.emit(error)
+
+
+class BatchLoader(QObject):
+    """
+    Reads several files in the read pool.
+    The results are passed together, when the last file is read, so the tabs of the files can be created at once.
+    """
+    # index of the file, Future of its read_text
+    fileRead = pyqtSignal(int, object)
+    # list of (path, Future of read_text)
+    loaded = pyqtSignal(object)
+
+    def __init__(self, paths, parent=None):
+        super(BatchLoader, self).__init__(parent)
+        self.paths = paths
+        self.futures = [None] * len(paths)
+        self.remaining = len(paths)
+        self.startTime = 0
+        self.fileRead.connect(self.on_file_read)
+
+    def start(self):
+        self.startTime = time.monotonic()
+        if not self.paths:
+            self.loaded.emit([])
+            return
+        pool = get_read_pool()
+        for index, path in enumerate(self.paths):
+            future = pool.submit(read_text, path)
+            future.add_done_callback(lambda done, index=index: self.fileRead.emit(index, done))
+
+    def on_file_read(self, index, future):
+        self.futures[index] = future
+        self.remaining -= 1
+        if self.remaining:
+            return
+        logging.info('Read {} files in {:.2f} s'.format(len(self.paths), time.monotonic() - self.startTime))
+        self.loaded.emit(list(zip(self.paths, self.futures)))
+
+
+class LoadingBar(QWidget):
+    """
+    Progress of the loading of a tab with a button, which cancels it
+    """
+    def __init__(self, loader, parent=None):
+        super(LoadingBar, self).__init__(parent)
+        label = QLabel('Loading {}'.format(os.path.basename(loader.path)), self)
+        self.progressBar = QProgressBar(self)
+        self.progressBar.setRange(0, 100)
+        cancelButton = QPushButton('Cancel', self)
+        cancelButton.clicked.connect(loader.cancel)
+        loader.progress.connect(self.progressBar.setValue)
+
+        layout = QHBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(label)
+        layout.addWidget(self.progressBar)
+        layout.addWidget(cancelButton)
+        self.setLayout(layout)
@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 
 import sys
-import os
 from PyQt5.QtWidgets import QApplication, QWidget
 from pyvicky.argparser import Argparser
 from pyvicky.window import Window
@@ -10,18 +9,13 @@ from pyvicky.logger import Logger
 
 
 def process_args(args, window):
-    for file_name in args:
-        if os.path.exists(file_name):
-            window.open_file(file_name)
-            logging.info("Open existing file")
-        else:
-            window.new_file()
-            logging.info("Create file")
-        window.set_title(file_name)
+    # the files are read together in the background, directories are shown in the tree
+    if args:
+        window.open_files(args)
+        logging.info("Open {} paths".format(len(args)))
 
 
 def main():
-    # TODO: now only possible with 1 file
     argparser = Argparser()
     if argparser.args.silent:
         silent = True
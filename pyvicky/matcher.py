@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import heapq
+import re
+
+# Bonuses of the score of a fuzzy match
+START_BONUS = 8
+HUMP_BONUS = 6
+CONSECUTIVE_BONUS = 4
+# Exact prefix matches are ranked above all fuzzy ones
+PREFIX_BONUS = 1000
+
+
+def fuzzy_score(word, query):
+    """
+    scores the match of the query characters in the word in order (subsequence)
+    characters at the start of the word, at camel humps (getCurrentWidget) and after underscores
+    score more, so 'gcw' is a good match for getCurrentWidget
+    :param word: candidate
+    :param query: lower case query
+    :return: score or None, if the word doesn't match
+    """
+    lower = word.lower()
+    score = 0
+    position = -1
+    for char in query:
+        found = lower.find(char, position + 1)
+        if found < 0:
+            return None
+        if found == 0:
+            score += START_BONUS
+        elif word[found].isupper() and not word[found - 1].isupper() or word[found - 1] == '_':
+            score += HUMP_BONUS
+        if found == position + 1:
+            score += CONSECUTIVE_BONUS
+        # gaps and long words score less
+        score -= found - position - 1
+        position = found
+    return score - len(word) / 100
+
+
+def rank_words(words, query, limit):
+    """
+    ranks a short list of words the same way as WordMatcher.match
+    :param words: candidates
+    :param query: typed part of the word, its first letter must be the first letter of the word
+    :param limit: maximum number of results
+    :return: best matches from the best to the worst
+    """
+    lower = query.lower()
+    if not lower:
+        return list(words[:limit])
+    scored = []
+    for index, word in enumerate(words):
+        if word[:1].lower() != lower[0]:
+            continue
+        score = fuzzy_score(word, lower)
+        if score is not None:
+            if word.lower().startswith(lower):
+                score += PREFIX_BONUS
+            # equal scores keep the original order
+            scored.append((score, -index, word))
+    return [word for _, _, word in heapq.nlargest(limit, scored)]
+
+
+class WordMatcher:
+    """
+    Prefix and fuzzy matching over a fixed list of words.
+    Words are kept sorted by their lower case form: prefix matches are found with a binary search,
+    and the words, which start with the same letter, form one string, that is searched for
+    the fuzzy pattern by the regex engine instead of a Python loop over every word.
+    """
+    def __init__(self, words):
+        pairs = sorted((word.lower(), word) for word in set(words))
+        self.keys = [key for key, _ in pairs]
+        self.words = [word for _, word in pairs]
+        # first letter -> (index of the first word, newline separated lower case words)
+        self.buckets = {}
+
+    def __len__(self):
+        return len(self.words)
+
+    def prefix(self, prefix, limit):
+        """
+        :param prefix: beginning of the word, case insensitive
+        :param limit: maximum number of results
+        :return: words with the prefix in the alphabetical order
+        """
+        lower = prefix.lower()
+        keys = self.keys
+        start = bisect.bisect_left(keys, lower)
+        end = bisect.bisect_left(keys, lower + '\U0010ffff', start, min(start + limit, len(keys)))
+        return self.words[start:end]
+
+    def get_bucket(self, letter):
+        bucket = self.buckets.get(letter)
+        if bucket is None:
+            start = bisect.bisect_left(self.keys, letter)
+            end = bisect.bisect_left(self.keys, letter + '\U0010ffff', start)
+            bucket = (start, '\n'.join(self.keys[start:end]))
+            self.buckets[letter] = bucket
+        return bucket
+
+    def match(self, query, limit):
+        """
+        :param query: typed part of the word, its first letter must be the first letter of the word
+        :param limit: maximum number of results
+        :return: best matches from the best to the worst, exact prefix matches first
+        """
+        lower = query.lower()
+        if not lower:
+            return self.words[:limit]
+        # prefix matches are found by the binary search, they are ranked among themselves
+        found = self.prefix(lower, limit)
+        results = [word for _, _, word in sorted(
+            ((fuzzy_score(word, lower), -index, word) for index, word in enumerate(found)), reverse=True)]
+        if len(results) >= limit:
+            return results
+        # the bucket is scanned only to fill up the results with fuzzy matches
+        start, text = self.get_bucket(lower[0])
+        if not text:
+            return results
+        # a class without the next character doesn't backtrack: ^a[^\nb]*b[^\nc]*c[^\n]*$
+        pattern = re.compile('^' + re.escape(lower[0]) +
+                             ''.join('[^\n{0}]*{0}'.format(re.escape(char)) for char in lower[1:]) + '[^\n]*$',
+                             re.MULTILINE)
+        words = self.words
+        scored = []
+        line = 0
+        position = 0
+        for match in pattern.finditer(text):
+            # the line number in the bucket is the index of the word
+            line += text.count('\n', position, match.start())
+            position = match.start()
+            if match.group().startswith(lower):
+                # all prefix matches are in the results already
+                continue
+            word = words[start + line]
+            scored.append((fuzzy_score(word, lower), word))
+        return results + [word for _, word in heapq.nlargest(limit - len(results), scored)]
+
+
+def benchmark(sizes=(1000, 10000, 100000, 500000), queries=200):
+    """
+    prints the time of a completion, as the editor asks for it on a keystroke, for dictionaries of the sizes:
+    typed prefixes of 1-3 letters and fuzzy queries (gcw for getCurrentWidget)
+    run it with python -m pyvicky.matcher
+    """
+    import random
+    import string
+    import time
+    from pyvicky.numberbar import CompletionIndex, QAutoComplete
+    random.seed(0)
+    parts = [''.join(random.choice(string.ascii_lowercase) for _ in range(random.randint(2, 7))) for _ in range(3000)]
+    for size in sizes:
+        words = set()
+        while len(words) < size:
+            first, *rest = random.sample(parts, random.randint(1, 3))
+            words.add(first + ''.join(part.capitalize() for part in rest))
+        words = list(words)
+        start = time.perf_counter()
+        matcher = WordMatcher(words)
+        build = time.perf_counter() - start
+        index = CompletionIndex()
+        index.on_loaded(index.dictionary_path(), matcher)
+        samples = random.sample(words, queries)
+        # first letter and the start of every hump: getCurrentWidget -> gcw
+        fuzzy = [word[0] + ''.join(char for char in word[1:] if char.isupper()).lower() + word[-1] for word in samples]
+        # buckets are built on the first use
+        for query in fuzzy:
+            matcher.get_bucket(query[0])
+        times = []
+        for name, typed in [('1 letter', [word[:1] for word in samples]), ('2 letters', [word[:2] for word in samples]),
+                            ('3 letters', [word[:3] for word in samples]), ('fuzzy', fuzzy)]:
+            start = time.perf_counter()
+            for query in typed:
+                index.complete(query, QAutoComplete.DICTIONARY_LIMIT)
+            times.append('{} {:.3f} ms'.format(name, (time.perf_counter() - start) * 1000 / queries))
+        print('{:>7} words: build {:.3f} s, complete: {}'.format(size, build, ', '.join(times)))
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -1,12 +1,23 @@
 # -*- coding: utf-8 -*-
 
-from PyQt5.QtCore import Qt, QRect, QSize
-from PyQt5.QtWidgets import QWidget, QPlainTextEdit, QTextEdit, QCompleter
-from PyQt5.QtGui import QColor, QPainter, QTextFormat, QTextCursor
+from PyQt5.QtCore import Qt, QRect, QSize, QEvent, QObject, QStringListModel, pyqtSignal
+from PyQt5.QtWidgets import QWidget, QPlainTextEdit, QCompleter
+from PyQt5.QtGui import QColor, QPainter, QTextCursor, QPixmap, QTextCharFormat
+
+from pyvicky.decorations import SelectionLayers, make_selection
+from pyvicky.identifiers import DocumentIndex, get_identifier_index
+from pyvicky.search import DocumentSearch
+from pyvicky.completion import get_jedi_completion
+from pyvicky.matcher import WordMatcher, rank_words
+from pyvicky.highlighter import read_config, SETTINGS_PATH
 
 import logging
-import configparser
 import os
+import threading
+import time
+
+BRACKETS = {'(': ')', '[': ']', '{': '}'}
+CLOSING_BRACKETS = {closer: opener for opener, closer in BRACKETS.items()}
 
 
 class QLineNumberArea(QWidget):
@@ -15,21 +26,48 @@ class QLineNumberArea(QWidget):
         self.codeEditor = editor
 
     def sizeHint(self):
-        return QSize(self.editor.lineNumberAreaWidth(), 0)
+        return QSize(self.codeEditor.lineNumberAreaWidth(), 0)
 
     def paintEvent(self, event):
         self.codeEditor.lineNumberAreaPaintEvent(event)
 
 
 class QCodeEditor(QPlainTextEdit):
+    # Pre-rendered line numbers are dropped, when there are more of them
+    NUMBER_CACHE_SIZE = 4096
+    # Brackets are matched at most this number of lines away
+    BRACKET_SCAN_LINES = 2000
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.lineNumberArea = QLineNumberArea(self)
+        # Gutter metrics, they are recomputed only when the font or the digit count changes
+        self.digitWidth = 0
+        self.lineHeight = 0
+        self.numberDigits = 0
+        self.numberAreaWidth = 0
+        # line number -> QPixmap with the rendered number
+        self.numberPixmaps = {}
+        self.update_gutter_metrics()
+        # Search hits, brackets and diagnostics, the current line is painted by the editor itself
+        self.selectionLayers = SelectionLayers(self)
+        self.currentLineColor = QColor(Qt.yellow).lighter(160)  # change it and make more transparent
+        self.currentLineCursor = QTextCursor(self.document())
+        self.bracketFormat = QTextCharFormat()
+        self.bracketFormat.setBackground(QColor(Qt.green).lighter(160))
         self.blockCountChanged.connect(self.updateLineNumberAreaWidth)
         self.updateRequest.connect(self.updateLineNumberArea)
         self.cursorPositionChanged.connect(self.highlightCurrentLine)
+        self.cursorPositionChanged.connect(self.highlight_brackets)
         self.updateLineNumberAreaWidth(0)
 
+        # Identifiers of the document for the completion
+        self.identifiers = DocumentIndex(self.document())
+        # Find searches the blocks of the document and caches the matches until it changes
+        self.documentSearch = DocumentSearch(self.document())
+        # Set by the tab: Python files are completed by jedi too
+        self.language = None
+        self.filePath = None
         self.completer = None
         completer = QAutoComplete()
         self.setCompleter(completer)
@@ -38,64 +76,164 @@ class QCodeEditor(QPlainTextEdit):
         logging.info('Create editor with number bar')
 
     def lineNumberAreaWidth(self):
-        digits = 1
-        max_value = max(1, self.blockCount())
-        while max_value >= 10:
-            max_value /= 10
-            digits += 1
-        space = 3 + self.fontMetrics().width('9') * digits
-        return space
+        return self.numberAreaWidth
+
+    def update_gutter_metrics(self):
+        """
+        reads the font metrics and drops the pre-rendered numbers, must be called after the font is changed
+        """
+        metrics = self.fontMetrics()
+        self.digitWidth = metrics.width('9')
+        self.lineHeight = metrics.height()
+        self.numberPixmaps = {}
+        self.numberDigits = 0
+        self.updateLineNumberAreaWidth(0)
+        self.lineNumberArea.update()
 
     def updateLineNumberAreaWidth(self, _):
-        self.setViewportMargins(self.lineNumberAreaWidth(), 0, 0, 0)
+        digits = len(str(max(1, self.blockCount())))
+        if digits == self.numberDigits:
+            return
+        self.numberDigits = digits
+        self.numberAreaWidth = 3 + self.digitWidth * digits
+        self.setViewportMargins(self.numberAreaWidth, 0, 0, 0)
+        cr = self.contentsRect()
+        self.lineNumberArea.setGeometry(QRect(cr.left(), cr.top(), self.numberAreaWidth, cr.height()))
 
     def updateLineNumberArea(self, rect, dy):
         if dy:
+            # only the uncovered strip is painted
             self.lineNumberArea.scroll(0, dy)
         else:
             self.lineNumberArea.update(0, rect.y(), self.lineNumberArea.width(), rect.height())
-        if rect.contains(self.viewport().rect()):
-            self.updateLineNumberAreaWidth(0)
 
     def resizeEvent(self, event):
         super().resizeEvent(event)
         cr = self.contentsRect()
-        self.lineNumberArea.setGeometry(QRect(cr.left(), cr.top(), self.lineNumberAreaWidth(), cr.height()))
+        self.lineNumberArea.setGeometry(QRect(cr.left(), cr.top(), self.numberAreaWidth, cr.height()))
+
+    def changeEvent(self, event):
+        super().changeEvent(event)
+        if event.type() == QEvent.FontChange:
+            self.update_gutter_metrics()
 
     # TODO: make this feature optional
     def highlightCurrentLine(self):
-        extraSelections = []
+        # The line isn't an extra selection: moving the cursor repaints two lines
+        # instead of passing all search hits to Qt again
+        old_rect = self.current_line_rect(self.currentLineCursor)
+        self.currentLineCursor = self.textCursor()
+        new_rect = self.current_line_rect(self.currentLineCursor)
+        if old_rect != new_rect:
+            self.viewport().update(old_rect)
+            self.viewport().update(new_rect)
+
+    def current_line_rect(self, cursor):
+        rect = self.cursorRect(cursor)
+        return QRect(0, rect.top(), self.viewport().width(), rect.height())
+
+    def paintEvent(self, event):
         if not self.isReadOnly():
-            selection = QTextEdit.ExtraSelection()
-            lineColor = QColor(Qt.yellow).lighter(160)  # change it and make more transparent
-            selection.format.setBackground(lineColor)
-            selection.format.setProperty(QTextFormat.FullWidthSelection, True)
-            selection.cursor = self.textCursor()
-            selection.cursor.clearSelection()
-            extraSelections.append(selection)
-        self.setExtraSelections(extraSelections)
+            rect = self.current_line_rect(self.textCursor())
+            if rect.intersects(event.rect()):
+                painter = QPainter(self.viewport())
+                painter.fillRect(rect, self.currentLineColor)
+                painter.end()
+        super().paintEvent(event)
+
+    def highlight_brackets(self):
+        document = self.document()
+        position = self.textCursor().position()
+        selections = []
+        for bracket_position in (position, position - 1):
+            match = self.find_matching_bracket(bracket_position)
+            if match is not None:
+                selections = [make_selection(document, bracket_position, bracket_position + 1, self.bracketFormat),
+                              make_selection(document, match, match + 1, self.bracketFormat)]
+                break
+        self.selectionLayers.set_layer('brackets', selections)
+
+    def find_matching_bracket(self, position):
+        """
+        :param position: position of a bracket in the document
+        :return: position of the pair of the bracket or None
+        """
+        document = self.document()
+        if position < 0:
+            return None
+        bracket = document.characterAt(position)
+        if bracket in BRACKETS:
+            pair, step = BRACKETS[bracket], 1
+        elif bracket in CLOSING_BRACKETS:
+            pair, step = CLOSING_BRACKETS[bracket], -1
+        else:
+            return None
+        block = document.findBlock(position)
+        column = position - block.position()
+        depth = 0
+        for _ in range(self.BRACKET_SCAN_LINES):
+            if not block.isValid():
+                break
+            text = block.text()
+            columns = range(column, len(text)) if step > 0 else range(min(column, len(text) - 1), -1, -1)
+            for i in columns:
+                char = text[i]
+                if char == bracket:
+                    depth += 1
+                elif char == pair:
+                    depth -= 1
+                    if depth == 0:
+                        return block.position() + i
+            if step > 0:
+                block = block.next()
+                column = 0
+            else:
+                block = block.previous()
+                column = len(block.text()) - 1 if block.isValid() else 0
+        return None
+
+    def number_pixmap(self, number):
+        """
+        :param number: line number
+        :return: QPixmap with the rendered number, it is drawn only once
+        """
+        pixmap = self.numberPixmaps.get(number)
+        if pixmap is None:
+            if len(self.numberPixmaps) >= self.NUMBER_CACHE_SIZE:
+                self.numberPixmaps = {}
+            text = str(number)
+            ratio = self.lineNumberArea.devicePixelRatioF()
+            pixmap = QPixmap(int(self.digitWidth * len(text) * ratio), int(self.lineHeight * ratio))
+            pixmap.setDevicePixelRatio(ratio)
+            pixmap.fill(Qt.transparent)
+            painter = QPainter(pixmap)
+            painter.setFont(self.font())
+            painter.setPen(Qt.black)
+            painter.drawText(0, 0, self.digitWidth * len(text), self.lineHeight, Qt.AlignRight, text)
+            painter.end()
+            self.numberPixmaps[number] = pixmap
+        return pixmap
 
     def lineNumberAreaPaintEvent(self, event):
         painter = QPainter(self.lineNumberArea)
-
-        painter.fillRect(event.rect(), Qt.lightGray)
+        rect = event.rect()
+        painter.fillRect(rect, Qt.lightGray)
 
         block = self.firstVisibleBlock()
         blockNumber = block.blockNumber()
-        top = self.blockBoundingGeometry(block).translated(self.contentOffset()).top()
-        bottom = top + self.blockBoundingRect(block).height()
+        top = int(self.blockBoundingGeometry(block).translated(self.contentOffset()).top())
+        bottom = top + int(self.blockBoundingRect(block).height())
+        right = self.lineNumberArea.width()
 
-        # Just to make sure I use the right font
-        height = self.fontMetrics().height()
-        while block.isValid() and (top <= event.rect().bottom()):
-            if block.isVisible() and (bottom >= event.rect().top()):
-                number = str(blockNumber + 1)
-                painter.setPen(Qt.black)
-                painter.drawText(0, top, self.lineNumberArea.width(), height, Qt.AlignRight, number)
+        # Only the blocks inside of the dirty rectangle are drawn
+        while block.isValid() and top <= rect.bottom():
+            if block.isVisible() and bottom >= rect.top():
+                pixmap = self.number_pixmap(blockNumber + 1)
+                painter.drawPixmap(right - int(pixmap.width() / pixmap.devicePixelRatio()), top, pixmap)
 
             block = block.next()
             top = bottom
-            bottom = top + self.blockBoundingRect(block).height()
+            bottom = top + int(self.blockBoundingRect(block).height())
             blockNumber += 1
 
     def setCompleter(self, completer):
@@ -105,18 +243,17 @@ class QCodeEditor(QPlainTextEdit):
             return
 
         completer.setWidget(self)
-        completer.setCompletionMode(QCompleter.PopupCompletion)
+        # the model holds only the ranked matches, so Qt mustn't filter it again
+        completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
         completer.setCaseSensitivity(Qt.CaseInsensitive)
         self.completer = completer
         self.completer.activated.connect(self.insertCompletion)
 
     def insertCompletion(self, completion):
+        # the typed prefix is replaced, because a fuzzy match may differ from it (gcw -> getCurrentWidget)
         tc = self.textCursor()
-        extra = (len(completion) -
-                 len(self.completer.completionPrefix()))
-        tc.movePosition(QTextCursor.Left)
-        tc.movePosition(QTextCursor.EndOfWord)
-        tc.insertText(completion[len(completion) - extra:len(completion)])
+        tc.movePosition(QTextCursor.Left, QTextCursor.KeepAnchor, len(self.completer.completionPrefix()))
+        tc.insertText(completion)
         self.setTextCursor(tc)
 
     def textUnderCursor(self):
@@ -158,13 +295,48 @@ class QCodeEditor(QPlainTextEdit):
 
         completionPrefix = self.textUnderCursor()
 
-        if (not isShortcut and (hasModifier or event.text() is '' or
-                                len(completionPrefix) < 2 or
-                                (event.text()[-1]) in eow)):
+        # Attributes are completed after the dot only by jedi, when its reply comes
+        attribute = self.language == 'python' and event.text() == '.' and not hasModifier
+        if attribute:
+            completionPrefix = ''
+        elif (not isShortcut and (hasModifier or event.text() is '' or
+                                  len(completionPrefix) < 2 or
+                                  (event.text()[-1]) in eow)):
             self.completer.popup().hide()
             return
 
-        if completionPrefix != self.completer.completionPrefix():
+        if self.language == 'python' and self.completion_context(completionPrefix) != self.completer.context:
+            # more letters of the same word are filtered from the last reply of jedi
+            get_jedi_completion().request(self, completionPrefix)
+        if not attribute:
+            self.show_completions(completionPrefix)
+
+    def on_context_completions(self, position, prefix, words):
+        """
+        called with the reply of jedi
+        :param position: position of the cursor, when the completions were requested
+        :param prefix: part of the word before the cursor
+        :param words: completions
+        """
+        if self.textCursor().position() != position:
+            # the cursor has moved, a new request is on the way
+            return
+        self.completer.set_context_words(self.completion_context(prefix), words)
+        if words and (prefix == '' or self.completer.popup().isVisible()):
+            self.show_completions(prefix)
+
+    def completion_context(self, prefix):
+        """
+        :param prefix: part of the word before the cursor
+        :return: position of the word and the text of the line before it
+        """
+        cursor = self.textCursor()
+        column = cursor.positionInBlock() - len(prefix)
+        return cursor.position() - len(prefix), cursor.block().text()[:column]
+
+    def show_completions(self, completionPrefix):
+        if self.completer.update_model(completionPrefix, self.completion_context(completionPrefix)) or \
+                completionPrefix != self.completer.completionPrefix():
             self.completer.setCompletionPrefix(completionPrefix)
             popup = self.completer.popup()
             popup.setCurrentIndex(
@@ -177,26 +349,202 @@ class QCodeEditor(QPlainTextEdit):
 
 
 class QAutoComplete(QCompleter):
-    # TODO: after setting new keyword setting you need to reload program to get new dictionary
+    # Maximum number of identifiers and dictionary words in the popup
+    IDENTIFIER_LIMIT = 50
+    DICTIONARY_LIMIT = 200
+
     def __init__(self, parent=None):
+        QCompleter.__init__(self, parent)
+        # Candidates for the current prefix: completions of jedi,
+        # identifiers of the open documents by rank, then dictionary words
+        self.words = []
+        self.wordsModel = QStringListModel(self)
+        self.setModel(self.wordsModel)
+        # Completions of jedi and the context of the word, they were computed for
+        self.contextWords = []
+        self.context = None
+
+    def set_context_words(self, context, words):
+        self.context = context
+        self.contextWords = words
+
+    def update_model(self, prefix, context=None):
+        """
+        fills the model with the candidates for the prefix
+        :param prefix: word under the cursor
+        :param context: QCodeEditor.completion_context of the word
+        :return: True, if the candidates have changed
+        """
         words = []
-        self.settings = configparser.ConfigParser()
-        self.settings.read('pyvicky/configs/settings.ini')
+        if context is not None and context == self.context:
+            words = rank_words(self.contextWords, prefix, self.DICTIONARY_LIMIT)
+        known = set(words)
+        words += [word for word in get_identifier_index().complete(prefix, self.IDENTIFIER_LIMIT)
+                  if word not in known]
+        known.update(words)
+        words += [word for word in get_completion_index().complete(prefix, self.DICTIONARY_LIMIT)
+                  if word not in known]
+        if words == self.words:
+            return False
+        self.words = words
+        self.wordsModel.setStringList(words)
+        return True
+
+
+def get_dictionary_path():
+    return read_config(SETTINGS_PATH).get('Dictionary', 'path', fallback=None)
+
+
+def load_words(path):
+    """
+    reads the dictionary, one word per line
+    :param path: path of the dictionary, the system dictionary is used if it can't be read
+    :return: WordMatcher of the words
+    """
+    words = set()
+    try:
+        with open(path, "r") as f:
+            for word in f:
+                words.add(word.strip())
+    except (IOError, TypeError) as e:
+        logging.error("unable to load keyword dictionary")
+        logging.error(e)
+        logging.error(os.getcwd())
         try:
-            str_path = self.settings['Dictionary']['path']
-            with open(str_path, "r") as f:
-                for word in f:
-                    words.append(word.strip())
-                f.close()
-        except IOError as e:
-            logging.error("unable to load keyword dictionary")
-            logging.error(e)
-            logging.error(os.getcwd())
-            try:
-                f = open("/usr/share/dict/words", "r")  # default system dict
+            with open("/usr/share/dict/words", "r") as f:  # default system dict
                 for word in f:
-                    words.append(word.strip())
-                f.close()
-            except IOError:
-                logging.error("dictionary not in anticipated location")
-        QCompleter.__init__(self, words, parent)
+                    words.add(word.strip())
+        except IOError:
+            logging.error("dictionary not in anticipated location")
+    words.discard('')
+    return WordMatcher(words)
+
+
+class CompletionIndex(QObject):
+    """
+    Word list of all completers in the process.
+    It is read in the background on the first completion and again,
+    when the dictionary path is changed in the settings. Until then the completion has no dictionary words.
+    """
+    # Seconds, for which the dictionary path is used without checking the settings file again
+    CHECK_INTERVAL = 2.0
+
+    # path of the dictionary, WordMatcher
+    loaded = pyqtSignal(object, object)
+
+    def __init__(self):
+        super().__init__()
+        self.matcher = WordMatcher([])
+        self.path = None
+        # the dictionary, which is being read, the path may be None too
+        self.loading = False
+        self.loadingPath = None
+        self.isLoaded = False
+        # dictionary path from the settings and the time, when it was read
+        self.settingsPath = None
+        self.checkTime = None
+        self.loaded.connect(self.on_loaded)
+
+    def complete(self, prefix, limit):
+        """
+        :param prefix: beginning of the word, case insensitive
+        :param limit: maximum number of results
+        :return: dictionary words with the prefix first, then fuzzy matches
+        """
+        self.update()
+        return self.matcher.match(prefix, limit)
+
+    def update(self):
+        """
+        reads the dictionary on the first use and starts reading the new one, if the path is changed
+        """
+        path = self.dictionary_path()
+        if (not self.isLoaded or path != self.path) and not (self.loading and path == self.loadingPath):
+            self.loading = True
+            self.loadingPath = path
+            threading.Thread(target=lambda: self.loaded.emit(path, load_words(path)), daemon=True).start()
+
+    def dictionary_path(self):
+        """
+        :return: dictionary path from the settings, they are checked at most once per CHECK_INTERVAL
+        """
+        now = time.monotonic()
+        if self.checkTime is None or now - self.checkTime >= self.CHECK_INTERVAL:
+            self.checkTime = now
+            self.settingsPath = get_dictionary_path()
+        return self.settingsPath
+
+    def on_loaded(self, path, matcher):
+        if self.loading and path != self.loadingPath:
+            # the path was changed again, while this dictionary was read
+            return
+        self.loading = False
+        self.loadingPath = None
+        self.path = path
+        self.isLoaded = True
+        self.matcher = matcher
+        logging.info('Loaded {} completion words from {}'.format(len(matcher), path))
+
+
+completion_index = None
+
+
+def get_completion_index():
+    global completion_index
+    if completion_index is None:
+        completion_index = CompletionIndex()
+    return completion_index
+
+
+def benchmark(lines=200000, steps=300):
+    """
+    prints the time of the gutter painting in a large file: a full repaint, a scroll by 3 lines
+    and the number of setViewportMargins calls while scrolling and typing
+    run it with python -m pyvicky.numberbar from the root of the repository
+    """
+    import sys
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication(sys.argv)
+    editor = QCodeEditor()
+    editor.setPlainText('\n'.join('line {}'.format(i) for i in range(lines)))
+    editor.resize(900, 1000)
+    editor.show()
+    app.processEvents()
+    margins, paints = [], []
+    set_margins, paint = editor.setViewportMargins, editor.lineNumberAreaPaintEvent
+
+    def timed_paint(event):
+        start = time.perf_counter()
+        paint(event)
+        paints.append(time.perf_counter() - start)
+
+    editor.setViewportMargins = lambda *args: (margins.append(args), set_margins(*args))
+    editor.lineNumberAreaPaintEvent = timed_paint
+
+    for _ in range(steps):
+        editor.lineNumberArea.repaint()
+    repaint = sum(paints) * 1000 / len(paints)
+
+    scrollBar = editor.verticalScrollBar()
+    scrollBar.setValue(lines // 2)
+    app.processEvents()
+    paints = []
+    start = time.perf_counter()
+    for _ in range(steps):
+        scrollBar.setValue(scrollBar.value() + 3)
+        app.processEvents()
+    step = (time.perf_counter() - start) * 1000 / steps
+    scroll = sum(paints) * 1000 / steps
+
+    cursor = editor.cursorForPosition(editor.viewport().rect().center())
+    for _ in range(steps):
+        cursor.insertText('x')
+        app.processEvents()
+    print('{} lines: full gutter repaint {:.3f} ms, gutter paint per scroll by 3 lines {:.3f} ms '
+          '(whole step with the text {:.3f} ms), setViewportMargins during {} scroll steps and {} edits: {} calls'
+          .format(lines, repaint, scroll, step, steps, steps, len(margins)))
+    editor.close()
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -6,7 +6,7 @@ from PyQt5.QtGui import QColor
 import configparser
 import os
 import logging
-from . import highlighter as hl
+from . import languages
 
 
 class PreferencesDlg(QDialog):
@@ -156,15 +156,9 @@ class PreferencesDlg(QDialog):
 
     @staticmethod
     def get_highlighters():
-        """Parse through the highlighter.py file and get the highlighter class names as strings.
+        """Get the highlighter class names of the registered languages as strings.
         Returns a list (of class names)."""
-        highlighters = []
-        classes = dir(hl)
-        classes.remove('BaseHighlighter')  # Ignore the base class
-        for highlighter in classes:
-            if highlighter.endswith('Highlighter'):
-                highlighters.append(highlighter)
-        return highlighters
+        return [language.highlighter for language in languages.LANGUAGES]
 
     def setup_editor_widgets(self):
         # Editor widgets
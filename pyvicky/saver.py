@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+from PyQt5.QtCore import QObject, pyqtSignal
+from PyQt5.QtWidgets import QApplication
+from concurrent.futures import ThreadPoolExecutor, wait
+import logging
+import os
+import time
+
+from pyvicky.file_search import write_atomic
+
+# Files, which are written at once
+MAX_SAVE_THREADS = 4
+# Characters, which are encoded at once, so the thread lets the GUI run in between
+ENCODE_CHUNK_SIZE = 1 << 20
+# none: the disk is not flushed, file: the file is flushed before the rename, full: the directory too
+FSYNC_POLICIES = ('none', 'file', 'full')
+
+save_pool = None
+
+
+def get_save_pool():
+    """
+    :return: ThreadPoolExecutor, which writes the saved files
+    """
+    global save_pool
+    if save_pool is None:
+        save_pool = ThreadPoolExecutor(max_workers=MAX_SAVE_THREADS)
+        QApplication.instance().aboutToQuit.connect(stop_save_pool)
+    return save_pool
+
+
+def stop_save_pool():
+    global save_pool
+    if save_pool is not None:
+        # the files, which are being saved, are written completely
+        save_pool.shutdown(wait=True)
+        save_pool = None
+
+
+def encode_text(text, encoding='utf-8', bom=b'', newline='\n'):
+    """
+    generator of the contents of the file in chunks
+    :param text: raw text of a QTextDocument, its lines are separated by U+2029,
+    line breaks inside of a line (Shift+Enter) are U+2028
+    :param encoding: encoding of the file
+    :param bom: byte order mark at the start of the file
+    :param newline: line end of the file
+    :return: UnicodeEncodeError is raised for a character, which the encoding lacks
+    """
+    yield bom
+    for position in range(0, len(text), ENCODE_CHUNK_SIZE):
+        chunk = text[position:position + ENCODE_CHUNK_SIZE]
+        yield chunk.replace('\u2029', newline).replace('\u2028', newline).encode(encoding)
+
+
+def write_text(path, text, encoding, bom, newline, fsync, previous):
+    """
+    encodes and writes the text, it is run in the save pool
+    :param fsync: one of FSYNC_POLICIES
+    :param previous: Future of the previous write of the same file or None, it is finished first
+    :return:
+    """
+    if previous is not None:
+        wait([previous])
+    write_atomic(path, encode_text(text, encoding, bom, newline), fsync != 'none', fsync == 'full')
+
+
+class FileSaver(QObject):
+    """
+    Writes files in background threads.
+    Every file is written to a temporary file next to it, which is renamed over it,
+    so a crash or a full disk during the write leaves the old file as it was.
+    Writes of the same file are done in their order, writes of different files at once.
+    """
+    # key passed to save, error message, it is empty, if the file was written
+    finished = pyqtSignal(object, str)
+    # key, real path of the file, Future of the write
+    written = pyqtSignal(object, str, object)
+
+    def __init__(self, parent=None):
+        super(FileSaver, self).__init__(parent)
+        # real path -> Future of the last write of the file
+        self.pending = {}
+        self.written.connect(self.on_written)
+
+    def save(self, key, path, text, encoding='utf-8', bom=b'', newline='\n', fsync='file'):
+        """
+        :param key: any object, which is passed to finished
+        :param path: path of the file, a link is followed, so the file it points to is written
+        :param text: raw text of the document
+        :param fsync: one of FSYNC_POLICIES
+        :return: Future of the write
+        """
+        path = os.path.realpath(path)
+        start = time.monotonic()
+        future = get_save_pool().submit(write_text, path, text, encoding, bom, newline, fsync,
+                                        self.pending.get(path))
+        self.pending[path] = future
+        future.startTime = start
+        future.length = len(text)
+        future.add_done_callback(lambda done: self.written.emit(key, path, done))
+        return future
+
+    def on_written(self, key, path, future):
+        if self.pending.get(path) is future:
+            del self.pending[path]
+        error = future.exception()
+        if error is None:
+            logging.info('Saved {} ({} characters) in {:.3f} s'.format(
+                path, future.length, time.monotonic() - future.startTime))
+            self.finished.emit(key, '')
+        else:
+            logging.error('Cannot save {}: {}'.format(path, error))
+            self.finished.emit(key, str(error))
+
+    def wait(self):
+        """
+        blocks until all pending files are written
+        """
+        wait(list(self.pending.values()))
@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+
+from PyQt5.QtCore import Qt, QObject, QPoint, QTimer, pyqtSignal
+from PyQt5.QtGui import QColor, QTextCharFormat, QTextCursor
+
+from bisect import bisect_left
+import logging
+import re
+import time
+
+from pyvicky.decorations import make_selection
+
+# Characters outside of the Basic Multilingual Plane take two positions in a QTextDocument
+ASTRAL = re.compile('[\U00010000-\U0010ffff]')
+
+
+def to_document_positions(text, positions):
+    """
+    converts indexes of a Python string to positions of a QTextDocument, which counts UTF-16 code units
+    :param text: text of the document
+    :param positions: sorted indexes in the text
+    :return: list of positions in the document
+    """
+    if text.isascii():
+        return list(positions)
+    astral = [match.start() for match in ASTRAL.finditer(text)]
+    if not astral:
+        return list(positions)
+    result = []
+    index = 0
+    for position in positions:
+        while index < len(astral) and astral[index] < position:
+            index += 1
+        result.append(position + index)
+    return result
+
+
+def to_text_index(text, position):
+    """
+    converts a position of a QTextDocument (UTF-16 code units) to an index of a Python string
+    :param text: text, which starts at the position 0
+    :param position: position in the text
+    :return: index in the string
+    """
+    if text.isascii():
+        return position
+    index = position
+    for count, match in enumerate(ASTRAL.finditer(text)):
+        if match.start() + count >= position:
+            break
+        index -= 1
+    return index
+
+
+class DocumentSearch(QObject):
+    """
+    Finds the next match of a pattern in a QTextDocument without a copy of the whole text:
+    the blocks after the position are read in chunks, and the search stops at the first match.
+    find_later searches a chunk after chunk in the event loop, so a search through a big document,
+    which doesn't find anything, doesn't block typing, and the next query cancels it.
+    Found matches are cached until the contents of the document change.
+    """
+    # Characters, which are read from the document at once
+    CHUNK_SIZE = 1 << 17
+    # Seconds of searching between two turns of the event loop
+    STEP_TIME = 0.02
+
+    def __init__(self, document):
+        super(DocumentSearch, self).__init__(document)
+        self.document = document
+        # incremented on every change of the contents
+        self.revision = 0
+        # (pattern, position, stop) -> (start, end) or None
+        self.cache = {}
+        # (generator, callback) of the search, which runs in the event loop
+        self.running = None
+        self.timer = QTimer(self)
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self.step)
+        document.contentsChange.connect(self.on_contents_change)
+
+    def on_contents_change(self, position, chars_removed, chars_added):
+        self.revision += 1
+        self.cache.clear()
+        self.cancel()
+
+    def find(self, pattern, position, stop=None):
+        """
+        :param pattern: compiled pattern
+        :param position: the match starts at this position or after it
+        :param stop: the search wraps around the end of the document and stops at this position,
+                     by default the whole document is searched
+        :return: start and end position of the first match or None
+        """
+        key = (pattern, position, stop)
+        if key in self.cache:
+            return self.cache[key]
+        steps = self.search(pattern, position, stop)
+        while True:
+            try:
+                next(steps)
+            except StopIteration as e:
+                return e.value
+
+    def find_later(self, pattern, position, stop, callback):
+        """
+        the same as find, but the result is passed to the callback, the running search is cancelled
+        :return: True, if the result was cached and the callback was called already
+        """
+        self.cancel()
+        key = (pattern, position, stop)
+        if key in self.cache:
+            callback(self.cache[key])
+            return True
+        self.running = (self.search(pattern, position, stop), callback)
+        self.timer.start()
+        return False
+
+    def cancel(self):
+        self.running = None
+        self.timer.stop()
+
+    def step(self):
+        if self.running is None:
+            return
+        steps, callback = self.running
+        deadline = time.monotonic() + self.STEP_TIME
+        try:
+            while time.monotonic() < deadline:
+                next(steps)
+        except StopIteration as e:
+            self.cancel()
+            callback(e.value)
+
+    def search(self, pattern, position, stop=None):
+        """
+        generator, which yields after every chunk, its return value is the result of find
+        """
+        key = (pattern, position, stop)
+        if stop is None:
+            stop = position
+        if position < stop:
+            result = yield from self.search_range(pattern, position, stop)
+        else:
+            result = yield from self.search_range(pattern, position, self.document.characterCount())
+            if result is None and stop > 0:
+                result = yield from self.search_range(pattern, 0, stop)
+        self.cache[key] = result
+        return result
+
+    def search_range(self, pattern, start, end):
+        """
+        generator of the first match, which starts between the positions start and end
+        """
+        document = self.document
+        length = document.characterCount() - 1
+        block = document.findBlock(start)
+        chunk_start = block.position()
+        offset = start - chunk_start
+        cursor = QTextCursor(document)
+        while chunk_start < end and chunk_start <= length:
+            # chunks consist of whole lines, so lookarounds see the line around the match
+            last = document.findBlock(min(chunk_start + self.CHUNK_SIZE, length))
+            chunk_end = last.position() + last.length() - 1
+            cursor.setPosition(chunk_start)
+            cursor.setPosition(chunk_end, QTextCursor.KeepAnchor)
+            text = cursor.selectedText().replace('\u2029', '\n')
+            if chunk_end < length:
+                # the paragraph separator after the chunk
+                text += '\n'
+            match = pattern.search(text, to_text_index(text, offset))
+            while match is not None and match.end() == match.start():
+                match = pattern.search(text, match.start() + 1)
+            if match is not None:
+                match_start, match_end = to_document_positions(text, match.span())
+                if chunk_start + match_start < end:
+                    return chunk_start + match_start, chunk_start + match_end
+                return None
+            chunk_start = chunk_end + 1
+            offset = 0
+            yield
+        return None
+
+
+class MatchIndex(QObject):
+    """
+    Sorted positions of all matches of a pattern in the document of an editor.
+    The pattern is matched block by block, so a match doesn't span lines.
+    An edit scans only the blocks it has touched, the matches after them are shifted by the change of the length.
+    The shift is applied lazily: matches after shiftIndex are stored without shiftDelta, and the next edit
+    moves the boundary to itself, so typing touches only the matches between two edits instead of all of them.
+    Only the matches in the viewport are passed to the editor as extra selections,
+    so the number of matches doesn't slow down painting.
+    """
+    changed = pyqtSignal()
+
+    # Upper bound of the decorations of one viewport
+    MAX_DRAWN = 5000
+
+    def __init__(self, editor, pattern):
+        super(MatchIndex, self).__init__(editor)
+        self.editor = editor
+        self.document = editor.document()
+        self.pattern = pattern
+        self.visible = False
+        # start and end positions of the matches, sorted
+        self.starts = []
+        self.ends = []
+        # positions of the matches from this index on are smaller by shiftDelta than the real ones
+        self.shiftIndex = 0
+        self.shiftDelta = 0
+        # incremented on every change of the matches
+        self.version = 0
+        self.length = self.document.characterCount()
+        # (first position, last position, version, current match) of the drawn selections
+        self.drawn = None
+
+        self.matchFormat = QTextCharFormat()
+        self.matchFormat.setBackground(QColor(Qt.yellow))
+        self.currentFormat = QTextCharFormat()
+        self.currentFormat.setBackground(QColor(255, 150, 50))
+
+        start = time.monotonic()
+        self.starts, self.ends = self.scan(self.document.begin(), self.length)
+        logging.debug('Found {} matches in {:.3f} s'.format(len(self.starts), time.monotonic() - start))
+
+        self.document.contentsChange.connect(self.on_contents_change)
+        editor.updateRequest.connect(self.draw)
+        editor.cursorPositionChanged.connect(self.draw)
+
+    def close(self):
+        """
+        removes the decorations and stops following the document
+        """
+        self.document.contentsChange.disconnect(self.on_contents_change)
+        self.editor.updateRequest.disconnect(self.draw)
+        self.editor.cursorPositionChanged.disconnect(self.draw)
+        self.editor.selectionLayers.clear_layer('search')
+        self.deleteLater()
+
+    def __len__(self):
+        return len(self.starts)
+
+    def scan(self, block, end):
+        """
+        :param block: first QTextBlock to scan
+        :param end: blocks, which start at this position or later, are not scanned
+        :return: lists of the start and the end positions of the matches
+        """
+        starts = []
+        ends = []
+        finditer = self.pattern.finditer
+        while block.isValid() and block.position() < end:
+            text = block.text()
+            spans = [match.span() for match in finditer(text) if match.end() > match.start()]
+            if spans:
+                offset = block.position()
+                positions = to_document_positions(text, [position for span in spans for position in span])
+                starts += [position + offset for position in positions[::2]]
+                ends += [position + offset for position in positions[1::2]]
+            block = block.next()
+        return starts, ends
+
+    def on_contents_change(self, position, chars_removed, chars_added):
+        document = self.document
+        length = document.characterCount()
+        # the length of the document is more reliable than chars_removed and chars_added,
+        # which include the last paragraph separator in some cases
+        delta = length - self.length
+        self.length = length
+        first = document.findBlock(position)
+        last = document.findBlock(position + chars_added)
+        if not last.isValid():
+            last = document.lastBlock()
+        end = last.position() + last.length()
+        # blocks between first and last (including it) have replaced the old text before old_end
+        old_end = end - delta
+        low = self.bisect(self.starts, first.position())
+        high = self.bisect(self.starts, old_end, low)
+        starts, ends = self.scan(first, end)
+        self.move_shift(high)
+        if delta == 0 and starts == self.starts[low:high] and ends == self.ends[low:high]:
+            # only the formats were changed
+            return
+        self.starts[low:high] = starts
+        self.ends[low:high] = ends
+        # the matches after the edit are shifted by the next edit or when the index is read there
+        self.shiftIndex = low + len(starts)
+        self.shiftDelta += delta
+        self.version += 1
+        self.changed.emit()
+        self.draw()
+
+    def move_shift(self, index):
+        """
+        applies the pending shift to the matches between shiftIndex and the index
+        :param index: new shiftIndex
+        :return:
+        """
+        delta = self.shiftDelta
+        low, high = sorted((self.shiftIndex, index))
+        if delta and low < high:
+            if index < self.shiftIndex:
+                delta = -delta
+            self.starts[low:high] = [position + delta for position in self.starts[low:high]]
+            self.ends[low:high] = [position + delta for position in self.ends[low:high]]
+        self.shiftIndex = index
+
+    def bisect(self, positions, position, low=0):
+        """
+        :param positions: starts or ends
+        :param position: position in the document
+        :return: index of the first match, which starts (or ends) at the position or after it
+        """
+        shift = self.shiftIndex
+        if low < shift:
+            index = bisect_left(positions, position, low, shift)
+            if index < shift:
+                return index
+        return bisect_left(positions, position - self.shiftDelta, max(low, shift))
+
+    def span(self, index):
+        """
+        :param index: index of the match
+        :return: start and end positions of the match
+        """
+        if index < self.shiftIndex:
+            return self.starts[index], self.ends[index]
+        return self.starts[index] + self.shiftDelta, self.ends[index] + self.shiftDelta
+
+    def current(self):
+        """
+        :return: index of the match, which is selected in the editor, or None
+        """
+        cursor = self.editor.textCursor()
+        index = self.bisect(self.starts, cursor.selectionStart())
+        if index < len(self.starts) and self.span(index) == (cursor.selectionStart(), cursor.selectionEnd()):
+            return index
+        return None
+
+    def next(self, position):
+        """
+        :param position: position in the document
+        :return: index of the first match, which starts at the position or after it, the search wraps around
+        """
+        if not self.starts:
+            return None
+        index = self.bisect(self.starts, position)
+        return index if index < len(self.starts) else 0
+
+    def previous(self, position):
+        """
+        :param position: position in the document
+        :return: index of the last match before the position, the search wraps around
+        """
+        if not self.starts:
+            return None
+        index = self.bisect(self.starts, position) - 1
+        return index if index >= 0 else len(self.starts) - 1
+
+    def set_visible(self, visible):
+        self.visible = visible
+        self.drawn = None
+        self.draw()
+
+    def draw(self, *args):
+        editor = self.editor
+        if not self.visible:
+            editor.selectionLayers.clear_layer('search')
+            return
+        viewport = editor.viewport()
+        top = editor.firstVisibleBlock().position()
+        bottom_block = editor.cursorForPosition(QPoint(viewport.width(), viewport.height())).block()
+        bottom = bottom_block.position() + bottom_block.length()
+        current = self.current()
+        key = (top, bottom, self.version, current)
+        if key == self.drawn:
+            # the cursor blinks or the viewport is repainted without scrolling
+            return
+        self.drawn = key
+        low = self.bisect(self.ends, top)
+        high = min(self.bisect(self.starts, bottom, low), low + self.MAX_DRAWN)
+        selections = []
+        for index in range(low, high):
+            start, end = self.span(index)
+            text_format = self.currentFormat if index == current else self.matchFormat
+            selections.append(make_selection(self.document, start, end, text_format))
+        editor.selectionLayers.set_layer('search', selections)
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+from PyQt5 import QtCore
+from array import array
+import builtins
+import importlib.util
+import logging
+import pathlib
+import threading
+
+# Kinds of names, which are told apart by the semantic pass. Spans refer to them by index.
+SEMANTIC_KINDS = ('parameter', 'local', 'global', 'builtin', 'attribute')
+PARAMETER, LOCAL, GLOBAL, BUILTIN, ATTRIBUTE = range(len(SEMANTIC_KINDS))
+
+BUILTINS = frozenset(dir(builtins))
+SCOPES = ('funcdef', 'lambdef', 'classdef', 'file_input')
+
+worker = None
+
+
+def available():
+    """
+    :return: True, if parso is installed and semantic highlighting can be used
+    """
+    return importlib.util.find_spec('parso') is not None
+
+
+def get_worker():
+    """
+    :return: SemanticWorker, which is shared by all documents and started on the first use
+    """
+    global worker
+    if worker is None:
+        worker = SemanticWorker()
+    return worker
+
+
+def get_scope(name):
+    """
+    :param name: parso Name leaf
+    :return: function, lambda, class or module, in which the name is bound
+    """
+    from parso.tree import search_ancestor
+    node = name.parent
+    if node.type in ('funcdef', 'classdef') and node.name is name:
+        # the name of a function or a class belongs to the enclosing scope
+        return search_ancestor(node, *SCOPES)
+    return search_ancestor(name, *SCOPES)
+
+
+def compute_spans(module):
+    """
+    resolves every name of the module to its kind
+    :param module: parso Module
+    :return: {line number (from 0): array of (column, length, kind index) triples}
+    """
+    from parso.tree import search_ancestor
+    names = [name for leaves in module.get_used_names().values() for name in leaves]
+    # id of the scope -> names, which are bound in it
+    definitions = {}
+    parameters = {}
+    bound = []
+    for name in names:
+        parent = name.parent
+        if parent.type == 'trailer' and name.get_previous_sibling() == '.':
+            bound.append((name, ATTRIBUTE))
+            continue
+        if parent.type == 'argument' and name.get_next_sibling() == '=':
+            # keyword argument, which belongs to the called function
+            continue
+        scope = get_scope(name)
+        if parent.type == 'param' and parent.name is name:
+            parameters.setdefault(id(scope), set()).add(name.value)
+        if name.is_definition():
+            definitions.setdefault(id(scope), set()).add(name.value)
+        bound.append((name, scope))
+
+    spans = {}
+    for name, scope in bound:
+        kind = scope if scope is ATTRIBUTE else None
+        value = name.value
+        innermost = True
+        while kind is None and scope is not None:
+            # class bodies are not visible from the methods
+            if (innermost or scope.type != 'classdef') and value in definitions.get(id(scope), ()):
+                if value in parameters.get(id(scope), ()):
+                    kind = PARAMETER
+                elif scope.type == 'file_input':
+                    kind = GLOBAL
+                else:
+                    kind = LOCAL
+            innermost = False
+            scope = search_ancestor(scope, *SCOPES)
+        if kind is None:
+            if value not in BUILTINS:
+                continue
+            kind = BUILTIN
+        line, column = name.start_pos
+        spans.setdefault(line - 1, array('I')).extend((column, len(value), kind))
+    return spans
+
+
+class SemanticWorker(QtCore.QObject):
+    """
+    Parses documents with parso in a daemon thread.
+    Only the newest request of every document is kept, so the requests of a fast typist
+    are not parsed one after another. Trees are kept in the diff cache of parso by the document key,
+    so the next parse reuses the unchanged parts of the previous one.
+    """
+    # key of the document, revision of the parsed text, spans
+    finished = QtCore.pyqtSignal(str, int, object)
+
+    def __init__(self):
+        super(SemanticWorker, self).__init__()
+        self.pending = {}
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name='semantic-highlighting', daemon=True)
+        self.thread.start()
+
+    def request(self, key, revision, code):
+        """
+        schedules a parse, the previous unprocessed request of the document is dropped
+        :param key: unique key of the document
+        :param revision: revision of the document, which is sent back with the result
+        :param code: text of the document
+        :return:
+        """
+        with self.condition:
+            self.pending[key] = (revision, code)
+            self.condition.notify()
+
+    def forget(self, key):
+        """
+        drops the tree of a closed document from the diff cache of parso
+        :param key: unique key of the document
+        :return:
+        """
+        with self.condition:
+            # None replaces an unprocessed request, the document isn't parsed any more
+            self.pending[key] = None
+            self.condition.notify()
+
+    def run(self):
+        import parso
+        grammar = parso.load_grammar()
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                key, request = self.pending.popitem()
+            if request is None:
+                # the cache is keyed by the path, parso made of the key
+                for trees in parso.cache.parser_cache.values():
+                    trees.pop(pathlib.Path(key), None)
+                continue
+            revision, code = request
+            try:
+                module = grammar.parse(code, path=key, diff_cache=True, cache=False)
+                spans = compute_spans(module)
+            except Exception as e:
+                logging.error('Semantic highlighting failed: {}'.format(e))
+                continue
+            try:
+                # the signal is queued to the GUI thread
+                self.finished.emit(key, revision, spans)
+            except RuntimeError:
+                # the worker was deleted at the exit of the application, while this document was parsed
+                return
+
+
+class SemanticLayer(QtCore.QObject):
+    """
+    Semantic formats of one document, merged by the highlighter on top of the lexical ones.
+    The document is sent to the worker after a pause in typing, results for an older revision are dropped.
+    Only visible blocks are reformatted, when a result comes; others get the formats when they are scrolled to.
+    """
+    # Pause after the last edit before the document is parsed (milliseconds)
+    DEBOUNCE_TIME = 400
+
+    def __init__(self, highlighter):
+        super(SemanticLayer, self).__init__(highlighter)
+        self.highlighter = highlighter
+        self.document = highlighter.document()
+        self.key = '<document {}>'.format(id(self))
+        # highlighter.edits of the text, for which the spans were computed
+        self.revision = None
+        self.spans = {}
+        # blocks, which are formatted with the current spans
+        self.appliedBlocks = set()
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.request)
+        highlighter.editor.verticalScrollBar().valueChanged.connect(self.on_view_changed)
+        get_worker().finished.connect(self.on_finished)
+        self.request()
+
+    def get_spans(self, block):
+        """
+        called from highlightBlock
+        :param block: QTextBlock, which is being highlighted
+        :return: array of (column, length, kind index) triples or None, if there are no current spans
+        """
+        if self.revision != self.highlighter.edits:
+            return None
+        number = block.blockNumber()
+        self.appliedBlocks.add(number)
+        return self.spans.get(number)
+
+    def request(self):
+        get_worker().request(self.key, self.highlighter.edits, self.document.toPlainText())
+
+    def on_contents_change(self):
+        """
+        called by the highlighter after every edit of the text
+        """
+        self.timer.start(self.DEBOUNCE_TIME)
+
+    def close(self):
+        """
+        called by the highlighter, before the document is freed
+        """
+        self.timer.stop()
+        get_worker().forget(self.key)
+
+    def on_finished(self, key, revision, spans):
+        if key != self.key or revision != self.highlighter.edits:
+            return
+        self.revision = revision
+        self.spans = spans
+        self.appliedBlocks = set()
+        self.on_view_changed()
+
+    def on_view_changed(self, *args):
+        if self.revision != self.highlighter.edits or self.highlighter.document() is None:
+            # stale or detached from the document
+            return
+        self.highlighter.update_visible_blocks()
+        first, last = self.highlighter.visibleBlocks
+        last = min(last, self.document.blockCount() - 1)
+        if any(number not in self.appliedBlocks for number in range(first, last + 1)):
+            self.highlighter.rehighlight_blocks(first, last + 1)
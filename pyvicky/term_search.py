@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Search for many terms at once.
+The terms are combined into one regular expression shaped as a trie of their characters, so the regex engine
+scans the text once and tries the terms with the same beginning together, instead of one search per term.
+At a position the longest term wins, and the matches don't overlap.
+search_files runs in the worker processes of find_in_files, so this module doesn't use Qt.
+"""
+
+import re
+
+from pyvicky.file_search import read_file, MAX_LINE_LENGTH
+
+# Longer terms are dropped, the trie is built recursively
+MAX_TERM_LENGTH = 256
+# Locations of one term kept for a file or a document, the rest is only counted
+MAX_TERM_HITS = 50
+# Characters or bytes, which are searched between the checks of a cancel, windows end at a line end
+TERM_WINDOW = 1 << 22
+
+
+def parse_terms(text):
+    """
+    :param text: terms, one per line, lines starting with # are comments
+    :return: list of the terms without duplicates in their order
+    """
+    terms = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith('#') and len(line) <= MAX_TERM_LENGTH:
+            terms.append(line)
+    return list(dict.fromkeys(terms))
+
+
+def trie_source(keys):
+    """
+    :param keys: not empty strings
+    :return: source of a regular expression, which matches any of them, the longest one at a position
+    """
+    trie = {}
+    for key in keys:
+        node = trie
+        for char in key:
+            node = node.setdefault(char, {})
+        # the empty string marks the end of a key
+        node[''] = {}
+    return node_source(trie)
+
+
+def node_source(node):
+    alternatives = [re.escape(char) + node_source(child) for char, child in sorted(node.items()) if char]
+    if not alternatives:
+        return ''
+    end = '' in node
+    if len(alternatives) == 1 and not end:
+        return alternatives[0]
+    # a longer key is tried before the key, which ends here
+    return '(?:' + '|'.join(alternatives) + (')?' if end else ')')
+
+
+def make_terms_pattern(terms, case_sensitive=False, whole_words=False, binary=False):
+    """
+    :param terms: list of the terms
+    :param case_sensitive: case sensitive search
+    :param whole_words: a term must not be a part of a longer word
+    :param binary: pattern for bytes, the files are searched as bytes
+    :return: source and flags of the pattern, {key of a match: term}
+    """
+    keys = {}
+    for term in terms:
+        key = term.encode('utf-8') if binary else term
+        if not case_sensitive:
+            key = key.lower()
+        keys.setdefault(key, term)
+    texts = [key.decode('utf-8') if binary else key for key in keys]
+    source = trie_source(texts)
+    if whole_words:
+        source = r'(?<!\w)(?:' + source + r')(?!\w)'
+    # the class of the first characters lets the regex engine skip the positions, where no term starts
+    first = {text[0] for text in texts}
+    first.update([char.upper() for char in first])
+    source = '(?=[' + ''.join(re.escape(char) for char in sorted(first)) + '])' + source
+    if binary:
+        source = source.encode('utf-8')
+    return source, 0 if case_sensitive else re.I, keys
+
+
+def find_term(keys, found, case_sensitive):
+    """
+    :param keys: {key of a match: term} from make_terms_pattern
+    :param found: text of a match
+    :return: the matched term
+    """
+    term = keys.get(found if case_sensitive else found.lower())
+    if term is None:
+        # re.I folds a few characters, which lower() keeps, like the long s
+        term = next(term for key, term in keys.items() if re.fullmatch(re.escape(key), found, re.I))
+    return term
+
+
+def count_terms(data, pattern, keys, case_sensitive, stopped=None):
+    """
+    :param data: text, bytes or mmap
+    :param pattern: compiled pattern from make_terms_pattern
+    :param keys: {key of a match: term} from make_terms_pattern
+    :param case_sensitive: case sensitive search
+    :param stopped: threading.Event, which cancels the search, it is checked after every TERM_WINDOW
+    :return: {term: [count, [(line from 1, column, text of the line)]]}, at most MAX_TERM_HITS locations of a term,
+    None, if the search was stopped
+    """
+    binary = not isinstance(data, str)
+    newline = b'\n' if binary else '\n'
+    results = {}
+    line = 1
+    position = 0
+    size = len(data)
+    window = 0
+    while window < size:
+        if stopped is not None and stopped.is_set():
+            return None
+        # a term has no line end, so a match doesn't span the windows
+        window_end = data.find(newline, window + TERM_WINDOW) + 1 if window + TERM_WINDOW < size else 0
+        if window_end <= 0:
+            window_end = size
+        for match in pattern.finditer(data, window, window_end):
+            term = find_term(keys, match.group(), case_sensitive)
+            entry = results.get(term)
+            if entry is None:
+                entry = results[term] = [0, []]
+            entry[0] += 1
+            if len(entry[1]) >= MAX_TERM_HITS:
+                continue
+            start = match.start()
+            # mmap has no count()
+            line += data[position:start].count(newline)
+            position = start
+            line_start = data.rfind(newline, 0, start) + 1
+            line_end = data.find(newline, start, start + MAX_LINE_LENGTH * 4)
+            if line_end < 0:
+                line_end = min(len(data), start + MAX_LINE_LENGTH * 4)
+            text = data[line_start:line_end]
+            column = start - line_start
+            if binary:
+                text = text.decode('utf-8', 'replace')
+                column = len(data[line_start:start].decode('utf-8', 'replace'))
+            entry[1].append((line, column, text.rstrip('\r')[:MAX_LINE_LENGTH * 2]))
+        window = window_end
+    return results
+
+
+def search_files(paths, source, flags, keys, case_sensitive):
+    """
+    counts the terms in a batch of files, it is run in a worker process
+    :param paths: paths of the files
+    :param source: bytes source of the pattern from make_terms_pattern
+    :param flags: flags of the pattern
+    :param keys: {key of a match: term} from make_terms_pattern
+    :param case_sensitive: case sensitive search
+    :return: list of (path, {term: [count, locations]}) of the files with matches
+    """
+    pattern = re.compile(source, flags)
+    results = []
+    for path in paths:
+        try:
+            with read_file(path) as data:
+                if data is None:
+                    continue
+                counts = count_terms(data, pattern, keys, case_sensitive)
+        except (OSError, ValueError):
+            continue
+        if counts:
+            results.append((path, counts))
+    return results
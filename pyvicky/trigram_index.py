@@ -0,0 +1,483 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent trigram index of a directory tree, which narrows the files a search has to read.
+index_files runs in the worker processes of find_in_files, so this module doesn't use Qt.
+"""
+
+from array import array
+from bisect import bisect_left
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import threading
+import time
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:
+    # Python before 3.11
+    import sre_parse
+    import sre_constants
+
+from pyvicky import file_search
+
+# Segments are merged into one, when there are more of them
+MAX_SEGMENTS = 8
+# Alternatives of a query, which are looked up separately, a bigger regex isn't narrowed by its groups
+MAX_ALTERNATIVES = 64
+SEGMENT_MAGIC = b'PVTRI001'
+# Files are split into chunks of this size to extract their trigrams
+TRIGRAM_CHUNK = 1 << 20
+# Lines are indexed separately, a trigram with a line end is never in the index
+NEWLINE = ord('\n')
+
+trigram_indexes = {}
+
+
+def get_cache_directory():
+    cache = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache, 'pyvicky', 'trigrams')
+
+
+def get_trigram_index(root):
+    """
+    :param root: directory of the project
+    :return: TrigramIndex of the directory, it is loaded from the cache once per process
+    """
+    root = os.path.abspath(root)
+    if root not in trigram_indexes:
+        trigram_indexes[root] = TrigramIndex(root)
+    return trigram_indexes[root]
+
+
+def trigram_key(trigram):
+    return int.from_bytes(trigram, 'big')
+
+
+def data_trigrams(data):
+    """
+    :param data: contents of a file, bytes or mmap
+    :return: set of lower case trigrams (3 bytes) of the lines
+    """
+    trigrams = set()
+    start = 0
+    # a mapped file is copied in chunks of whole lines
+    while start < len(data):
+        end = data.find(b'\n', start + TRIGRAM_CHUNK)
+        if end < 0:
+            end = len(data)
+        # repeated lines are common in code, and a match never spans lines
+        lines = set(data[start:end].lower().split(b'\n'))
+        trigrams.update(line[i:i + 3] for line in lines for i in range(len(line) - 2))
+        start = end + 1
+    return trigrams
+
+
+def index_files(files, source=None, flags=0):
+    """
+    reads a batch of files, it is run in a worker process
+    :param files: list of (id, path, search), the file is searched too, if search is True
+    :param source: bytes source of the pattern from file_search.make_pattern or None
+    :param flags: flags of the pattern
+    :return: entries [(id, path, mtime in ns, size)] of the read files,
+             postings {trigram key: array of ids}, results [(path, matches)]
+    """
+    pattern = re.compile(source, flags) if source is not None else None
+    entries = []
+    postings = {}
+    results = []
+    for file_id, path, search in files:
+        try:
+            stat = os.stat(path)
+            with file_search.read_file(path) as data:
+                if data is None:
+                    # empty and binary files have no trigrams, but they are known, so they aren't read again
+                    trigrams = ()
+                else:
+                    trigrams = data_trigrams(data)
+                    if search and pattern is not None:
+                        matches = file_search.search_data(data, pattern)
+                        if matches:
+                            results.append((path, matches))
+        except (OSError, ValueError):
+            # the file was removed or can't be read, it is tried again by the next update
+            continue
+        entries.append((file_id, path, stat.st_mtime_ns, stat.st_size))
+        for trigram in trigrams:
+            key = trigram_key(trigram)
+            ids = postings.get(key)
+            if ids is None:
+                postings[key] = array('I', (file_id,))
+            else:
+                ids.append(file_id)
+    return entries, postings, results
+
+
+def required_literals(items):
+    """
+    :param items: parsed regular expression (sre_parse)
+    :return: list of alternatives, every alternative is a list of byte strings, which a match must contain
+    """
+    alternatives = [[]]
+    run = bytearray()
+
+    def flush():
+        if len(run) >= 3:
+            for alternative in alternatives:
+                alternative.append(bytes(run))
+        run.clear()
+
+    def combine(alternatives, sub):
+        if len(alternatives) * len(sub) > MAX_ALTERNATIVES:
+            # dropping a condition only makes more files candidates
+            return alternatives
+        return [alternative + other for alternative in alternatives for other in sub]
+
+    for op, value in items:
+        if op is sre_constants.LITERAL and value != NEWLINE:
+            run.append(value)
+            continue
+        # the index has the trigrams of the lines, so a literal is split at a line end
+        flush()
+        if op is sre_constants.SUBPATTERN:
+            alternatives = combine(alternatives, required_literals(value[-1]))
+        elif op is sre_constants.BRANCH:
+            sub = []
+            for branch in value[1]:
+                sub += required_literals(branch)
+            alternatives = combine(alternatives, sub)
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) \
+                or op is getattr(sre_constants, 'POSSESSIVE_REPEAT', None):
+            if value[0] >= 1:
+                alternatives = combine(alternatives, required_literals(value[2]))
+        elif op is getattr(sre_constants, 'ATOMIC_GROUP', None):
+            alternatives = combine(alternatives, required_literals(value))
+    flush()
+    return alternatives
+
+
+def query_trigrams(source, flags):
+    """
+    :param source: bytes source of the pattern
+    :param flags: flags of the pattern
+    :return: list of alternatives, every one a set of trigram keys, which a matching file contains,
+             None, if the pattern can't narrow the files
+    """
+    try:
+        parsed = sre_parse.parse(source, flags)
+    except Exception as e:
+        logging.debug('Pattern is not narrowed: {}'.format(e))
+        return None
+    result = []
+    for alternative in required_literals(list(parsed)):
+        keys = set()
+        for literal in alternative:
+            literal = literal.lower()
+            keys.update(trigram_key(literal[i:i + 3]) for i in range(len(literal) - 2))
+        if not keys:
+            return None
+        result.append(keys)
+    return result
+
+
+class Segment:
+    """
+    Immutable inverted index of a group of files in one file of the cache:
+    sorted trigram keys, offsets of their postings and the postings (sorted file ids), all little endian.
+    Keys and offsets are read into memory, the postings are read through mmap, when they are needed.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:8] != SEGMENT_MAGIC:
+            raise ValueError('{} is not an index segment'.format(path))
+        count = int.from_bytes(self.data[8:16], 'little')
+        self.keys = array('I')
+        self.keys.frombytes(self.data[16:16 + count * 4])
+        self.offsets = array('Q')
+        self.offsets.frombytes(self.data[16 + count * 4:16 + count * 12 + 8])
+        self.postingsStart = 16 + count * 12 + 8
+
+    def close(self):
+        self.data.close()
+
+    def find(self, key):
+        index = bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            return index
+        return None
+
+    def count(self, key):
+        index = self.find(key)
+        return 0 if index is None else self.offsets[index + 1] - self.offsets[index]
+
+    def postings(self, key):
+        """
+        :param key: trigram key
+        :return: array of the ids of the files with the trigram
+        """
+        ids = array('I')
+        index = self.find(key)
+        if index is not None:
+            start = self.postingsStart + self.offsets[index] * 4
+            ids.frombytes(self.data[start:self.postingsStart + self.offsets[index + 1] * 4])
+        return ids
+
+    def candidates(self, keys):
+        """
+        :param keys: set of trigram keys
+        :return: set of the ids of the files, which contain all trigrams
+        """
+        # the rarest trigram first, the intersection is empty early for a selective query
+        result = None
+        for key in sorted(keys, key=self.count):
+            ids = set(self.postings(key))
+            result = ids if result is None else result & ids
+            if not result:
+                break
+        return result or set()
+
+    @staticmethod
+    def write(path, postings):
+        """
+        :param path: path of the segment file
+        :param postings: {trigram key: array of sorted file ids}
+        :return:
+        """
+        keys = array('I', sorted(postings))
+        offsets = array('Q', [0])
+        total = 0
+        for key in keys:
+            total += len(postings[key])
+            offsets.append(total)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(SEGMENT_MAGIC)
+            f.write(len(keys).to_bytes(8, 'little'))
+            f.write(keys.tobytes())
+            f.write(offsets.tobytes())
+            for key in keys:
+                f.write(postings[key].tobytes())
+        os.replace(path + '.tmp', path)
+
+
+class TrigramIndex:
+    """
+    Trigrams of the files of a directory tree, stored in the cache directory.
+    Every file has an id. An update stats all files and reads only the new and changed ones (by mtime and size),
+    their trigrams form a new segment, and the ids of the old versions and of removed files are marked dead.
+    Segments are merged, when there are too many of them, and the index is built again,
+    when most of the ids are dead.
+    """
+    def __init__(self, root, cache_directory=None):
+        self.root = root
+        self.directory = os.path.join(cache_directory or get_cache_directory(),
+                                      hashlib.sha1(root.encode('utf-8')).hexdigest()[:16])
+        # serializes the updates and the queries of the searches
+        self.lock = threading.Lock()
+        self.clear()
+        self.load()
+
+    def clear(self):
+        # [path relative to the root, mtime in ns, size] by id
+        self.files = []
+        # relative path -> id of its current version
+        self.ids = {}
+        self.dead = set()
+        self.segments = []
+        self.nextSegment = 0
+        self.buildTime = 0.0
+
+    def load(self):
+        try:
+            with open(os.path.join(self.directory, 'index.json'), 'r') as f:
+                state = json.load(f)
+            self.files = state['files']
+            self.dead = set(state['dead'])
+            self.nextSegment = state['nextSegment']
+            self.buildTime = state.get('buildTime', 0.0)
+            self.segments = [Segment(os.path.join(self.directory, name)) for name in state['segments']]
+        except (OSError, ValueError, KeyError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logging.error('Trigram index of {} is dropped: {}'.format(self.root, e))
+            self.close()
+            self.clear()
+            return
+        self.ids = {entry[0]: file_id for file_id, entry in enumerate(self.files)
+                    if entry is not None and file_id not in self.dead}
+        logging.info('Loaded trigram index of {} files of {}'.format(len(self.ids), self.root))
+
+    def save(self):
+        state = {'root': self.root,
+                 'files': self.files,
+                 'dead': sorted(self.dead),
+                 'nextSegment': self.nextSegment,
+                 'buildTime': self.buildTime,
+                 'segments': [os.path.basename(segment.path) for segment in self.segments]}
+        path = os.path.join(self.directory, 'index.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(path + '.tmp', path)
+        # segments, which are not referenced any more
+        names = set(state['segments'])
+        for name in os.listdir(self.directory):
+            if name.startswith('segment-') and name not in names:
+                os.remove(os.path.join(self.directory, name))
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
+
+    def is_built(self):
+        return bool(self.files)
+
+    def size(self):
+        """
+        :return: size of the index on the disk in bytes
+        """
+        try:
+            return sum(entry.stat().st_size for entry in os.scandir(self.directory))
+        except OSError:
+            return 0
+
+    def candidates(self, source, flags):
+        """
+        :param source: bytes source of the pattern
+        :param flags: flags of the pattern
+        :return: paths of the indexed files, which may match, ordered by their ids
+        """
+        alternatives = query_trigrams(source, flags)
+        if alternatives is None:
+            ids = set(self.ids.values())
+        else:
+            ids = set()
+            for keys in alternatives:
+                for segment in self.segments:
+                    ids |= segment.candidates(keys)
+            ids -= self.dead
+        return [os.path.join(self.root, self.files[file_id][0]) for file_id in sorted(ids)]
+
+    def update(self, submit, stopped=None, searched=(), source=None, flags=0, on_found=None):
+        """
+        indexes the new and changed files and drops the removed ones, they are searched at the same time
+        :param submit: function, which runs index_files in the pool and returns a future
+        :param stopped: threading.Event, the update ends, when it is set, the indexed part is kept
+        :param searched: paths, which have been searched already, they are only indexed
+        :param source: bytes source of the pattern to search the changed files for, or None
+        :param flags: flags of the pattern
+        :param on_found: function, which gets the results [(path, matches)] of every batch
+        :return: number of indexed files
+        """
+        start = time.monotonic()
+        if len(self.dead) > len(self.ids):
+            logging.info('Trigram index of {} is built again'.format(self.root))
+            self.close()
+            self.clear()
+        first_build = not self.files
+        prefix = len(self.root.rstrip('/')) + 1
+        alive = set(self.ids.values())
+        # ids of the files found by the walk, changed or not
+        seen = set()
+        futures = []
+        batch = []
+        for entry in file_search.walk_entries(self.root, stopped):
+            path = entry.path[prefix:]
+            file_id = self.ids.get(path)
+            if file_id is not None:
+                seen.add(file_id)
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if self.files[file_id][1:] == [stat.st_mtime_ns, stat.st_size]:
+                    continue
+            # the new version gets a new id, the entry is filled in, when the file is read
+            batch.append((len(self.files), entry.path, entry.path not in searched))
+            self.files.append(None)
+            if len(batch) >= file_search.BATCH_FILES:
+                futures.append(submit(batch, source, flags))
+                batch = []
+        if batch:
+            futures.append(submit(batch, source, flags))
+
+        postings = {}
+        indexed = 0
+        for future in futures:
+            if stopped is not None and stopped.is_set():
+                future.cancel()
+                continue
+            entries, batch_postings, results = future.result()
+            if results and on_found is not None:
+                on_found(results)
+            for file_id, path, mtime, size in entries:
+                path = path[prefix:]
+                old = self.ids.get(path)
+                if old is not None:
+                    self.dead.add(old)
+                self.ids[path] = file_id
+                self.files[file_id] = [path, mtime, size]
+                indexed += 1
+            for key, ids in batch_postings.items():
+                known = postings.get(key)
+                if known is None:
+                    postings[key] = ids
+                else:
+                    known.extend(ids)
+
+        removed = 0
+        if stopped is None or not stopped.is_set():
+            # the files, which the walk hasn't found, were removed
+            for file_id in alive - seen:
+                del self.ids[self.files[file_id][0]]
+                self.dead.add(file_id)
+                removed += 1
+        if indexed or removed:
+            self.write(postings)
+            if first_build:
+                self.buildTime = time.monotonic() - start
+                self.save()
+            logging.info('Indexed {} files and removed {} in {:.3f} s'.format(
+                indexed, removed, time.monotonic() - start))
+        return indexed
+
+    def write(self, postings):
+        """
+        adds the postings of the new files as a new segment and saves the index
+        :param postings: {trigram key: array of file ids}
+        :return:
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        if postings:
+            self.segments.append(self.write_segment(postings))
+        if len(self.segments) > MAX_SEGMENTS:
+            self.merge()
+        self.save()
+
+    def write_segment(self, postings):
+        path = os.path.join(self.directory, 'segment-{}'.format(self.nextSegment))
+        self.nextSegment += 1
+        Segment.write(path, postings)
+        return Segment(path)
+
+    def merge(self):
+        """
+        merges all segments into one, the ids of the later segments are bigger, so the postings stay sorted
+        """
+        postings = {}
+        for segment in self.segments:
+            for index, key in enumerate(segment.keys):
+                ids = array('I')
+                ids.frombytes(segment.data[segment.postingsStart + segment.offsets[index] * 4:
+                                           segment.postingsStart + segment.offsets[index + 1] * 4])
+                known = postings.get(key)
+                if known is None:
+                    postings[key] = ids
+                else:
+                    known.extend(ids)
+        merged = self.write_segment(postings)
+        self.close()
+        self.segments = [merged]
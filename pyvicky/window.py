@@ -2,14 +2,21 @@
 import configparser
 import sys
 import os
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, pyqtSignal
 from PyQt5.QtWidgets import QApplication, QWidget, QAction, QMainWindow, QInputDialog, QLineEdit, QFileDialog, \
     QTextEdit, QMessageBox, QVBoxLayout, QTabWidget, QFileSystemModel, QTreeView, QDockWidget
-from PyQt5.QtGui import QIcon, QFont, QSyntaxHighlighter, QTextCharFormat
-from pyvicky.highlighter import PythonHighlighter
+from PyQt5.QtGui import QIcon, QFont, QSyntaxHighlighter, QTextCharFormat, QTextCursor
+from PyQt5 import sip
+from pyvicky.highlighter import create_highlighter
+from pyvicky import completion, languages
 from pyvicky.preferences import PreferencesDlg
 from pyvicky.numberbar import QCodeEditor
 from pyvicky.find import Find
+from pyvicky.find_in_files import FindInFiles
+from pyvicky.find_terms import FindTerms
+from pyvicky.loader import FileLoader, LoadingBar, BatchLoader, BATCH_FILE_SIZE
+from pyvicky.large_file import LargeFileView
+from pyvicky.saver import FileSaver
 from pyvicky.interpreter_dialog import InterpreterDlg
 
 import traceback
@@ -42,6 +49,8 @@ class Window(QMainWindow):
         self.currentFilePath = os.getcwd()
         self.firstSave = True
         self.findDlg = None
+        self.fileSaver = FileSaver(self)
+        self.fileSaver.finished.connect(self.on_file_saved)
 
         self.add_menu_bar()
         self.add_tool_bar()
@@ -57,9 +66,17 @@ class Window(QMainWindow):
         self.tabWidget = TabView(self)
         self.setCentralWidget(self.tabWidget)
         self.tabWidget.tabWidget.tabCloseRequested.connect(self.close_tab)
+        self.tabWidget.tabWidget.currentChanged.connect(self.on_tab_changed)
+        self.tabWidget.editorRemoved.connect(completion.forget_editor)
 
         self.addDockWidget(Qt.LeftDockWidgetArea, self.docked_items)
 
+        self.docked_search = QDockWidget("Find in Files", self)
+        self.findInFiles = FindInFiles(self)
+        self.docked_search.setWidget(self.findInFiles)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.docked_search)
+        self.docked_search.hide()
+
         # self.tabWidget.add_tab(self, "new")
 
         self.font = QFont()
@@ -89,6 +106,11 @@ class Window(QMainWindow):
         open_button.setStatusTip('Open file')
         open_button.triggered.connect(self.open_file)  # without brackets, else it will execute immediately
 
+        open_files_button = QAction('Open files', self)
+        open_files_button.setShortcut('Ctrl+Alt+O')
+        open_files_button.setStatusTip('Open several files')
+        open_files_button.triggered.connect(lambda: self.open_files())
+
         new_button = QAction('New file', self)
         new_button.setShortcut('Ctrl+N')
         new_button.setStatusTip('New file')
@@ -97,7 +119,17 @@ class Window(QMainWindow):
         save_button = QAction('Save file', self)
         save_button.setShortcut('Ctrl+S')
         save_button.setStatusTip('Save file')
-        save_button.triggered.connect(self.save_file)
+        save_button.triggered.connect(lambda: self.save_file())
+
+        save_as_button = QAction('Save file as', self)
+        save_as_button.setShortcut('Ctrl+Shift+S')
+        save_as_button.setStatusTip('Save file as')
+        save_as_button.triggered.connect(lambda: self.save_file(ask=True))
+
+        save_all_button = QAction('Save all', self)
+        save_all_button.setShortcut('Ctrl+Alt+S')
+        save_all_button.setStatusTip('Save all modified files')
+        save_all_button.triggered.connect(self.save_all)
 
         open_dir_button = QAction('Open directory', self)
         open_dir_button.setShortcut('Ctrl+Shift+O')
@@ -106,8 +138,11 @@ class Window(QMainWindow):
 
         file_menu.addAction(exit_button)
         file_menu.addAction(open_button)
+        file_menu.addAction(open_files_button)
         file_menu.addAction(new_button)
         file_menu.addAction(save_button)
+        file_menu.addAction(save_as_button)
+        file_menu.addAction(save_all_button)
         file_menu.addAction(open_dir_button)
 
         copy_text = QAction('Copy', self)
@@ -124,9 +159,14 @@ class Window(QMainWindow):
         clear_text.setShortcut('Ctrl+Y')
         clear_text.triggered.connect(self.clear_text)
 
+        goto_line = QAction('Go to Line', self)
+        goto_line.setShortcut('Ctrl+G')
+        goto_line.triggered.connect(self.ask_line)
+
         edit_menu.addAction(copy_text)
         edit_menu.addAction(paste_text)
         edit_menu.addAction(clear_text)
+        edit_menu.addAction(goto_line)
 
         edit_highlight = QAction('Preferences', self)
         edit_highlight.setShortcut('Ctrl+P')
@@ -145,7 +185,17 @@ class Window(QMainWindow):
         search_edit.setShortcut('Ctrl+F')
         search_edit.triggered.connect(self.search_config)
 
+        search_files = QAction('Find in Files', self)
+        search_files.setShortcut('Ctrl+Shift+F')
+        search_files.triggered.connect(self.search_files)
+
+        search_terms = QAction('Find Terms', self)
+        search_terms.setShortcut('Ctrl+Shift+T')
+        search_terms.triggered.connect(self.search_terms)
+
         search_menu.addAction(search_edit)
+        search_menu.addAction(search_files)
+        search_menu.addAction(search_terms)
 
         interp_edit = QAction('Interpreter Settings', self)
         interp_edit.setShortcut('Ctrl+I')
@@ -248,38 +298,173 @@ class Window(QMainWindow):
             return path
 
     def open_file(self, filename=None):
-        try:
-            if not filename:
-                filename = self.open_file_name_dialog()
-
-            if filename and os.path.isfile(filename):
-                self.tabWidget.add_tab(self, filename, open(filename).read())
-                # self.text.setPlainText(open(filename).read())
-                self.update_ui()
-                logger.info('File opened')
+        """
+        opens the file in a new tab, the text is loaded in the background
+        :param filename: path of the file, it is asked for, if it is not given
+        :return: the tab or None
+        """
+        if not filename:
+            filename = self.open_file_name_dialog()
+        if not filename or not os.path.isfile(filename):
+            return None
+
+        if os.path.getsize(filename) >= self.settings.getint('Editor', 'LargeFileSize', fallback=256) << 20:
+            try:
+                tab = self.tabWidget.add_viewer_tab(self, filename)
+            except (OSError, ValueError) as e:
+                # an encoding, which the viewer doesn't support, the file is loaded into an editor
+                logger.info('Cannot map {}: {}'.format(filename, e))
+            else:
+                tab.viewer.setFont(self.font)
+                self.tabWidget.tabWidget.setCurrentWidget(tab)
                 self.set_title(filename)
-        except IOError as io_e:
-            logger.error(io_e)
-            sys.exit(1)
+                return tab
 
-        except Exception as e:
-            logger.error(e)
-            sys.exit(1)
-
-    def open_files(self):
-        # TODO: not implemented, implement, when tabs will be created
-        filename, _ = QFileDialog.getOpenFileName(self, "Open File", '', "All Files (*)")
-        try:
-            self.tabWidget.add_tab(self, filename, open(filename).read())
-            # self.text.setPlainText(open(filename).read())
+        tab = self.tabWidget.add_tab(self, filename, file_path=filename)
+        self.load_tab(tab)
+        self.tabWidget.tabWidget.setCurrentWidget(tab)
+        self.set_title(filename)
+        return tab
 
-        except IOError as io_e:
-            logger.error(io_e)
-            sys.exit(1)
+    def load_tab(self, tab):
+        """
+        loads the file of the tab into its editor in the background
+        :param tab: tab with an empty editor
+        :return: FileLoader of the tab
+        """
+        editor = tab.editor
+        editor.setFont(self.font)
+        # the text is not editable, until it is loaded completely
+        editor.setReadOnly(True)
+        loader = FileLoader(tab.file_path, editor.document())
+        tab.loader = loader
+        tab.loadingBar = LoadingBar(loader, tab)
+        tab.layout.insertWidget(0, tab.loadingBar)
+        loader.loaded.connect(lambda: self.on_file_loaded(tab))
+        loader.failed.connect(lambda error: self.on_file_failed(tab, error))
+        loader.start()
+        return loader
+
+    def finish_loading(self, tab):
+        """
+        removes the loading state of the tab
+        :return: False, if the tab was closed
+        """
+        if sip.isdeleted(tab) or tab.loader is None:
+            # the tab was closed meanwhile
+            return False
+        loader = tab.loader
+        tab.loader = None
+        tab.encoding = loader.encoding
+        tab.bom = loader.bom
+        tab.newline = loader.newline
+        tab.editor.setReadOnly(False)
+        tab.loadingBar.deleteLater()
+        tab.loadingBar = None
+        return True
 
-        except Exception as e:
-            logger.error(e)
-            sys.exit(1)
+    def on_file_loaded(self, tab):
+        if self.finish_loading(tab):
+            # only the new tab is set up, the others keep their highlighters
+            self.setup_tab(self.tabWidget.tabWidget.indexOf(tab))
+            self.hibernate_tabs()
+            logger.info('File opened')
+
+    def on_file_failed(self, tab, error):
+        if not self.finish_loading(tab):
+            return
+        self.tabWidget.close_tab(self.tabWidget.tabWidget.indexOf(tab))
+        if error:
+            QMessageBox.warning(self, 'Cannot open file', 'Cannot open {}:\n{}'.format(tab.file_path, error))
+
+    def open_files(self, paths=None):
+        """
+        opens several files at once, they are read and decoded in the background,
+        their tabs are created together and the preferences are applied to them once
+        :param paths: paths of files or directories, they are asked for, if they are not given,
+                      directories are shown in the tree, paths, which don't exist, are opened as new files
+        :return: BatchLoader or None
+        """
+        if paths is None:
+            paths = self.open_file_names_dialog()
+        if not paths:
+            return None
+
+        directories = []
+        files = []
+        for path in paths:
+            path = os.path.abspath(path)
+            if os.path.isdir(path):
+                directories.append(path)
+            elif path not in files:
+                files.append(path)
+        if directories:
+            self.treeWidget.show_directories(directories)
+
+        large_size = self.settings.getint('Editor', 'LargeFileSize', fallback=256) << 20
+        batch = []
+        for path in files:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            # big files are loaded in chunks, the rest is read by the batch
+            if size <= min(BATCH_FILE_SIZE, large_size) and self.tabWidget.find_tab(path) is None:
+                batch.append(path)
+
+        loader = BatchLoader(batch, self)
+        loader.loaded.connect(lambda results: self.on_files_read(loader, files, dict(results)))
+        loader.start()
+        return loader
+
+    def on_files_read(self, loader, files, results):
+        """
+        creates the tabs of a batch open in one pass
+        :param loader: BatchLoader of the files
+        :param files: all files of the batch in their order
+        :param results: path -> Future of read_text for the files, which were read by the loader
+        :return:
+        """
+        loader.deleteLater()
+        errors = []
+        tab = None
+        # the preferences are applied to the new editors at once
+        created = False
+        for path in files:
+            future = results.get(path)
+            if future is None:
+                index = self.tabWidget.find_tab(path)
+                if index is not None:
+                    tab = self.tabWidget.tabWidget.widget(index)
+                elif os.path.exists(path):
+                    tab = self.open_file(path) or tab
+                else:
+                    tab = self.tabWidget.add_tab(self, path, file_path=path)
+                    created = True
+                    logger.info('Create file')
+                continue
+            if future.cancelled():
+                continue
+            error = future.exception()
+            if error is not None:
+                logger.error('Cannot open {}: {}'.format(path, error))
+                errors.append('{}: {}'.format(path, error))
+                continue
+            text, encoding, bom, newline = future.result()
+            tab = self.tabWidget.add_tab(self, path, text, path)
+            tab.encoding = encoding
+            tab.bom = bom
+            tab.newline = newline
+            created = True
+        if tab is not None:
+            # the tabs over the budget are hibernated, before their highlighters are created
+            self.tabWidget.tabWidget.setCurrentWidget(tab)
+            self.set_title(tab.file_path)
+        if created:
+            self.update_ui()
+        logger.info('Opened {} files'.format(len(files)))
+        if errors:
+            QMessageBox.warning(self, 'Cannot open files', 'Cannot open:\n' + '\n'.join(errors))
 
     def save_file_dialog(self):
         """
@@ -298,33 +483,90 @@ class Window(QMainWindow):
 
         return None
 
-    def save_file(self, current=None):
-        try:
+    def save_file(self, current=None, ask=False):
+        """
+        saves the tab in the background, the path is asked for only for a new file
+        :param current: index of the tab, the current tab by default
+        :param ask: the path is asked for, even if the tab has one (Save as)
+        :return: Future of the write or None, if nothing is saved
+        """
+        if current is None:
+            current = self.tabWidget.get_cur_index()
+        if current < 0:
+            return None
+        tab = self.tabWidget.tabWidget.widget(current)
+        if tab.loader is not None or tab.viewer is not None or tab.editor is None:
+            # the file is being loaded, it is read-only or hibernated without changes
+            return None
+        file_name = tab.file_path
+        if ask or not file_name:
             file_name = self.save_file_dialog()
-            with open(file_name, "w") as CurrentFile:
-                if not current:
-                    current = self.tabWidget.get_cur_index()
-                CurrentFile.write(self.get_editor_by_index(current).toPlainText())
-                # CurrentFile.write(self.text.toPlainText())
-            CurrentFile.close()
-            self.set_title(file_name)
-            logger.info('File saved')
-
-        except IOError as io_e:
-            logger.error(io_e)
-            sys.exit(1)
+            if not file_name:
+                return None
+        document = tab.editor.document()
+        fsync = self.settings.get('Editor', 'FSync', fallback='file')
+        # the text is copied here, it is encoded and written in a thread
+        return self.fileSaver.save((tab, file_name, self.edit_count(tab)), file_name, document.toRawText(),
+                                   tab.encoding, tab.bom, tab.newline, fsync)
+
+    def save_all(self):
+        """
+        saves all modified tabs, their files are written at once
+        :return: list of the Futures of the writes
+        """
+        futures = []
+        for index in range(self.tabWidget.get_tabs()):
+            editor = self.get_editor_by_index(index)
+            if editor is not None and editor.document().isModified():
+                future = self.save_file(index)
+                if future is not None:
+                    futures.append(future)
+        logger.info('Saving {} files'.format(len(futures)))
+        return futures
 
-        except Exception as e:
-            logger.error(e)
-            sys.exit(1)
+    @staticmethod
+    def edit_count(tab):
+        """
+        :return: number, which changes with every edit of the text of the tab, but not with its highlighting
+        """
+        if tab.highlighter is not None:
+            return tab.highlighter.edits
+        return tab.editor.document().revision()
+
+    def on_file_saved(self, key, error):
+        tab, file_name, edits = key
+        if sip.isdeleted(tab) or self.tabWidget.tabWidget.indexOf(tab) < 0:
+            # the tab was closed meanwhile
+            return
+        if error:
+            QMessageBox.warning(self, 'Cannot save file', 'Cannot save {}:\n{}'.format(file_name, error))
+            return
+        index = self.tabWidget.tabWidget.indexOf(tab)
+        if self.edit_count(tab) == edits:
+            # the text wasn't edited during the write
+            tab.editor.document().setModified(False)
+        if tab.file_path != file_name:
+            tab.file_path = file_name
+            self.tabWidget.tabWidget.setTabText(index, os.path.basename(file_name))
+            # the new name may be of another language
+            self.tabWidget.set_highlighter(index)
+        if index == self.tabWidget.get_cur_index():
+            self.set_title(file_name)
+        logger.info('File saved')
 
     def copy_func(self):
         current = self.tabWidget.get_cur_index()
+        viewer = self.tabWidget.get_viewer_from_tab(current)
+        if viewer is not None:
+            viewer.copy()
+            return
         self.get_editor_by_index(current).copy()
 
     def paste_func(self):
         current = self.tabWidget.get_cur_index()
-        self.get_editor_by_index(current).paste()
+        editor = self.get_editor_by_index(current)
+        if editor is not None:
+            editor.paste()
 
     def get_editor_by_index(self, current):
         return self.tabWidget.get_editor_from_tab(current)
@@ -333,6 +575,10 @@ class Window(QMainWindow):
         # destroy = self.text.document().isModified()
         if current is None:
             current = self.tabWidget.get_cur_index()
+        tab = self.tabWidget.tabWidget.widget(current)
+        if tab.loader is not None or tab.viewer is not None or tab.editor is None:
+            # the file is being loaded, it is read-only or hibernated, it can't have any changes
+            return False
         destroy = self.get_editor_by_index(current).document().isModified()
 
         if not destroy:
@@ -348,7 +594,15 @@ class Window(QMainWindow):
             elif detour == QMessageBox.No:
                 return False
             elif detour == QMessageBox.Yes:
-                return self.save_file(current)
+                future = self.save_file(current)
+                if future is None:
+                    return True
+                # the tab is closed only if its file is written
+                error = future.exception()
+                if error is not None:
+                    QMessageBox.warning(self, 'Cannot save file', 'Cannot save the file:\n{}'.format(error))
+                    return True
+                return False
 
         return True
 
@@ -371,6 +625,8 @@ class Window(QMainWindow):
         if self.track_unsaved_files():
             event.ignore()
         else:
+            # files, which are being saved, are written completely
+            self.fileSaver.wait()
             self.close_application()
 
     def new_file(self):
@@ -381,7 +637,9 @@ class Window(QMainWindow):
 
     def clear_text(self):
         current = self.tabWidget.get_cur_index()
-        self.get_editor_by_index(current).clear()
+        editor = self.get_editor_by_index(current)
+        if editor is not None:
+            editor.clear()
 
     def set_title(self, file_path):
         file_path = file_path.split('/')[-1]
@@ -400,11 +658,26 @@ class Window(QMainWindow):
 
         count = self.tabWidget.get_tabs()
         for i in range(count):
-            highlighter = self.tabWidget.set_highlighter(i)
-            text = self.tabWidget.get_editor_from_tab(i)
-            text.setPalette(highlighter.get_palette())
-            text.setTabStopWidth(40)
-            text.setFont(self.font)
+            self.setup_tab(i)
+
+    def setup_tab(self, index):
+        """
+        applies the font, the theme and the highlighter to the editor or viewer of the tab
+        :param index: index of the tab
+        :return:
+        """
+        viewer = self.tabWidget.get_viewer_from_tab(index)
+        if viewer is not None:
+            viewer.setFont(self.font)
+            return
+        if self.tabWidget.tabWidget.widget(index).editor is None:
+            # a hibernated tab is set up, when it is loaded again
+            return
+        highlighter = self.tabWidget.set_highlighter(index)
+        text = self.tabWidget.get_editor_from_tab(index)
+        text.setPalette(highlighter.get_palette())
+        text.setTabStopWidth(40)
+        text.setFont(self.font)
 
     def load_config(self):
         self.settings.read('pyvicky/configs/settings.ini')
@@ -414,6 +687,15 @@ class Window(QMainWindow):
         find = Find(self)
         find.show()
 
+    def search_files(self):
+        self.docked_search.show()
+        self.findInFiles.findField.setFocus()
+        self.findInFiles.findField.selectAll()
+
+    def search_terms(self):
+        find_terms = FindTerms(self)
+        find_terms.show()
+
     def change_preferences(self):
         try:
             # Create the Preferences dialog
@@ -426,7 +708,7 @@ class Window(QMainWindow):
             self.firstSave = False
 
             with open(self.currentFilePath, 'r') as f:
-                self.tabWidget.add_tab(self, "INI", f.read())
+                self.tabWidget.add_tab(self, "INI", f.read(), self.currentFilePath)
                 # self.text.clear()
                 # self.text.setPlainText(f.read())
 
@@ -467,6 +749,8 @@ class Window(QMainWindow):
         self.load_config()
 
         self.setup_editor()
+        # the budget of the tabs may have changed
+        self.hibernate_tabs()
         # self.text.update()
         self.update()
         logging.info("Updated preferences")
@@ -484,6 +768,138 @@ class Window(QMainWindow):
         else:
             self.tabWidget.close_tab(current_index)
 
+    def on_tab_changed(self, index):
+        if index < 0:
+            return
+        tab = self.tabWidget.tabWidget.widget(index)
+        tab.lastUsed = time.monotonic()
+        if tab.hibernated is not None:
+            self.wake_tab(tab)
+        self.hibernate_tabs()
+
+    def hibernate_tabs(self):
+        """
+        hibernates the least recently used tabs, until the editors fit into the budget,
+        HibernateTabs editors with HibernateSize MB of text at most, 0 turns the limit off.
+        Only unmodified tabs of existing files are hibernated, the current tab never.
+        :return: number of the hibernated tabs
+        """
+        max_tabs = self.settings.getint('Editor', 'HibernateTabs', fallback=30)
+        max_size = self.settings.getint('Editor', 'HibernateSize', fallback=256) << 20
+        current = self.tabWidget.get_cur_index()
+        count = 0
+        size = 0
+        candidates = []
+        for index in range(self.tabWidget.get_tabs()):
+            tab = self.tabWidget.tabWidget.widget(index)
+            if tab.editor is None:
+                continue
+            count += 1
+            # UTF-16 text, the layout and the formats come on top of it
+            tab_size = tab.editor.document().characterCount() * 2
+            size += tab_size
+            if index != current and tab.loader is None and not tab.editor.document().isModified() and \
+                    tab.file_path and os.path.isfile(tab.file_path):
+                candidates.append((tab.lastUsed, index, tab_size))
+        hibernated = 0
+        for _, index, tab_size in sorted(candidates):
+            if (not max_tabs or count <= max_tabs) and (not max_size or size <= max_size):
+                break
+            self.tabWidget.hibernate_tab(index)
+            count -= 1
+            size -= tab_size
+            hibernated += 1
+        if hibernated:
+            logger.info('Hibernated {} tabs, {} editors with {} KB of text are left'.format(
+                hibernated, count, size >> 10))
+        return hibernated
+
+    def wake_tab(self, tab):
+        """
+        loads the file of a hibernated tab again, its cursor and scroll position are restored, when it is loaded
+        """
+        anchor, position, vertical, horizontal = tab.hibernated
+        tab.hibernated = None
+        self.tabWidget.add_editor(self, tab)
+        loader = self.load_tab(tab)
+        loader.loaded.connect(lambda: self.restore_view(tab, anchor, position, vertical, horizontal))
+        logger.info('Waking up ' + tab.file_path)
+
+    @staticmethod
+    def restore_view(tab, anchor, position, vertical, horizontal):
+        if sip.isdeleted(tab) or tab.editor is None:
+            return
+        editor = tab.editor
+        # the file may have become shorter meanwhile
+        length = editor.document().characterCount() - 1
+        cursor = editor.textCursor()
+        cursor.setPosition(min(anchor, length))
+        cursor.setPosition(min(position, length), QTextCursor.KeepAnchor)
+        editor.setTextCursor(cursor)
+        editor.verticalScrollBar().setValue(vertical)
+        editor.horizontalScrollBar().setValue(horizontal)
+
+    def open_file_at(self, path, line=1, column=0):
+        """
+        shows the file, it is opened in a new tab, if it isn't opened yet
+        :param path: path of the file
+        :param line: line to move the cursor to, from 1
+        :param column: column in the line
+        :return:
+        """
+        index = self.tabWidget.find_tab(path)
+        if index is None:
+            self.open_file(path)
+            index = self.tabWidget.find_tab(path)
+            if index is None:
+                return
+        self.tabWidget.tabWidget.setCurrentIndex(index)
+        tab = self.tabWidget.tabWidget.widget(index)
+        if tab.loader is not None:
+            # the line may not be loaded yet
+            tab.loader.loaded.connect(lambda: self.open_file_at(path, line, column))
+            return
+        self.goto_line(index, line, column)
+
+    def goto_line(self, index, line, column=0):
+        """
+        moves the cursor of the tab to the line
+        :param index: index of the tab
+        :param line: line from 1
+        :param column: column in the line
+        :return:
+        """
+        viewer = self.tabWidget.get_viewer_from_tab(index)
+        if viewer is not None:
+            viewer.goto_line(line, column)
+            viewer.setFocus()
+            return
+        editor = self.get_editor_by_index(index)
+        block = editor.document().findBlockByNumber(line - 1)
+        if not block.isValid():
+            block = editor.document().lastBlock()
+        cursor = editor.textCursor()
+        cursor.setPosition(block.position() + min(column, block.length() - 1))
+        editor.setTextCursor(cursor)
+        editor.centerCursor()
+        editor.setFocus()
+
+    def ask_line(self):
+        current = self.tabWidget.get_cur_index()
+        if current < 0:
+            return
+        viewer = self.tabWidget.get_viewer_from_tab(current)
+        if viewer is not None:
+            count = viewer.file.line_count()
+            line = viewer.currentLine + 1
+        else:
+            cursor = self.get_editor_by_index(current).textCursor()
+            count = cursor.document().blockCount()
+            line = cursor.blockNumber() + 1
+        line, ok = QInputDialog.getInt(self, 'Go to Line', 'Line (1 - {}):'.format(count), line, 1, count)
+        if ok:
+            self.goto_line(current, line)
+
     def open_file_from_tree(self, index):
         # TODO: iterate if file is already opned, or not??=)
         path = self.treeWidget.tree_function(index)
@@ -495,6 +911,7 @@ class DirectoriesTreeView(QWidget):
     def __init__(self, parent, _dir=None):
         super(QWidget, self).__init__(parent)
         self.tree = QTreeView()
+        self.rootPath = None
         windowLayout = QVBoxLayout()
         windowLayout.addWidget(self.tree)
         self.setLayout(windowLayout)
@@ -510,6 +927,7 @@ class DirectoriesTreeView(QWidget):
             # print(self.model.rootPath())
             # print(self.model.rootDirectory())
             index = self.model.index(self.model.rootPath())
+            self.rootPath = _dir
 
             self.tree.setModel(self.model)
             self.tree.setRootIndex(index)
@@ -527,6 +945,30 @@ class DirectoriesTreeView(QWidget):
 
         self.show()
 
+    def root_path(self):
+        """
+        :return: opened directory, the working directory, if none is opened
+        """
+        return self.rootPath or os.getcwd()
+
+    def show_directories(self, directories):
+        """
+        shows the directories in the tree, their common parent becomes its root
+        :param directories: absolute paths of the directories
+        :return:
+        """
+        root = os.path.commonpath(directories)
+        self.initUI(root)
+        for directory in directories:
+            if directory == root:
+                continue
+            # the directory is shown with the directories above it up to the root
+            index = self.model.index(directory)
+            while index.isValid() and index != self.tree.rootIndex():
+                self.tree.expand(index)
+                index = index.parent()
+        logging.info('Tree shows {} directories'.format(len(directories)))
+
     def tree_function(self, index):
         # print(item)
         path = self.sender().model().filePath(index)
@@ -535,6 +977,10 @@ class DirectoriesTreeView(QWidget):
 
 
 class TabView(QWidget):
+    # editor of a tab, which is closed or hibernated, it is emitted before the editor is deleted,
+    # so the dialogs and the completion drop it
+    editorRemoved = pyqtSignal(object)
+
     def __init__(self, parent):
         super(QWidget, self).__init__(parent)
         self.layout = QVBoxLayout(self)
@@ -549,25 +995,122 @@ class TabView(QWidget):
         self.layout.addWidget(self.tabWidget)
         self.setLayout(self.layout)
 
-    def add_tab(self, parent, tab_name, text=''):
+    def create_tab(self, file_path):
+        """
+        :param file_path: path of the file or None
+        :return: tab widget without its editor or viewer
+        """
         tab = QWidget()
+        tab.file_path = file_path
+        tab.highlighter = None
+        tab.editor = None
+        # LargeFileView of a file, which is too big for an editor
+        tab.viewer = None
+        # FileLoader of a file, which is being loaded, and its progress
+        tab.loader = None
+        tab.loadingBar = None
+        # how the file is stored, set by the loader
+        tab.encoding = 'utf-8'
+        tab.bom = b''
+        tab.newline = os.linesep
+        # the least recently used tabs are hibernated first
+        tab.lastUsed = time.monotonic()
+        # (anchor, position, vertical scroll, horizontal scroll) of a tab without its editor
+        tab.hibernated = None
         tab.layout = QVBoxLayout(self)
-        text_editor = QCodeEditor(parent)
-        text_editor.setPlainText(text)
-        tab.layout.addWidget(text_editor)
         tab.setLayout(tab.layout)
+        return tab
+
+    def add_tab(self, parent, tab_name, text='', file_path=None):
+        tab = self.create_tab(file_path)
+        self.add_editor(parent, tab, text)
         if '/' in tab_name:
             tab_name = tab_name.split('/')[-1]
         self.tabWidget.addTab(tab, tab_name)
         logging.info('Added tab')
+        return tab
+
+    def add_editor(self, parent, tab, text=''):
+        """
+        :param tab: tab without an editor
+        :return: the new editor of the tab
+        """
+        text_editor = QCodeEditor(parent)
+        text_editor.setPlainText(text)
+        tab.editor = text_editor
+        tab.layout.addWidget(text_editor)
+        return text_editor
+
+    def hibernate_tab(self, index):
+        """
+        frees the editor of the tab with its document, highlighter and undo stack,
+        only the path, the cursor and the scroll position are kept, so the file can be loaded again
+        :param index: index of a tab with an unmodified editor
+        :return:
+        """
+        tab = self.tabWidget.widget(index)
+        editor = tab.editor
+        cursor = editor.textCursor()
+        tab.hibernated = (cursor.anchor(), cursor.position(),
+                          editor.verticalScrollBar().value(), editor.horizontalScrollBar().value())
+        # names of the file are not offered by the completion, until it is loaded again
+        editor.identifiers.close()
+        if tab.highlighter is not None:
+            tab.highlighter.close()
+        self.editorRemoved.emit(editor)
+        tab.layout.removeWidget(editor)
+        editor.deleteLater()
+        tab.editor = None
+        tab.highlighter = None
+        logging.info('Hibernated tab ' + tab.file_path)
+
+    def add_viewer_tab(self, parent, file_path):
+        """
+        opens the file in a read-only LargeFileView
+        :param file_path: path of the file
+        :return: the tab, OSError or ValueError is raised, if the file can't be mapped
+        """
+        viewer = LargeFileView(file_path, parent)
+        tab = self.create_tab(file_path)
+        tab.viewer = viewer
+        tab.encoding = viewer.file.encoding
+        tab.layout.addWidget(viewer)
+        self.tabWidget.addTab(tab, os.path.basename(file_path))
+        logging.info('Added large file tab')
+        return tab
 
     def close_tab(self, currentIndex):
         # TODO: control save operation
         # currentQWidget = self.widget(currentIndex)
         # currentQWidget.deleteLater()
+        tab = self.tabWidget.widget(currentIndex)
+        loader, tab.loader = tab.loader, None
+        if loader is not None:
+            loader.cancel()
+        if tab.viewer is not None:
+            tab.viewer.close_file()
+        editor = self.get_editor_from_tab(currentIndex)
+        if editor is not None:
+            # names of the closed file are not offered by the completion any more
+            editor.identifiers.close()
+            self.editorRemoved.emit(editor)
+        if tab.highlighter is not None:
+            tab.highlighter.close()
         self.tabWidget.removeTab(currentIndex)
         logging.info('Closed tab')
 
+    def find_tab(self, file_path):
+        """
+        :param file_path: path of the file
+        :return: index of the tab with the file or None
+        """
+        file_path = os.path.abspath(file_path)
+        for index in range(self.tabWidget.count()):
+            tab_path = self.tabWidget.widget(index).file_path
+            if tab_path and os.path.abspath(tab_path) == file_path:
+                return index
+        return None
+
     def get_cur_index(self):
         return self.tabWidget.currentIndex()
 
@@ -586,10 +1129,31 @@ class TabView(QWidget):
         except Exception as e:
             logging.error(e)
 
+    def get_viewer_from_tab(self, index):
+        """
+        :return: LargeFileView of the tab or None
+        """
+        tab = self.tabWidget.widget(index)
+        return tab.viewer if tab is not None else None
+
     def set_highlighter(self, index):
+        tab = self.tabWidget.widget(index)
+        if tab.highlighter is not None:
+            language = languages.get_language_for_file(tab.file_path)
+            if language is None or language.name == tab.highlighter.language:
+                # keep the highlighter of the tab and only apply the current theme
+                tab.highlighter.reload_rules()
+                return tab.highlighter
+            # the file has got another language, so the old highlighter is detached
+            tab.highlighter.close()
+            tab.highlighter.setDocument(None)
         editor = self.get_editor_from_tab(index)
-        self.tabWidget.widget(index).highlighter = PythonHighlighter(editor.document())
-        return self.tabWidget.widget(index).highlighter
+        tab.highlighter = create_highlighter(editor.document(), tab.file_path)
+        # visible lines are highlighted first, the rest of the file in the background
+        tab.highlighter.set_editor(editor)
+        editor.language = tab.highlighter.language
+        editor.filePath = tab.file_path
+        return tab.highlighter
 
     def get_tabs(self):
         return self.tabWidget.count()
@@ -1 +1,476 @@
-# create unittests or (preferable) Pytests
+# -*- coding: utf-8 -*-
+# Pytests, run them from the root of the repository: python -m pytest -q tests.py
+
+import codecs
+from concurrent.futures import Future
+import os
+import re
+import threading
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtCore import QEvent, Qt
+from PyQt5.QtGui import QSyntaxHighlighter, QTextCursor, QTextDocument
+from PyQt5.QtWidgets import QApplication, QPlainTextDocumentLayout, QPlainTextEdit
+from PyQt5 import sip
+import pytest
+
+from pyvicky import file_search, find, find_in_files, highlighter, large_file, loader, saver, term_search, \
+    trigram_index
+from pyvicky import completion
+from pyvicky.completion import JediCompletion
+from pyvicky.find_terms import FindTerms
+from pyvicky.numberbar import QCodeEditor
+from pyvicky.window import Window
+
+# Settings and themes are read by paths relative to the root of the repository
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    return QApplication.instance() or QApplication([])
+
+
+@pytest.fixture
+def window(app):
+    window = Window(900, 800, '')
+    yield window
+    # close() would ask about the unsaved tabs
+    window.hide()
+    window.deleteLater()
+    QApplication.processEvents()
+
+
+def wait_until(condition, timeout=10):
+    """
+    runs the event loop, until the condition is true
+    """
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, 'timed out'
+        QApplication.processEvents()
+        time.sleep(0.001)
+
+
+class CountingHighlighter(highlighter.PythonHighlighter):
+    """
+    counts the blocks, Qt asks it to highlight
+    """
+    def __init__(self, *args, **kwargs):
+        self.calls = 0
+        super(CountingHighlighter, self).__init__(*args, **kwargs)
+
+    def highlightBlock(self, text):
+        self.calls += 1
+        super(CountingHighlighter, self).highlightBlock(text)
+
+
+def make_document(lines):
+    """
+    :return: QTextDocument with the lines, highlighted completely, and its highlighter
+    """
+    document = QTextDocument()
+    # the document tells about its changes only with a layout, QPlainTextEdit gives it this one
+    document.setDocumentLayout(QPlainTextDocumentLayout(document))
+    document.setPlainText('\n'.join(lines))
+    counter = CountingHighlighter(document, language='python')
+    # a new highlighter formats the document in the event loop and ignores the changes until then
+    QApplication.processEvents()
+    assert counter.calls == len(lines)
+    counter.calls = 0
+    return document, counter
+
+
+def insert_text(document, line, column, text):
+    cursor = QTextCursor(document.findBlockByNumber(line))
+    cursor.setPosition(cursor.position() + column)
+    cursor.insertText(text)
+
+
+def run_now(function, *args):
+    """
+    runs the function at once instead of in a pool
+    :return: finished Future with its result
+    """
+    future = Future()
+    future.set_result(function(*args))
+    return future
+
+
+def test_trigram_index_keeps_matches_across_lines(tmp_path):
+    root = tmp_path / 'project'
+    root.mkdir()
+    (root / 'match.py').write_bytes(b'x = foo\nbar = 1\n')
+    (root / 'other.py').write_bytes(b'foo = bar\n')
+    index = trigram_index.TrigramIndex(str(root), cache_directory=str(tmp_path / 'cache'))
+    assert index.update(lambda batch, source, flags: run_now(trigram_index.index_files, batch, source, flags)) == 2
+
+    source, flags = file_search.make_pattern(r'foo\nbar', regex=True)
+    found = file_search.search_files(index.candidates(source, flags), source, flags)
+    assert [os.path.basename(path) for path, matches in found] == ['match.py']
+    # a literal line end splits the trigrams, but the literals on both sides still narrow the files
+    source, flags = file_search.make_pattern('x = foo\nbar = 1', regex=True)
+    assert [os.path.basename(path) for path in index.candidates(source, flags)] == ['match.py']
+    index.close()
+
+
+def test_write_atomic_keeps_the_mode(tmp_path):
+    new_path = tmp_path / 'new.txt'
+    file_search.write_atomic(str(new_path), b'new')
+    assert new_path.stat().st_mode & 0o777 == 0o666 & ~file_search.UMASK
+
+    old_path = tmp_path / 'old.sh'
+    old_path.write_bytes(b'old')
+    old_path.chmod(0o751)
+    file_search.write_atomic(str(old_path), [b'ne', b'w'])
+    assert old_path.read_bytes() == b'new'
+    assert old_path.stat().st_mode & 0o777 == 0o751
+    assert sorted(os.listdir(str(tmp_path))) == ['new.txt', 'old.sh']
+
+
+
+@pytest.mark.parametrize('head, encoding, bom', [
+    (b'\xff\xfe\x00\x00a\x00\x00\x00', 'utf-32-le', b'\xff\xfe\x00\x00'),
+    (b'\xff\xfea\x00', 'utf-16-le', b'\xff\xfe'),
+    (b'\xfe\xff\x00a', 'utf-16-be', b'\xfe\xff'),
+    (b'\xef\xbb\xbfa', 'utf-8', b'\xef\xbb\xbf'),
+    ('caf\u00e9'.encode('utf-8'), 'utf-8', b''),
+    # a character cut at the end of the head
+    ('caf\u00e9'.encode('utf-8')[:-1], 'utf-8', b''),
+    ('caf\u00e9 ok'.encode('latin-1'), 'latin-1', b''),
+    (b'', 'utf-8', b''),
+])
+def test_detect_encoding(head, encoding, bom):
+    assert loader.detect_encoding(head) == (encoding, bom)
+
+
+@pytest.mark.parametrize('text, newline', [
+    ('a\r\nb\n', '\r\n'), ('a\rb\r\n', '\r'), ('a\nb\r\n', '\n'), ('no line end', '\n'), ('a\r', '\r'),
+])
+def test_detect_newline(text, newline):
+    assert loader.detect_newline(text) == newline
+
+
+@pytest.mark.parametrize('data, text, encoding, bom, newline', [
+    ('caf\u00e9\r\nx\r\n'.encode('utf-8'), 'caf\u00e9\nx\n', 'utf-8', b'', '\r\n'),
+    # a byte, which isn't UTF-8, after the sniffed head
+    (b'a' * 20 + b'caf\xe9\rx', 'a' * 20 + 'caf\u00e9\nx', 'latin-1', b'', '\r'),
+    (codecs.BOM_UTF16_LE + 'a\r\nb'.encode('utf-16-le'), 'a\nb', 'utf-16-le', codecs.BOM_UTF16_LE, '\r\n'),
+    (b'no line end', 'no line end', 'utf-8', b'', os.linesep),
+])
+def test_read_text_and_file_loader(app, tmp_path, monkeypatch, data, text, encoding, bom, newline):
+    # '\r\n' and the characters are split by the chunks, the bad byte is after the sniffed head
+    monkeypatch.setattr(loader, 'SNIFF_SIZE', 8)
+    monkeypatch.setattr(loader, 'CHUNK_SIZE', 3)
+    path = tmp_path / 'loaded.txt'
+    path.write_bytes(data)
+    assert loader.read_text(str(path)) == (text, encoding, bom, newline)
+
+    document = QTextDocument()
+    file_loader = loader.FileLoader(str(path), document)
+    loaded = []
+    file_loader.loaded.connect(lambda: loaded.append(True))
+    file_loader.start()
+    wait_until(lambda: loaded)
+    assert (document.toPlainText(), file_loader.encoding, file_loader.bom, file_loader.newline) == \
+        (text, encoding, bom, newline)
+    assert document.isUndoRedoEnabled() and not document.isModified()
+
+
+@pytest.mark.parametrize('lines, block_size', [
+    # long lines, less than LINE_STEP of them in a block
+    ([b'x' * 16000 for _ in range(5)], 1 << 17),
+    # small blocks, so that the steps of the index cross them
+    ([b'line %d' % i + b'\r' * (i % 3) for i in range(1000)], 1000),
+    ([b'', b'', b'after empty lines'] * 50, 100),
+])
+def test_build_index_finds_every_line(tmp_path, monkeypatch, lines, block_size):
+    monkeypatch.setattr(large_file, 'INDEX_BLOCK_SIZE', block_size)
+    path = tmp_path / 'large.txt'
+    # the last line has no line end
+    path.write_bytes(b'\n'.join(lines))
+    mapped = large_file.MappedFile(str(path))
+    start = time.perf_counter()
+    mapped.build_index()
+    assert time.perf_counter() - start < 1
+    assert mapped.complete
+    assert mapped.line_count() == len(lines)
+    assert mapped.indexed[1] == path.stat().st_size
+    starts = [0]
+    for line in lines[:-1]:
+        starts.append(starts[-1] + len(line) + 1)
+    assert list(mapped.offsets) == starts[::large_file.LINE_STEP]
+    assert [mapped.line_start(line) for line in range(len(lines))] == starts
+    mapped.close()
+
+
+def test_replace_files_follows_links(tmp_path):
+    target = tmp_path / 'target.py'
+    target.write_bytes(b'old = 1\n')
+    link = tmp_path / 'link.py'
+    link.symlink_to(target)
+    source, flags = file_search.make_pattern('old')
+    data, signature = file_search.read_text_file(str(link))
+    assert file_search.replace_files([(str(link), signature)], source, flags, b'new', False) == \
+        [(str(link), 1, None)]
+    assert link.is_symlink()
+    assert target.read_bytes() == b'new = 1\n'
+
+
+def test_edit_inside_docstring_highlights_one_block(app):
+    code = ['def f(x):', '    return (x +', '            1)']
+    lines = ['"""'] + ['docstring line {}'.format(i) for i in range(5000)] + ['"""'] + code * 30
+    document, counter = make_document(lines)
+    assert document.blockCount() == len(lines)
+
+    # text, brackets and quotes inside the docstring, code, which keeps the open brackets of the line
+    for line, column, text in [(2500, 0, 'x'), (2500, 3, '('), (2500, 5, "'"), (1, 0, '\\'),
+                               (5002, 4, 'y'), (5003, 15, ' [y]'), (5004, 12, '2 * ')]:
+        counter.calls = 0
+        insert_text(document, line, column, text)
+        # the state at the end of the edited block is unchanged, so Qt stops after it
+        assert 1 <= counter.calls <= 2, (line, text)
+
+    counter.calls = 0
+    # closing the docstring early changes the state of every following block
+    insert_text(document, 10, 0, '"""')
+    assert counter.calls > 4990
+
+
+def test_theme_changes_reuse_the_rules(app, tmp_path, monkeypatch):
+    with open(highlighter.SETTINGS_PATH) as f:
+        settings = f.read()
+    # settings.ini uses mint, so the first change switches the theme
+    themes = ['pyvicky/configs/themes/abyss.ini', 'pyvicky/configs/themes/mint.ini']
+    settings_paths = []
+    for i, theme in enumerate(themes):
+        path = tmp_path / 'settings{}.ini'.format(i)
+        path.write_text(''.join('theme = {}\n'.format(theme) if line.startswith('theme =') else line
+                                for line in settings.splitlines(True)))
+        settings_paths.append(str(path))
+
+    document, counter = make_document(['def f(x):', '    """docstring"""', '    return x + 1  # comment'] * 300)
+    rules, patterns, times = {}, set(), []
+    for change in range(20):
+        monkeypatch.setattr(highlighter, 'SETTINGS_PATH', settings_paths[change % 2])
+        counter.calls = 0
+        start = time.perf_counter()
+        assert counter.reload_rules()
+        times.append(time.perf_counter() - start)
+        # every theme change reformats each block once, with a rule set, which is built once per theme
+        assert counter.calls == document.blockCount()
+        assert rules.setdefault(change % 2, counter.rules) is counter.rules
+        assert len(counter.rules.formats) == 7
+        patterns.add(counter.rules.tokenizer.regex.pattern)
+        assert len(document.findChildren(QSyntaxHighlighter)) == 1
+
+    assert len(patterns) == 1
+    assert len([key for key in highlighter.rule_sets if key[0] == 'python' and key[1] in themes]) == 2
+    # the cost of a reformat doesn't grow with the number of theme changes
+    assert min(times[-4:]) <= 3 * max(times[:4])
+
+
+def test_gutter_margins_change_only_with_the_digits(app):
+    editor = QCodeEditor()
+    editor.setPlainText('\n'.join('line {}'.format(i) for i in range(5000)))
+    editor.resize(600, 400)
+    editor.show()
+    app.processEvents()
+    margins = []
+    set_margins = editor.setViewportMargins
+    editor.setViewportMargins = lambda *args: (margins.append(args), set_margins(*args))
+
+    scrollBar = editor.verticalScrollBar()
+    cursor = editor.cursorForPosition(editor.viewport().rect().center())
+    for _ in range(50):
+        scrollBar.setValue(scrollBar.value() + 3)
+        cursor.insertText('x\n')
+        app.processEvents()
+    assert margins == []
+
+    # 9,999 -> 10,000 lines adds a digit
+    cursor.insertText('\n' * (9999 - editor.blockCount()))
+    app.processEvents()
+    assert margins == []
+    cursor.insertText('\n')
+    app.processEvents()
+    assert len(margins) == 1
+    assert editor.lineNumberArea.width() == editor.lineNumberAreaWidth()
+    editor.close()
+
+
+def test_replace_all_is_one_undo_step(app):
+    # adjacent words, words at the ends of lines and a character outside of the BMP before them
+    text = '\n'.join(['foo foo_x foo', '\U0001f600 foo(foo)', 'xfoo foo'] * 1000)
+    editor = QPlainTextEdit()
+    editor.setPlainText(text)
+    document = editor.document()
+    document.clearUndoRedoStacks()
+    pattern = find.compile_query('foo', whole_words=True)
+    assert find.replace_spans(editor, find.match_spans(text, pattern), 'bar') == 5000
+    assert editor.toPlainText() == text.replace('foo foo_x foo', 'bar foo_x bar') \
+        .replace('foo(foo)', 'bar(bar)').replace('xfoo foo', 'xfoo bar')
+
+    document.undo()
+    assert editor.toPlainText() == text
+    assert not document.isUndoAvailable()
+
+
+def test_encode_text_writes_both_line_separators(app):
+    document = QTextDocument()
+    document.setPlainText('first\nsecond')
+    # Shift+Enter breaks a line inside of the block with U+2028
+    insert_text(document, 0, 2, '\u2028')
+    assert document.blockCount() == 2
+    data = b''.join(saver.encode_text(document.toRawText(), 'utf-8', b'\xef\xbb\xbf', '\r\n'))
+    assert data == b'\xef\xbb\xbffi\r\nrst\r\nsecond'
+    assert data[3:].decode() == document.toPlainText().replace('\n', '\r\n')
+
+
+def test_search_pool_failures_end_the_replacement(app, tmp_path):
+    (tmp_path / 'a.py').write_bytes(b'foo = 1\n')
+    source, flags = file_search.make_pattern('foo')
+    pool = find_in_files.get_search_pool()
+    # the workers are not forked from the editor with its Qt threads
+    assert pool._mp_context.get_start_method() != 'fork'
+    found = []
+    searched = find_in_files.walk_and_search(pool, str(tmp_path), file_search.search_files, (source, flags),
+                                             threading.Event(), found.extend)
+    assert searched == 1
+    assert [os.path.basename(path) for path, matches in found] == ['a.py']
+
+    # a pool, which was shut down meanwhile, fails the replacement instead of the thread
+    find_in_files.stop_search_pool()
+    panel = find_in_files.FindInFiles(None)
+    panel.run_batches(pool, panel.replaceGeneration, file_search.preview_replace, [str(tmp_path / 'a.py')],
+                      (source, flags, 'bar', False), [], panel.previewReady)
+    assert panel.statusLabel.text() == 'Replacement failed, see the log'
+
+    # only the failed pool is dropped, not a new one
+    new_pool = find_in_files.get_search_pool()
+    find_in_files.stop_search_pool(pool)
+    assert find_in_files.search_pool is new_pool
+    find_in_files.stop_search_pool()
+
+
+def test_find_terms_counts_the_tab_in_a_thread(window, monkeypatch):
+    tab = window.tabWidget.add_tab(window, 'terms', 'foo bar\nbaz foo\n' * 1000)
+    window.tabWidget.tabWidget.setCurrentWidget(tab)
+    threads = []
+    count_terms = term_search.count_terms
+
+    def counting(*args):
+        threads.append(threading.current_thread())
+        return count_terms(*args)
+
+    monkeypatch.setattr(term_search, 'count_terms', counting)
+    # the cancel is checked after every line
+    monkeypatch.setattr(term_search, 'TERM_WINDOW', 1)
+    dialog = FindTerms(window)
+    dialog.termsField.setPlainText('foo\nbaz\nnone')
+    dialog.search()
+    assert dialog.statusLabel.text() == 'Searching...'
+    wait_until(lambda: dialog.statusLabel.text() != 'Searching...')
+    assert threads and threading.main_thread() not in threads
+    assert dialog.counts == {'foo': [2000, 1, 50], 'baz': [1000, 1, 50], 'none': [0, 0, 0]}
+    assert dialog.items['foo'].child(1).data(0, Qt.UserRole) == (None, 2, 4)
+
+    stopped = threading.Event()
+    stopped.set()
+    source, flags, keys = term_search.make_terms_pattern(['foo'])
+    assert count_terms('foo\n' * 10, re.compile(source, flags), keys, False, stopped) is None
+    # the results of a stopped search are not shown
+    dialog.search()
+    dialog.stop()
+    time.sleep(0.1)
+    QApplication.processEvents()
+    assert dialog.statusLabel.text() == 'Stopped'
+    assert dialog.counts['foo'] == [0, 0, 0]
+
+
+def test_jedi_requests_of_a_deleted_editor_are_dropped(app):
+    jedi = JediCompletion()
+    editor = QCodeEditor()
+    editor.setPlainText('import os\nos.')
+    jedi.request(editor, '')
+    # a request was sent and the next one waits for the pause in typing
+    jedi.latest = (1, editor, 12, '')
+    jedi.request(editor, '')
+    editor.deleteLater()
+    QApplication.sendPostedEvents(None, QEvent.DeferredDelete)
+    assert sip.isdeleted(editor)
+    assert jedi.pending is None and jedi.latest is None
+    assert not jedi.timer.isActive()
+
+    # a request, which is sent after the editor is deleted, is dropped without the worker
+    jedi.pending = (editor, 12, '')
+    jedi.send()
+    assert jedi.process is None
+
+
+def test_hibernated_tab_wakes_up_with_its_view(window, tmp_path, monkeypatch):
+    path = tmp_path / 'hibernated.py'
+    text = '\n'.join('line {} '.format(i) + 'x' * (i % 30) for i in range(3000))
+    path.write_text(text)
+    tab = window.open_file(str(path))
+    wait_until(lambda: tab.loader is None)
+    editor = tab.editor
+    editor.resize(400, 300)
+    cursor = editor.textCursor()
+    cursor.setPosition(20000)
+    cursor.setPosition(20010, QTextCursor.KeepAnchor)
+    editor.setTextCursor(cursor)
+    editor.verticalScrollBar().setValue(1500)
+    view = (cursor.anchor(), cursor.position(), editor.verticalScrollBar().value(),
+            editor.horizontalScrollBar().value())
+    assert view[:3] == (20000, 20010, 1500)
+
+    # the dialogs and the completion hold the editor
+    find_dialog = find.Find(window)
+    find_dialog.searchStart = (editor, 0)
+    terms_dialog = FindTerms(window)
+    terms_dialog.editor = editor
+    jedi = JediCompletion()
+    monkeypatch.setattr(completion, 'jedi_completion', jedi)
+    jedi.request(editor, '')
+
+    other = window.tabWidget.add_tab(window, 'other')
+    window.tabWidget.tabWidget.setCurrentWidget(other)
+    window.tabWidget.hibernate_tab(window.tabWidget.tabWidget.indexOf(tab))
+    assert tab.editor is None and tab.hibernated == view
+    assert find_dialog.searchStart is None and terms_dialog.editor is None and jedi.pending is None
+    QApplication.sendPostedEvents(None, QEvent.DeferredDelete)
+    assert sip.isdeleted(editor)
+
+    window.tabWidget.tabWidget.setCurrentWidget(tab)
+    wait_until(lambda: tab.editor is not None and tab.loader is None)
+    QApplication.processEvents()
+    editor = tab.editor
+    assert editor.toPlainText() == text
+    assert not editor.isReadOnly()
+    assert (editor.textCursor().anchor(), editor.textCursor().position(), editor.verticalScrollBar().value(),
+            editor.horizontalScrollBar().value()) == view
+
+
+def test_open_files_creates_the_tabs_in_order(window, tmp_path, monkeypatch):
+    names = ['b.py', 'missing.py', 'a.txt', 'c.py']
+    for name in names:
+        if name != 'missing.py':
+            (tmp_path / name).write_text('text of {}\n'.format(name))
+    updates = []
+    monkeypatch.setattr(window, 'update_ui', lambda: updates.append(True))
+    existing = window.tabWidget.get_tabs()
+    window.open_files([str(tmp_path / name) for name in names])
+    wait_until(lambda: window.tabWidget.get_tabs() == existing + len(names))
+    QApplication.processEvents()
+
+    tabs = [window.tabWidget.tabWidget.widget(index) for index in range(existing, existing + len(names))]
+    assert [os.path.basename(tab.file_path) for tab in tabs] == names
+    assert updates == [True]
+    assert [tab.editor.toPlainText() for tab in tabs] == ['text of b.py\n', '', 'text of a.txt\n', 'text of c.py\n']
+    # the path, which doesn't exist, is a new file, the last tab is shown
+    assert not os.path.exists(tabs[1].file_path)
+    assert window.tabWidget.tabWidget.currentWidget() is tabs[-1]